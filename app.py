@@ -2,7 +2,7 @@ import streamlit as st
 import os
 
 try:
-    from event_llm_core import generate_titles, generate_description, generate_flyer_image, generate_banner_image, generate_faqs, generate_refund_policy, fuzzy_correct, get_global_analytics, reset_analytics
+    from event_llm_core import generate_titles, generate_description, generate_flyer_image, generate_banner_image, generate_faqs, generate_refund_policy, iter_event_package, fuzzy_correct, get_global_analytics, reset_analytics, suggest_optimal_settings, CATEGORY_OPTIONS, EVENT_TYPE_OPTIONS, TONE_OPTIONS
 except Exception as e:
     st.error("**Configuration Error**")
     st.error("OpenAI API key is missing or invalid.")
@@ -27,6 +27,9 @@ except Exception as e:
 
 st.set_page_config(page_title="EC - 172", layout="wide")
 
+GENERATION_TIMEOUT = float(os.getenv("APP_GENERATION_TIMEOUT", "60")) or None
+IMAGE_GENERATION_TIMEOUT = float(os.getenv("APP_IMAGE_TIMEOUT", "180")) or None
+
 st.markdown("""
 <style>
 section.main > div:first-child {background: #f8fafc; border-radius: 12px; padding: 2rem 2rem 1rem 2rem; box-shadow: 0 2px 8px #0001;}
@@ -78,55 +81,6 @@ def get_optimization_tip(category, event_type, tone):
     
     return f"{tone} {event_type}s in {category} perform best when titles clearly communicate the unique value and target outcome."
 
-def suggest_optimal_settings(category, event_type):
-    suggestions = {
-        ("Technology", "Conference"): {"tone": "Professional", "titles": 5, "desc_length": 1200},
-        ("Technology", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 800},
-        ("Technology", "Seminar"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
-        ("Technology", "Webinar"): {"tone": "Innovative", "titles": 4, "desc_length": 900},
-        ("Technology", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1100},
-        ("Technology", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
-        ("Business", "Conference"): {"tone": "Professional", "titles": 5, "desc_length": 1400},
-        ("Business", "Workshop"): {"tone": "Formal", "titles": 4, "desc_length": 900},
-        ("Business", "Seminar"): {"tone": "Formal", "titles": 3, "desc_length": 1000},
-        ("Business", "Webinar"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
-        ("Business", "Festival"): {"tone": "Professional", "titles": 4, "desc_length": 1200},
-        ("Business", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1100},
-        ("Education", "Conference"): {"tone": "Innovative", "titles": 5, "desc_length": 1400},
-        ("Education", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 900},
-        ("Education", "Seminar"): {"tone": "Innovative", "titles": 4, "desc_length": 1100},
-        ("Education", "Webinar"): {"tone": "Creative", "titles": 5, "desc_length": 1000},
-        ("Education", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1200},
-        ("Education", "Exhibition"): {"tone": "Innovative", "titles": 4, "desc_length": 1000},
-        ("Health", "Conference"): {"tone": "Professional", "titles": 4, "desc_length": 1300},
-        ("Health", "Workshop"): {"tone": "Friendly", "titles": 4, "desc_length": 900},
-        ("Health", "Seminar"): {"tone": "Professional", "titles": 3, "desc_length": 800},
-        ("Health", "Webinar"): {"tone": "Friendly", "titles": 4, "desc_length": 900},
-        ("Health", "Festival"): {"tone": "Friendly", "titles": 5, "desc_length": 1100},
-        ("Health", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
-        ("Entertainment", "Conference"): {"tone": "Creative", "titles": 4, "desc_length": 1100},
-        ("Entertainment", "Workshop"): {"tone": "Casual", "titles": 4, "desc_length": 800},
-        ("Entertainment", "Seminar"): {"tone": "Creative", "titles": 3, "desc_length": 900},
-        ("Entertainment", "Webinar"): {"tone": "Casual", "titles": 4, "desc_length": 800},
-        ("Entertainment", "Festival"): {"tone": "Casual", "titles": 5, "desc_length": 1000},
-        ("Entertainment", "Exhibition"): {"tone": "Creative", "titles": 5, "desc_length": 1100},
-        ("Sports", "Conference"): {"tone": "Professional", "titles": 4, "desc_length": 1200},
-        ("Sports", "Workshop"): {"tone": "Professional", "titles": 4, "desc_length": 900},
-        ("Sports", "Seminar"): {"tone": "Professional", "titles": 3, "desc_length": 800},
-        ("Sports", "Webinar"): {"tone": "Professional", "titles": 4, "desc_length": 900},
-        ("Sports", "Festival"): {"tone": "Casual", "titles": 5, "desc_length": 1100},
-        ("Sports", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
-        ("Arts & Culture", "Conference"): {"tone": "Creative", "titles": 4, "desc_length": 1200},
-        ("Arts & Culture", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 900},
-        ("Arts & Culture", "Seminar"): {"tone": "Creative", "titles": 3, "desc_length": 900},
-        ("Arts & Culture", "Webinar"): {"tone": "Creative", "titles": 4, "desc_length": 800},
-        ("Arts & Culture", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1200},
-        ("Arts & Culture", "Exhibition"): {"tone": "Creative", "titles": 5, "desc_length": 1100}
-    }
-    
-    key = (category, event_type)
-    return suggestions.get(key, {"tone": "Professional", "titles": 3, "desc_length": 800})
-
 def get_combined_context():
     if not st.session_state.master_context and not st.session_state.context_updates:
         return None
@@ -212,6 +166,9 @@ def initialize_session_state():
         'flyer_logs': None,
         'faq_logs': None,
         'refund_logs': None,
+        'banner_image_url': "",
+        'banner_logs': None,
+        'package_timings': None,
         'master_context': "",
         'context_updates': []
     }
@@ -222,10 +179,6 @@ def initialize_session_state():
 
 initialize_session_state()
 
-CATEGORY_OPTIONS = ["Select event category", "Technology", "Business", "Education", "Health", "Entertainment", "Sports", "Arts & Culture", "Other"]
-EVENT_TYPE_OPTIONS = ["Select event type", "Conference", "Workshop", "Seminar", "Webinar", "Festival", "Exhibition", "Meetup", "Other"]
-TONE_OPTIONS = ["Select tone of event", "Professional", "Casual", "Formal", "Creative", "Premium", "Innovative", "Friendly", "Corporate", "Other"]
-
 st.markdown("## Title Generation")
 
 col1, col2, col3 = st.columns(3)
@@ -294,8 +247,11 @@ if generate_titles_btn:
                 final_tone,
                 num_titles,
                 combined_context,
-                cost_mode
+                cost_mode,
+                timeout=GENERATION_TIMEOUT
             )
+            if logs.get("Deadline fallback"):
+                st.warning(f"Generation took too long - showing {logs['Deadline fallback']}.")
             st.session_state.generated_titles = titles
             st.session_state.title_logs = logs
         except Exception as e:
@@ -453,6 +409,12 @@ if st.session_state.get("final_title"):
         with st.spinner("Generating description with advanced prompt engineering..."):
             try:
                 combined_context = get_combined_context()
+                partial_box = st.empty()
+                partial_text = []
+                
+                def show_partial_description(chunk):
+                    partial_text.append(chunk)
+                    partial_box.markdown(f'<div class="description-box">{"".join(partial_text)}</div>', unsafe_allow_html=True)
                 
                 description, logs = generate_description(
                     desc_title,
@@ -461,8 +423,13 @@ if st.session_state.get("final_title"):
                     final_desc_tone,
                     combined_context,
                     max_chars,
-                    desc_cost_mode
+                    desc_cost_mode,
+                    on_chunk=show_partial_description,
+                    timeout=GENERATION_TIMEOUT
                 )
+                partial_box.empty()
+                if logs.get("Deadline fallback"):
+                    st.warning(f"Generation took too long - showing {logs['Deadline fallback']}.")
                 st.session_state.description = description
                 st.session_state.desc_logs = logs
             except Exception as e:
@@ -514,6 +481,72 @@ if st.session_state.get("final_title"):
                 st.session_state.final_description = custom_desc
                 st.success(f"Using custom description ({len(custom_desc)} characters)")
 
+if st.session_state.get("final_title") and st.session_state.get("final_description"):
+    st.markdown("## Full Event Package")
+    st.info("Generate FAQs, refund policy, flyer and banner at the same time from the title and description above. Each result appears as soon as it is ready.")
+    
+    package_cost_mode = st.selectbox("Package Cost Mode", ["balanced", "economy", "premium"], key="package_cost_mode")
+    generate_package_btn = st.button("Generate Full Package", key="generate_package_btn")
+    
+    if generate_package_btn:
+        package_category = st.session_state.get("custom_title_category") if st.session_state.get("title_category") == "Other" else st.session_state.get("title_category")
+        package_event_type = st.session_state.get("custom_title_event_type") if st.session_state.get("title_event_type") == "Other" else st.session_state.get("title_event_type")
+        package_tone = st.session_state.get("custom_title_tone") if st.session_state.get("title_tone") == "Other" else st.session_state.get("title_tone")
+        stage_labels = {"faqs": "FAQs", "refund_policy": "Refund Policy", "flyer": "Flyer", "banner": "Banner"}
+        stage_status = {stage: st.empty() for stage in stage_labels}
+        for stage, label in stage_labels.items():
+            stage_status[stage].info(f"{label}: generating...")
+        
+        package_timings = {}
+        try:
+            for stage, artifact, logs, timing in iter_event_package(
+                package_category,
+                package_event_type,
+                package_tone,
+                get_combined_context(),
+                package_cost_mode,
+                title=st.session_state.final_title,
+                description=st.session_state.final_description,
+                stages=list(stage_labels),
+                image_output="path",
+                timeout=IMAGE_GENERATION_TIMEOUT
+            ):
+                if timing is not None:
+                    package_timings[stage_labels[stage]] = timing["seconds"]
+                if not artifact:
+                    stage_status[stage].error(f"{stage_labels[stage]}: failed - {logs.get('error', 'no result')}")
+                    continue
+                if stage == "faqs":
+                    st.session_state.faqs = artifact
+                    st.session_state.faq_logs = logs
+                elif stage == "refund_policy":
+                    st.session_state.refund_policy = artifact
+                    st.session_state.refund_logs = logs
+                elif stage == "flyer":
+                    st.session_state.flyer_image_url = artifact
+                    st.session_state.flyer_logs = logs
+                    st.session_state.visual_type_generated = "flyer"
+                else:
+                    st.session_state.banner_image_url = artifact
+                    st.session_state.banner_logs = logs
+                stage_status[stage].success(f"{stage_labels[stage]}: ready in {timing['seconds']}s")
+            st.session_state.package_timings = package_timings
+        except Exception as e:
+            st.error(f"Error generating event package: {str(e)}")
+    
+    if st.session_state.get("package_timings"):
+        st.markdown("### Package Stage Timings:")
+        timing_cols = st.columns(len(st.session_state.package_timings))
+        for col, (label, seconds) in zip(timing_cols, st.session_state.package_timings.items()):
+            col.metric(label, f"{seconds}s")
+    
+    banner_data = st.session_state.get("banner_image_url")
+    if banner_data and os.path.exists(banner_data):
+        st.markdown("### Generated Banner:")
+        st.image(banner_data, use_container_width=True)
+        with open(banner_data, 'rb') as image_file:
+            st.download_button("Download Banner", image_file, file_name="event_banner.png", mime="image/png", key="download_package_banner_btn")
+
 if st.session_state.get("final_title"):
     st.markdown("## Visual Content Generation")
     
@@ -619,7 +652,9 @@ if st.session_state.get("final_title"):
                         final_visual_tone,
                         combined_context,
                         visual_cost_mode,
-                        visual_image_size.split()[0]
+                        visual_image_size.split()[0],
+                        output="path",
+                        timeout=IMAGE_GENERATION_TIMEOUT
                     )
                 else:
                     image_url, visual_logs = generate_banner_image(
@@ -630,7 +665,9 @@ if st.session_state.get("final_title"):
                         final_visual_tone,
                         combined_context,
                         visual_cost_mode,
-                        visual_image_size.split()[0]
+                        visual_image_size.split()[0],
+                        output="path",
+                        timeout=IMAGE_GENERATION_TIMEOUT
                     )
                 
                 if image_url and (isinstance(image_url, bytes) and len(image_url) > 0) or (isinstance(image_url, str) and image_url.strip()):
@@ -656,6 +693,10 @@ if st.session_state.get("final_title"):
             image_buffer = io.BytesIO(image_data)
             st.image(image_buffer, use_container_width=True)
             st.download_button(f"Download {visual_type_display}", image_data, file_name=f"event_{st.session_state.get('visual_type_generated', 'visual')}.png", mime="image/png")
+        elif os.path.exists(image_data):
+            st.image(image_data, use_container_width=True)
+            with open(image_data, 'rb') as image_file:
+                st.download_button(f"Download {visual_type_display}", image_file, file_name=f"event_{st.session_state.get('visual_type_generated', 'visual')}.png", mime="image/png")
         else:
             st.image(image_data, use_container_width=True)
             st.download_button(f"Download {visual_type_display}", image_data, file_name=f"event_{st.session_state.get('visual_type_generated', 'visual')}.png")
@@ -730,6 +771,12 @@ if st.session_state.get("final_title"):
         with st.spinner("Generating FAQs with advanced prompt engineering..."):
             try:
                 combined_context = get_combined_context()
+                partial_box = st.empty()
+                partial_text = []
+                
+                def show_partial_faqs(chunk):
+                    partial_text.append(chunk)
+                    partial_box.text("".join(partial_text))
                 
                 faqs, faq_logs = generate_faqs(
                     faq_title,
@@ -738,8 +785,11 @@ if st.session_state.get("final_title"):
                     final_faq_event_type,
                     final_faq_tone,
                     combined_context,
-                    faq_cost_mode
+                    faq_cost_mode,
+                    on_chunk=show_partial_faqs,
+                    timeout=GENERATION_TIMEOUT
                 )
+                partial_box.empty()
                 st.session_state.faqs = faqs
                 st.session_state.faq_logs = faq_logs
             except Exception as e:
@@ -863,6 +913,12 @@ if st.session_state.get("final_title"):
         with st.spinner("Generating refund policy with advanced prompt engineering..."):
             try:
                 combined_context = get_combined_context()
+                partial_box = st.empty()
+                partial_text = []
+                
+                def show_partial_refund_policy(chunk):
+                    partial_text.append(chunk)
+                    partial_box.markdown("".join(partial_text))
                 
                 refund_policy, refund_logs = generate_refund_policy(
                     refund_title,
@@ -871,8 +927,11 @@ if st.session_state.get("final_title"):
                     final_refund_event_type,
                     final_refund_tone,
                     combined_context,
-                    refund_cost_mode
+                    refund_cost_mode,
+                    on_chunk=show_partial_refund_policy,
+                    timeout=GENERATION_TIMEOUT
                 )
+                partial_box.empty()
                 st.session_state.refund_policy = refund_policy
                 st.session_state.refund_logs = refund_logs
             except Exception as e:
@@ -0,0 +1,206 @@
+from event_llm_core import generate_event_package, get_global_analytics, enable_batching, EVENT_PACKAGE_GRAPH
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import argparse
+import json
+import os
+import time
+
+def load_journal(journal_path):
+    # The watermark advances over every journaled line, done, failed or skipped,
+    # so the sets stay small; failed lines are tracked separately and retried.
+    watermark = 0
+    settled = set()
+    failed = set()
+    skipped = 0
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                line_number = entry.get("line", 0)
+                if entry.get("status") == "done":
+                    failed.discard(line_number)
+                elif entry.get("status") == "skipped":
+                    failed.discard(line_number)
+                    skipped += 1
+                elif entry.get("status") == "failed":
+                    failed.add(line_number)
+                else:
+                    continue
+                if line_number > watermark:
+                    settled.add(line_number)
+                    while watermark + 1 in settled:
+                        watermark += 1
+                        settled.remove(watermark)
+    return watermark, settled - failed, failed, skipped
+
+def read_specs(input_path, watermark, done, failed):
+    # Blank lines are yielded as None so they get journaled and the watermark
+    # can move past them.
+    with open(input_path) as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number not in failed and (line_number <= watermark or line_number in done):
+                continue
+            yield line_number, line if line.strip() else None
+
+def run_spec(line_number, line, defaults):
+    start = time.time()
+    try:
+        spec = json.loads(line)
+    except ValueError as e:
+        return {"line": line_number, "id": None, "status": "failed", "errors": {"input": f"Invalid JSON: {e}"}}
+    if not isinstance(spec, dict):
+        return {"line": line_number, "id": None, "status": "failed", "errors": {"input": "Spec must be a JSON object"}}
+
+    item_id = spec.get("id", line_number)
+    missing = [field for field in ("category", "event_type", "tone") if not str(spec.get(field) or "").strip()]
+    if missing:
+        return {"line": line_number, "id": item_id, "status": "failed", "errors": {"input": f"Missing required fields: {', '.join(missing)}"}}
+    stages = spec.get("stages", defaults["stages"])
+    unknown = [stage for stage in stages if stage not in EVENT_PACKAGE_GRAPH]
+    if unknown:
+        return {"line": line_number, "id": item_id, "status": "failed", "errors": {"input": f"Unknown stages: {', '.join(unknown)}"}}
+
+    package, logs = generate_event_package(
+        spec["category"],
+        spec["event_type"],
+        spec["tone"],
+        spec.get("context"),
+        spec.get("cost_mode", defaults["cost_mode"]),
+        max(1, min(int(spec.get("num_titles", defaults["num_titles"])), 5)),
+        int(spec.get("max_chars", defaults["max_chars"])),
+        spec.get("title"),
+        spec.get("description"),
+        stages,
+        max_workers=defaults["stage_workers"],
+        image_output="path",
+        timeout=spec.get("timeout", defaults["timeout"])
+    )
+    errors = {}
+    for stage in logs["Failed stages"]:
+        stage_logs = logs["Stage logs"].get(stage, {})
+        errors[stage] = stage_logs.get("error") or "; ".join(stage_logs.get("errors", [])) or "no result"
+    return {
+        "line": line_number,
+        "id": item_id,
+        "status": "failed" if errors else "done",
+        "package": package,
+        "timings": logs["Stage timings (s)"],
+        "errors": errors,
+        "deadline_fallbacks": logs["Deadline fallbacks"],
+        "seconds": round(time.time() - start, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk Event Generation Service")
+    parser.add_argument('input', help='JSONL file with one event spec per line (category, event_type, tone, and optional id, context, cost_mode, title, description, num_titles, max_chars, stages, timeout)')
+    parser.add_argument('--output', default='bulk_results.jsonl', help='NDJSON file results are appended to')
+    parser.add_argument('--journal', default=None, help='Checkpoint journal used to resume an interrupted run (defaults to <output>.journal)')
+    parser.add_argument('--stages', nargs='+', choices=list(EVENT_PACKAGE_GRAPH), default=['titles', 'description', 'faqs', 'refund_policy'], help='Stages generated for specs that do not list their own')
+    parser.add_argument('--cost_mode', choices=['economy', 'balanced', 'premium'], default='balanced', help='Cost mode for specs that do not set their own')
+    parser.add_argument('--num_titles', type=int, default=3, help='Title count for specs that do not set their own')
+    parser.add_argument('--max_chars', type=int, default=800, help='Description length for specs that do not set their own')
+    parser.add_argument('--concurrency', type=int, default=8, help='Events generated at the same time')
+    parser.add_argument('--stage_workers', type=int, default=2, help='Independent stages of one event generated at the same time')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds per event for specs that do not set their own')
+    parser.add_argument('--batch_window_ms', type=float, default=0, help='Pack title requests arriving within this window into one completion (0 disables batching)')
+
+    args = parser.parse_args()
+    journal_path = args.journal or f"{args.output}.journal"
+
+    errors = []
+    if not os.path.exists(args.input):
+        errors.append(f"Input file not found: {args.input}")
+    if args.concurrency < 1:
+        errors.append("concurrency must be at least 1")
+    if args.stage_workers < 1:
+        errors.append("stage_workers must be at least 1")
+    if args.batch_window_ms < 0:
+        errors.append("batch_window_ms must not be negative")
+
+    if errors:
+        print("[Bulk Service] Validation Errors:")
+        for error in errors:
+            print(f"  • {error}")
+        exit(1)
+
+    if args.batch_window_ms:
+        enable_batching(args.batch_window_ms)
+
+    watermark, done, retry, skipped = load_journal(journal_path)
+    defaults = {"stages": args.stages, "cost_mode": args.cost_mode, "num_titles": args.num_titles, "max_chars": args.max_chars, "stage_workers": args.stage_workers, "timeout": args.timeout}
+
+    print(f"[Bulk Service] Input: {args.input}")
+    print(f"[Bulk Service] Output: {args.output}")
+    print(f"[Bulk Service] Journal: {journal_path}")
+    print(f"[Bulk Service] Already completed (journal): {watermark + len(done) - skipped - sum(1 for line_number in retry if line_number <= watermark)}")
+    print(f"[Bulk Service] Failed earlier, retrying (journal): {len(retry)}")
+    print(f"[Bulk Service] Default stages: {', '.join(args.stages)}")
+    print(f"[Bulk Service] Concurrency: {args.concurrency}")
+    print("-" * 50)
+
+    completed = 0
+    failed = 0
+    start = time.time()
+    running = {}
+    max_in_flight = args.concurrency * 2
+
+    def collect(finished):
+        nonlocal completed, failed
+        for future in finished:
+            line_number = running.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                record = {"line": line_number, "id": None, "status": "failed", "errors": {"run": str(e)}}
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            journal.write(json.dumps({"line": record["line"], "id": record["id"], "status": record["status"]}) + "\n")
+            journal.flush()
+            if record["status"] == "done":
+                completed += 1
+                print(f"[Bulk Service] line {record['line']} ({record['id']}) done in {record['seconds']}s - {completed} done, {failed} failed")
+            else:
+                failed += 1
+                print(f"[Bulk Service] line {record['line']} ({record['id']}) FAILED: {record['errors']} - {completed} done, {failed} failed")
+
+    with open(args.output, 'a') as output, open(journal_path, 'a') as journal, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        try:
+            for line_number, line in read_specs(args.input, watermark, done, retry):
+                if line is None:
+                    journal.write(json.dumps({"line": line_number, "id": None, "status": "skipped"}) + "\n")
+                    journal.flush()
+                    continue
+                if len(running) >= max_in_flight:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                running[executor.submit(run_spec, line_number, line, defaults)] = line_number
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                collect(finished)
+        except KeyboardInterrupt:
+            for future in list(running):
+                if future.cancel():
+                    del running[future]
+            print(f"[Bulk Service] Interrupted - waiting for {len(running)} in-flight items so they are journaled; re-run the same command to resume.")
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                collect(finished)
+
+    analytics = get_global_analytics()
+    print("-" * 50)
+    print("[Bulk Service] Run Report:")
+    print(f"  Completed this run: {completed}")
+    print(f"  Failed this run: {failed}")
+    print(f"  Requests this run: {analytics['total_requests']}")
+    print(f"  Cache hit rate: {analytics['cache_hit_rate']}")
+    print(f"  Cost this run: {analytics['total_cost']}")
+    print(f"  Elapsed: {time.time() - start:.1f}s")
+    if failed:
+        print("[Bulk Service] Re-run the same command to retry failed items.")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
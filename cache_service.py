@@ -0,0 +1,131 @@
+from event_llm_core import cache, image_blobs, CacheSweeper, SmartCache, SimilarityCache, prompt_corpus, similarity_scope
+from multiprocessing import Pool
+import argparse
+import hashlib
+import random
+import tempfile
+
+def stress_worker(task):
+    cache_dir, backend, worker_id, iterations, num_keys = task
+    store = SmartCache(cache_dir=cache_dir, disk_backend=backend)
+    written = set()
+    reads = 0
+    corrupted = []
+    for i in range(iterations):
+        key = f"stress-{random.randrange(num_keys)}"
+        payload = f"{worker_id}:{i}:" + "x" * random.randint(100, 50000)
+        store.set(key, {'payload': payload, 'checksum': hashlib.sha256(payload.encode()).hexdigest()})
+        written.add(key)
+
+        probe = f"stress-{random.randrange(num_keys)}"
+        store.forget(probe)
+        data = store.disk.load(probe)
+        if data is None:
+            if probe in written:
+                corrupted.append(f"{probe}: missing after write")
+            continue
+        reads += 1
+        content = data.get('content') if isinstance(data, dict) else None
+        if not isinstance(content, dict) or hashlib.sha256(content.get('payload', '').encode()).hexdigest() != content.get('checksum'):
+            corrupted.append(f"{probe}: checksum mismatch")
+    return reads, corrupted
+
+def run_stress(args):
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="smart_cache_stress_")
+
+    print(f"[Cache Service] Stress testing {args.backend} backend in {cache_dir}")
+    print(f"[Cache Service] Workers: {args.workers}, iterations per worker: {args.iterations}, keys: {args.keys}")
+    print("-" * 50)
+
+    tasks = [(cache_dir, args.backend, worker_id, args.iterations, args.keys) for worker_id in range(args.workers)]
+    with Pool(args.workers) as pool:
+        results = pool.map(stress_worker, tasks)
+
+    total_reads = sum(reads for reads, _ in results)
+    corrupted = [entry for _, errors in results for entry in errors]
+
+    print("[Cache Service] Stress Report:")
+    print(f"  writes: {args.workers * args.iterations}")
+    print(f"  verified reads: {total_reads}")
+    print(f"  corrupted entries: {len(corrupted)}")
+    for entry in corrupted[:10]:
+        print(f"  • {entry}")
+    if corrupted:
+        exit(1)
+
+def run_sweep(args):
+    if args.max_disk_mb is not None and args.max_disk_mb <= 0:
+        print("[Cache Service] Validation Errors:")
+        print("  • max_disk_mb must be positive")
+        exit(1)
+
+    max_disk_bytes = int(args.max_disk_mb * 1024 * 1024) if args.max_disk_mb is not None else None
+
+    print(f"[Cache Service] Sweeping cache directory: {cache.cache_dir}")
+    print(f"[Cache Service] Disk backend: {type(cache.disk).__name__}")
+    print(f"[Cache Service] Max disk size: {f'{args.max_disk_mb} MB' if max_disk_bytes else 'unlimited'}")
+    print("-" * 50)
+
+    report = CacheSweeper(cache, image_blobs, max_disk_bytes=max_disk_bytes).run_once(vacuum=args.vacuum)
+
+    print("[Cache Service] Sweep Report:")
+    for k, v in report.items():
+        print(f"  {k}: {v}")
+
+def run_similarity(args):
+    corpus = prompt_corpus()
+    minhash = SimilarityCache()
+    scoped = []
+    for prompt in corpus:
+        namespace, text = similarity_scope(prompt["generator"], prompt["cache_params"], prompt["user"], prompt["max_tokens"], prompt["temperature"], prompt["model"], prompt["cost_mode"])
+        scoped.append((prompt, namespace, minhash.signature(text)))
+
+    print(f"[Cache Service] Checking similarity scopes of {len(corpus)} prompts from {len({prompt['event'] for prompt in corpus})} different events")
+    print(f"[Cache Service] Threshold: {args.threshold}")
+    print("-" * 50)
+
+    pairs = 0
+    matches = []
+    best = 0.0
+    for i, (prompt, namespace, signature) in enumerate(scoped):
+        for other, other_namespace, other_signature in scoped[i + 1:]:
+            if prompt["generator"] != other["generator"] or prompt["cost_mode"] != other["cost_mode"] or prompt["event"] == other["event"]:
+                continue
+            pairs += 1
+            score = float((signature == other_signature).mean()) if namespace == other_namespace else 0.0
+            best = max(best, score)
+            if score >= args.threshold:
+                matches.append(f"{prompt['generator']} ({prompt['cost_mode']}): {prompt['event'][:3]} ~ {other['event'][:3]} at {score:.2f}")
+
+    print("[Cache Service] Similarity Report:")
+    print(f"  cross-event pairs: {pairs}")
+    print(f"  highest cross-event similarity: {best:.2f}")
+    print(f"  cross-event matches: {len(matches)}")
+    for entry in matches[:10]:
+        print(f"  • {entry}")
+    if matches:
+        exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache Maintenance Service")
+    parser.add_argument('command', choices=['sweep', 'stress', 'similarity'], help='Maintenance command to run; similarity checks that different events never share a similarity cache hit')
+    parser.add_argument('--max_disk_mb', type=float, default=None, help='Maximum disk size for cache entries and image blobs; least recently used are evicted first')
+    parser.add_argument('--vacuum', action='store_true', help='Compact the SQLite cache file after sweeping (sqlite backend only)')
+    parser.add_argument('--backend', choices=['pickle', 'sqlite'], default='pickle', help='Disk backend to stress test')
+    parser.add_argument('--cache_dir', default=None, help='Cache directory for the stress test (defaults to a fresh temporary directory)')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent writer processes for the stress test')
+    parser.add_argument('--iterations', type=int, default=500, help='Writes per worker for the stress test')
+    parser.add_argument('--keys', type=int, default=50, help='Number of distinct keys shared by all stress workers')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Similarity at or above which two different events count as a match')
+
+    args = parser.parse_args()
+
+    if args.command == "stress":
+        run_stress(args)
+    elif args.command == "similarity":
+        run_similarity(args)
+    else:
+        run_sweep(args)
+
+if __name__ == "__main__":
+    main()
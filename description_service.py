@@ -9,6 +9,8 @@ def main():
     parser.add_argument('--tone', required=True, help='Tone of the event')
     parser.add_argument('--context', required=False, default=None, help='Optional context')
     parser.add_argument('--max_chars', type=int, default=800, help='Maximum characters (max 5000)')
+    parser.add_argument('--stream', action='store_true', help='Print the description as it is generated')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds; once spent the best partial result or a static fallback is returned')
     
     args = parser.parse_args()
     
@@ -39,7 +41,12 @@ def main():
     print(f"[Description Service] Max Characters: {max_chars}")
     print("-" * 50)
     
-    description, logs = generate_description(args.title, args.category, args.event_type, args.tone, args.context, max_chars)
+    if args.stream:
+        print("[Description Service] Streaming:")
+        print("  ", end="", flush=True)
+    description, logs = generate_description(args.title, args.category, args.event_type, args.tone, args.context, max_chars, on_chunk=(lambda chunk: print(chunk, end="", flush=True)) if args.stream else None, timeout=args.timeout)
+    if args.stream:
+        print()
     
     print("[Description Service] Generation Logs:")
     for k, v in logs.items():
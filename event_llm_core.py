@@ -1,106 +1,1338 @@
+import asyncio
+import atexit
 import json
 import os
 import time
 import hashlib
+import base64
+import importlib.util
+import mmap
 import pickle
+import sqlite3
+import struct
+import sys
+import threading
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from difflib import get_close_matches
 import streamlit as st
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
 import random
+import re
+import zlib
+import numpy as np
+from retry_policy import CircuitBreaker, DeadlineExceeded, RetryPolicy
+from tokenizer import TokenCounter, load_bpe_encoding
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 load_dotenv()
 
-class SmartCache:
-    def __init__(self, cache_dir="cache", ttl_hours=48):
-        self.cache_dir = cache_dir
-        self.ttl = timedelta(hours=ttl_hours)
-        self.memory_cache = {}
-        self.max_memory_items = 100
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
+class MemoryTier:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
     
-    def _get_cache_key(self, *args, **kwargs):
-        content = str(args) + str(sorted(kwargs.items()))
-        return hashlib.md5(content.encode()).hexdigest()[:16]
+    @staticmethod
+    def _sizeof(content):
+        return sys.getsizeof(content)
     
     def get(self, key):
-        if key in self.memory_cache:
-            data = self.memory_cache[key]
-            if datetime.now() - data['timestamp'] < self.ttl:
-                return data['content']
-            else:
-                del self.memory_cache[key]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+    
+    def set(self, key, data):
+        size = self._sizeof(data['content'])
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+            while self.current_bytes + size > self.max_bytes and self.entries:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+            self.entries[key] = (data, size)
+            self.current_bytes += size
+            return True
+    
+    def pop(self, key):
+        with self.lock:
+            self._remove(key)
+    
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'entries': len(self.entries),
+                'evictions': self.evictions
+            }
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.fd = None
+    
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except Exception:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.thread_lock.release()
+            raise
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+    
+    def try_acquire(self):
+        if not self.thread_lock.acquire(blocking=False):
+            return False
+        try:
+            self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            os.close(self.fd)
+            self.fd = None
+            self.thread_lock.release()
+            return False
+        except Exception:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.thread_lock.release()
+            raise
+    
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+        finally:
+            self.fd = None
+            self.thread_lock.release()
+
+class FlightLock:
+    """Per-key lock file that its holder unlinks on release.
+    
+    A waiter that wakes up on an unlinked file retries on the current one, so
+    at most one process holds a key while finished keys leave no files behind.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+    
+    def __enter__(self):
+        self.acquire(blocking=True)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+    
+    def try_acquire(self):
+        return self.acquire(blocking=False)
+    
+    def acquire(self, blocking=True):
+        while True:
+            fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    self.fd = fd
+                    return True
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            except FileNotFoundError:
+                pass
+            except Exception:
+                os.close(fd)
+                raise
+            os.close(fd)
+    
+    def release(self):
+        try:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+        finally:
+            self.fd = None
+
+class SingleFlight:
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self.lock = threading.Lock()
+        self.calls = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+    
+    def process_lock(self, key):
+        if not self.lock_dir or fcntl is None:
+            return nullcontext()
+        return FlightLock(os.path.join(self.lock_dir, f"{key}.lock"))
+    
+    def do(self, key, fn, deadline=None):
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = {'event': threading.Event(), 'result': None, 'error': None}
+                    self.calls[key] = call
+            
+            if leader:
+                break
+            if not call['event'].wait(None if deadline is None else max(deadline - time.time(), 0)):
+                raise DeadlineExceeded("Time budget exhausted waiting for an in-flight generation")
+            # A leader that ran out of its own budget says nothing about ours
+            if isinstance(call['error'], DeadlineExceeded) and (deadline is None or time.time() < deadline):
+                continue
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
         
-        cache_file = os.path.join(self.cache_dir, f"{key}.pkl")
+        try:
+            call['result'] = fn()
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['event'].set()
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self.calls = weakref.WeakKeyDictionary()
+    
+    async def do(self, key, coro_fn, deadline=None):
+        calls = self.calls.setdefault(asyncio.get_running_loop(), {})
+        while key in calls:
+            try:
+                return await asyncio.wait_for(asyncio.shield(calls[key]), None if deadline is None else max(deadline - time.time(), 0)), True
+            except DeadlineExceeded:
+                # A leader that ran out of its own budget says nothing about ours
+                if deadline is not None and time.time() >= deadline:
+                    raise
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("Time budget exhausted waiting for an in-flight generation")
+        
+        future = asyncio.get_running_loop().create_future()
+        calls[key] = future
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del calls[key]
+
+class RateLimiter:
+    STATE = struct.Struct("ddd")
+    
+    def __init__(self, limits, lock_dir=None):
+        self.limits = limits
+        self.lock_dir = lock_dir
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.states = {}
+        self.stats = {}
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+    
+    def _bucket_lock(self, model):
+        with self.lock:
+            if model not in self.locks:
+                if self.lock_dir:
+                    name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+                    self.locks[model] = FileLock(os.path.join(self.lock_dir, f"{name}.bucket"))
+                else:
+                    self.locks[model] = threading.Lock()
+                self.stats[model] = {'requests': 0, 'waits': 0, 'wait_seconds': 0.0}
+            return self.locks[model]
+    
+    def _load(self, model, lock, rpm, tpm):
+        if isinstance(lock, FileLock):
+            data = os.pread(lock.fd, self.STATE.size, 0)
+            if len(data) == self.STATE.size:
+                return list(self.STATE.unpack(data))
+        elif model in self.states:
+            return self.states[model]
+        return [rpm, tpm or 0, time.time()]
+    
+    def _store(self, model, lock, state):
+        if isinstance(lock, FileLock):
+            os.pwrite(lock.fd, self.STATE.pack(*state), 0)
+        else:
+            self.states[model] = state
+    
+    def reserve(self, model, tokens=0):
+        limit = self.limits.get(model)
+        if not limit:
+            return 0
+        rpm, tpm = limit.get("rpm"), limit.get("tpm")
+        lock = self._bucket_lock(model)
+        with lock:
+            requests_left, tokens_left, updated = self._load(model, lock, rpm, tpm)
+            now = time.time()
+            elapsed = max(now - updated, 0)
+            requests_left = min(rpm, requests_left + elapsed * rpm / 60) - 1
+            wait_seconds = -requests_left * 60 / rpm if requests_left < 0 else 0
+            if tpm:
+                tokens_left = min(tpm, tokens_left + elapsed * tpm / 60) - min(tokens, tpm)
+                if tokens_left < 0:
+                    wait_seconds = max(wait_seconds, -tokens_left * 60 / tpm)
+            self._store(model, lock, [requests_left, tokens_left, now])
+        
+        with self.lock:
+            stats = self.stats[model]
+            stats['requests'] += 1
+            if wait_seconds > 0:
+                stats['waits'] += 1
+                stats['wait_seconds'] += wait_seconds
+        return wait_seconds
+    
+    def acquire(self, model, tokens=0, deadline=None):
+        wait_seconds = self.reserve(model, tokens)
+        if deadline is not None and time.time() + wait_seconds >= deadline:
+            raise DeadlineExceeded(f"Time budget exhausted: {model} rate limit needs a {wait_seconds:.1f}s wait")
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        return wait_seconds
+    
+    async def acquire_async(self, model, tokens=0, deadline=None):
+        if not self.limits.get(model):
+            return 0
+        # reserve() takes a thread lock and a blocking flock on the bucket file
+        wait_seconds = await asyncio.to_thread(self.reserve, model, tokens)
+        if deadline is not None and time.time() + wait_seconds >= deadline:
+            raise DeadlineExceeded(f"Time budget exhausted: {model} rate limit needs a {wait_seconds:.1f}s wait")
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        return wait_seconds
+    
+    def snapshot(self):
+        with self.lock:
+            return {model: {**stats, 'wait_seconds': round(stats['wait_seconds'], 2)} for model, stats in self.stats.items()}
+
+class HedgePolicy:
+    def __init__(self, percentile=None, max_share=0.1, min_samples=20, window=200):
+        self.percentile = percentile
+        self.max_share = max_share
+        self.min_samples = min_samples
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.stats = {'eligible_requests': 0, 'hedged_requests': 0, 'hedge_wins': 0, 'hedge_tokens': 0, 'hedge_cost': 0.0}
+    
+    def record_latency(self, key, seconds):
+        with self.lock:
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+    
+    def hedge_delay(self, key):
+        if self.percentile is None:
+            return None
+        with self.lock:
+            self.stats['eligible_requests'] += 1
+            samples = list(self.samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, self.percentile))
+    
+    def try_hedge(self):
+        with self.lock:
+            if self.stats['hedged_requests'] + 1 > self.max_share * self.stats['eligible_requests']:
+                return False
+            self.stats['hedged_requests'] += 1
+            return True
+    
+    def record_hedge(self, hedge_won, tokens, cost):
+        with self.lock:
+            if hedge_won:
+                self.stats['hedge_wins'] += 1
+            self.stats['hedge_tokens'] += tokens
+            self.stats['hedge_cost'] += cost
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                'hedge_cost': f"${self.stats['hedge_cost']:.4f}",
+                'hedge_share': f"{self.stats['hedged_requests'] / max(self.stats['eligible_requests'], 1) * 100:.1f}%",
+                'thresholds (s)': {f"{generator}/{model}": round(float(np.percentile(list(samples), self.percentile)), 2) for (generator, model), samples in self.samples.items() if self.percentile is not None and len(samples) >= self.min_samples}
+            }
+
+class LengthCalibrator:
+    TARGET_BUCKETS = (5, 10, 250, 500, 1000, 2000, 5000)
+    
+    def __init__(self, path=None, min_samples=5, alpha=0.2, headroom=1.25, save_interval=5.0):
+        self.path = path
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.headroom = headroom
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.dirty = False
+        self.saved_at = 0.0
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.buckets = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[Calibration] Ignoring unreadable calibration file {path}: {e}")
+    
+    def key(self, generator, cost_mode, target):
+        bucket = next((b for b in self.TARGET_BUCKETS if target <= b), self.TARGET_BUCKETS[-1])
+        return f"{generator}/{cost_mode}/{bucket}"
+    
+    def record(self, generator, cost_mode, target, asked, output_units, output_tokens, complete=True):
+        if output_units <= 0 or output_tokens <= 0:
+            return
+        with self.lock:
+            stats = self.buckets.setdefault(self.key(generator, cost_mode, target), {'tokens_per_unit': None, 'fill_ratio': None, 'samples': 0, 'fill_samples': 0})
+            tokens_per_unit = output_tokens / output_units
+            stats['tokens_per_unit'] = tokens_per_unit if stats['tokens_per_unit'] is None else (1 - self.alpha) * stats['tokens_per_unit'] + self.alpha * tokens_per_unit
+            stats['samples'] += 1
+            if complete:
+                fill_ratio = min(output_units / asked, 1.5)
+                stats['fill_ratio'] = fill_ratio if stats['fill_ratio'] is None else (1 - self.alpha) * stats['fill_ratio'] + self.alpha * fill_ratio
+                stats['fill_samples'] += 1
+            self.dirty = True
+            due = time.time() - self.saved_at >= self.save_interval
+        if due:
+            self.save()
+    
+    def _stats(self, generator, cost_mode, target):
+        with self.lock:
+            return dict(self.buckets.get(self.key(generator, cost_mode, target)) or {})
+    
+    def max_tokens(self, generator, cost_mode, target, default, overhead=20):
+        stats = self._stats(generator, cost_mode, target)
+        if stats.get('samples', 0) < self.min_samples:
+            return default
+        return int(target * stats['tokens_per_unit'] * self.headroom) + overhead
+    
+    def prompt_target(self, generator, cost_mode, target):
+        stats = self._stats(generator, cost_mode, target)
+        if stats.get('fill_samples', 0) < self.min_samples or not stats['fill_ratio']:
+            return target
+        return int(min(max(target / stats['fill_ratio'], target), 2 * target))
+    
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.buckets, indent=2, sort_keys=True)
+            self.dirty = False
+            self.saved_at = time.time()
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[Calibration] Could not save {self.path}: {e}")
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: {
+                    'tokens_per_unit': round(stats['tokens_per_unit'], 3),
+                    'fill_ratio': round(stats['fill_ratio'], 3) if stats['fill_ratio'] is not None else None,
+                    'samples': stats['samples'],
+                    'calibrated': stats['samples'] >= self.min_samples
+                }
+                for key, stats in sorted(self.buckets.items())
+            }
+
+class PickleDiskStore:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.lock_dir = os.path.join(cache_dir, ".locks")
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+        os.makedirs(self.lock_dir, exist_ok=True)
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+    
+    def _lock(self, key):
+        stripe = key[:2]
+        with self.locks_guard:
+            if stripe not in self.locks:
+                self.locks[stripe] = FileLock(os.path.join(self.lock_dir, f"{stripe}.lock"))
+            return self.locks[stripe]
+    
+    def load(self, key):
+        cache_file = self._path(key)
         if os.path.exists(cache_file):
             try:
                 with open(cache_file, 'rb') as f:
                     data = pickle.load(f)
-                if datetime.now() - data['timestamp'] < self.ttl:
-                    if len(self.memory_cache) < self.max_memory_items:
-                        self.memory_cache[key] = data
-                    return data['content']
-                else:
-                    os.remove(cache_file)
-            except:
+                os.utime(cache_file)
+                return data
+            except OSError:
                 pass
+            except Exception:
+                self.delete(key)
         return None
     
-    def set(self, key, content):
+    def save(self, key, data, ttl):
+        cache_file = self._path(key)
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with self._lock(key):
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, cache_file)
+        except Exception:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+    
+    def delete(self, key):
+        try:
+            with self._lock(key):
+                os.remove(self._path(key))
+        except OSError:
+            pass
+    
+    def purge_expired(self, ttl):
+        report, _ = self.sweep(ttl)
+        return report['expired']
+    
+    def sweep(self, ttl):
+        report = {'expired': 0, 'corrupt': 0, 'bytes_reclaimed': 0}
+        live = []
+        cutoff = datetime.now() - ttl
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                tmp_file = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(tmp_file)
+                    if stat.st_mtime < time.time() - 3600:
+                        os.remove(tmp_file)
+                        report['corrupt'] += 1
+                        report['bytes_reclaimed'] += stat.st_size
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.pkl'):
+                continue
+            key = name[:-4]
+            cache_file = self._path(key)
+            try:
+                stat = os.stat(cache_file)
+                with open(cache_file, 'rb') as f:
+                    timestamp = pickle.load(f)['timestamp']
+            except OSError:
+                continue
+            except Exception:
+                self.delete(key)
+                report['corrupt'] += 1
+                report['bytes_reclaimed'] += stat.st_size
+                continue
+            if timestamp < cutoff:
+                self.delete(key)
+                report['expired'] += 1
+                report['bytes_reclaimed'] += stat.st_size
+            else:
+                live.append((stat.st_mtime, key, stat.st_size))
+        return report, live
+    
+    def evict(self, key):
+        try:
+            size = os.path.getsize(self._path(key))
+        except OSError:
+            return 0
+        self.delete(key)
+        return size
+
+class SQLiteDiskStore:
+    SERIALIZATION_VERSION = 1
+    # Hits only rewrite the LRU timestamp once it is this stale, so hot keys
+    # do not turn every read into a write.
+    ACCESS_UPDATE_SECONDS = 300
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, pool TEXT NOT NULL, created REAL NOT NULL, "
+            "expires REAL NOT NULL, version INTEGER NOT NULL, payload BLOB NOT NULL, accessed REAL)"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(cache_entries)")]
+        if 'accessed' not in columns:
+            conn.execute("ALTER TABLE cache_entries ADD COLUMN accessed REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries (expires)")
+    
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+    
+    def load(self, key):
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT pool, created, version, payload, accessed FROM cache_entries WHERE key = ? AND expires > ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            pool, created, version, payload, accessed = row
+            if version != self.SERIALIZATION_VERSION:
+                self.delete(key)
+                return None
+            try:
+                content = pickle.loads(payload)
+            except Exception:
+                self.delete(key)
+                return None
+            if accessed is None or now - accessed > self.ACCESS_UPDATE_SECONDS:
+                self._conn().execute("UPDATE cache_entries SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            return None
+        return {'content': content, 'timestamp': datetime.fromtimestamp(created), 'pool': pool}
+    
+    def save(self, key, data, ttl):
+        created = data['timestamp'].timestamp()
+        payload = pickle.dumps(data['content'], protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache_entries (key, pool, created, expires, version, payload, accessed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, data.get('pool', 'text'), created, created + ttl.total_seconds(), self.SERIALIZATION_VERSION, sqlite3.Binary(payload), created)
+            )
+        except sqlite3.Error:
+            pass
+    
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+    
+    def purge_expired(self, ttl):
+        cursor = self._conn().execute("DELETE FROM cache_entries WHERE expires <= ?", (time.time(),))
+        return cursor.rowcount
+    
+    def sweep(self, ttl):
+        conn = self._conn()
+        now = time.time()
+        report = {'expired': 0, 'corrupt': 0, 'bytes_reclaimed': 0}
+        expired_count, expired_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM cache_entries WHERE expires <= ?", (now,)
+        ).fetchone()
+        corrupt_count, corrupt_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM cache_entries WHERE expires > ? AND version != ?",
+            (now, self.SERIALIZATION_VERSION)
+        ).fetchone()
+        conn.execute("DELETE FROM cache_entries WHERE expires <= ? OR version != ?", (now, self.SERIALIZATION_VERSION))
+        report['expired'] = expired_count
+        report['corrupt'] = corrupt_count
+        report['bytes_reclaimed'] = expired_bytes + corrupt_bytes
+        live = [
+            (accessed, key, size)
+            for key, size, accessed in conn.execute("SELECT key, LENGTH(payload), COALESCE(accessed, created) FROM cache_entries")
+        ]
+        return report, live
+    
+    def evict(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT LENGTH(payload) FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return 0
+        self.delete(key)
+        return row[0]
+    
+    def vacuum(self):
+        conn = self._conn()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+
+class SharedMemoryTier(SQLiteDiskStore):
+    def __init__(self, db_path, max_bytes):
+        super().__init__(db_path)
+        self.max_bytes = max_bytes
+        self.evictions = 0
+    
+    def _used_bytes(self, conn):
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+    
+    def save(self, key, data, ttl):
+        try:
+            super().save(key, data, ttl)
+            conn = self._conn()
+            if self._used_bytes(conn) > self.max_bytes:
+                count = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+                cursor = conn.execute(
+                    "DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries ORDER BY COALESCE(accessed, created) LIMIT ?)",
+                    (max(1, count // 10),)
+                )
+                self.evictions += cursor.rowcount
+        except sqlite3.Error:
+            pass
+    
+    def stats(self):
+        conn = self._conn()
+        return {
+            'bytes': self._used_bytes(conn),
+            'max_bytes': self.max_bytes,
+            'entries': conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0],
+            'evictions': self.evictions
+        }
+
+class ImageBlobStore:
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir)
+    
+    @staticmethod
+    def is_digest(value):
+        return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+    
+    def _path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.png")
+    
+    def put(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        blob_file = self._path(digest)
+        if not os.path.exists(blob_file):
+            os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+            tmp_file = f"{blob_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_file, blob_file)
+        return digest
+    
+    def path(self, digest):
+        blob_file = self._path(digest)
+        if not os.path.exists(blob_file):
+            return None
+        os.utime(blob_file)
+        return blob_file
+    
+    def open(self, digest):
+        blob_file = self._path(digest)
+        with open(blob_file, 'rb') as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        os.utime(blob_file)
+        return view
+    
+    def read(self, digest):
+        blob_file = self._path(digest)
+        with open(blob_file, 'rb') as f:
+            data = f.read()
+        os.utime(blob_file)
+        return data
+    
+    def sweep(self, ttl):
+        report = {'expired': 0, 'corrupt': 0, 'bytes_reclaimed': 0}
+        live = []
+        cutoff = time.time() - ttl.total_seconds()
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                blob_file = os.path.join(root, name)
+                try:
+                    stat = os.stat(blob_file)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    if stat.st_mtime < time.time() - 3600:
+                        os.remove(blob_file)
+                        report['corrupt'] += 1
+                        report['bytes_reclaimed'] += stat.st_size
+                    continue
+                if stat.st_size == 0:
+                    os.remove(blob_file)
+                    report['corrupt'] += 1
+                elif stat.st_mtime < cutoff:
+                    os.remove(blob_file)
+                    report['expired'] += 1
+                    report['bytes_reclaimed'] += stat.st_size
+                else:
+                    live.append((stat.st_mtime, name[:-4], stat.st_size))
+        return report, live
+    
+    def evict(self, digest):
+        blob_file = self._path(digest)
+        try:
+            size = os.path.getsize(blob_file)
+            os.remove(blob_file)
+        except OSError:
+            return 0
+        return size
+
+class SmartCache:
+    def __init__(self, cache_dir="cache", ttl_hours=48, text_memory_bytes=16 * 1024 * 1024, image_memory_bytes=64 * 1024 * 1024, disk_backend="pickle", shared_tier=None, retention_hours=168):
+        self.cache_dir = cache_dir
+        self.ttl = timedelta(hours=ttl_hours)
+        self.retention = max(self.ttl, timedelta(hours=retention_hours))
+        self.shared = shared_tier
+        self.memory_pools = {
+            'text': MemoryTier(text_memory_bytes),
+            'image': MemoryTier(image_memory_bytes)
+        }
+        if disk_backend == "sqlite":
+            self.disk = SQLiteDiskStore(os.path.join(cache_dir, "cache.db"))
+        elif disk_backend == "pickle":
+            self.disk = PickleDiskStore(cache_dir)
+        else:
+            raise ValueError(f"Unknown cache disk backend: {disk_backend}")
+    
+    def _get_cache_key(self, *args, **kwargs):
+        content = str(args) + str(sorted(kwargs.items()))
+        return hashlib.sha256(content.encode()).hexdigest()
+    
+    @staticmethod
+    def canonicalize(value):
+        if isinstance(value, str):
+            return " ".join(value.lower().split())
+        if isinstance(value, float):
+            return round(value, 4)
+        if isinstance(value, (list, tuple)):
+            return [SmartCache.canonicalize(v) for v in value]
+        if isinstance(value, dict):
+            return {str(k): SmartCache.canonicalize(v) for k, v in sorted(value.items())}
+        return value
+    
+    @staticmethod
+    def canonicalize_context(context):
+        if not context:
+            return None
+        segments = {SmartCache.canonicalize(segment) for segment in re.split(r"[.;|\n]+", context)}
+        return sorted(segment for segment in segments if segment)
+    
+    def request_key(self, generator, **params):
+        descriptor = {
+            'generator': generator,
+            'template_version': PROMPT_TEMPLATE_VERSIONS.get(generator, 1),
+            'optimizer_version': PromptOptimizer.VERSION,
+            'params': {
+                k: self.canonicalize_context(v) if k == 'context' else self.canonicalize(v)
+                for k, v in sorted(params.items())
+            }
+        }
+        return hashlib.sha256(json.dumps(descriptor, sort_keys=True, default=str).encode()).hexdigest()
+    
+    def _memory_get(self, key):
+        for tier in self.memory_pools.values():
+            data = tier.get(key)
+            if data is not None:
+                if datetime.now() - data['timestamp'] < self.retention:
+                    return data
+                tier.pop(key)
+        return None
+    
+    def lookup(self, key):
+        data = self._memory_get(key)
+        if data is not None:
+            return data['content'], datetime.now() - data['timestamp']
+        
+        if self.shared is not None:
+            data = self.shared.load(key)
+            if data is not None and datetime.now() - data['timestamp'] < self.retention:
+                self.memory_pools[data.get('pool', 'text')].set(key, data)
+                return data['content'], datetime.now() - data['timestamp']
+        
+        data = self.disk.load(key)
+        if data is not None:
+            if datetime.now() - data['timestamp'] < self.retention:
+                self.memory_pools[data.get('pool', 'text')].set(key, data)
+                if self.shared is not None:
+                    self.shared.save(key, data, self.retention)
+                return data['content'], datetime.now() - data['timestamp']
+            self.disk.delete(key)
+        return None, None
+    
+    def get(self, key):
+        content, age = self.lookup(key)
+        if content is not None and age < self.ttl:
+            return content
+        return None
+    
+    def set(self, key, content, pool="text"):
         data = {
             'content': content,
-            'timestamp': datetime.now()
+            'timestamp': datetime.now(),
+            'pool': pool
         }
         
-        if len(self.memory_cache) >= self.max_memory_items:
-            oldest_key = min(self.memory_cache.keys(), key=lambda k: self.memory_cache[k]['timestamp'])
-            del self.memory_cache[oldest_key]
+        for name, tier in self.memory_pools.items():
+            if name != pool:
+                tier.pop(key)
+        self.memory_pools[pool].set(key, data)
+        if self.shared is not None:
+            self.shared.save(key, data, self.retention)
+        self.disk.save(key, data, self.retention)
+    
+    def purge_expired(self):
+        return self.disk.purge_expired(self.retention)
+    
+    def forget(self, key):
+        for tier in self.memory_pools.values():
+            tier.pop(key)
+    
+    def memory_stats(self):
+        pools = {name: tier.stats() for name, tier in self.memory_pools.items()}
+        return {
+            'bytes': sum(p['bytes'] for p in pools.values()),
+            'entries': sum(p['entries'] for p in pools.values()),
+            'evictions': sum(p['evictions'] for p in pools.values()),
+            'pools': pools,
+            'shared': self.shared.stats() if self.shared is not None else None
+        }
+
+class CacheSweeper:
+    def __init__(self, cache, blob_store, max_disk_bytes=None, interval_seconds=3600):
+        self.cache = cache
+        self.blob_store = blob_store
+        self.max_disk_bytes = max_disk_bytes
+        self.interval_seconds = interval_seconds
+        self.last_report = None
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def run_once(self, vacuum=False):
+        start = time.time()
+        entry_report, live_entries = self.cache.disk.sweep(self.cache.retention)
+        blob_report, live_blobs = self.blob_store.sweep(self.cache.retention)
+        report = {
+            'expired_entries': entry_report['expired'],
+            'corrupt_entries': entry_report['corrupt'],
+            'evicted_entries': 0,
+            'expired_blobs': blob_report['expired'],
+            'corrupt_blobs': blob_report['corrupt'],
+            'evicted_blobs': 0,
+            'bytes_reclaimed': entry_report['bytes_reclaimed'] + blob_report['bytes_reclaimed']
+        }
+        
+        candidates = [(accessed, 'entry', key, size) for accessed, key, size in live_entries]
+        candidates += [(accessed, 'blob', digest, size) for accessed, digest, size in live_blobs]
+        disk_bytes = sum(c[3] for c in candidates)
+        if self.max_disk_bytes is not None and disk_bytes > self.max_disk_bytes:
+            candidates.sort()
+            for _, kind, key, _ in candidates:
+                if disk_bytes <= self.max_disk_bytes:
+                    break
+                if kind == 'entry':
+                    freed = self.cache.disk.evict(key)
+                    self.cache.forget(key)
+                    report['evicted_entries'] += 1
+                else:
+                    freed = self.blob_store.evict(key)
+                    report['evicted_blobs'] += 1
+                disk_bytes -= freed
+                report['bytes_reclaimed'] += freed
         
-        self.memory_cache[key] = data
+        if vacuum and hasattr(self.cache.disk, 'vacuum'):
+            self.cache.disk.vacuum()
         
-        cache_file = os.path.join(self.cache_dir, f"{key}.pkl")
-        try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(data, f)
-        except:
-            pass
+        report['bytes_remaining'] = disk_bytes
+        report['duration_s'] = round(time.time() - start, 3)
+        report['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        self.last_report = report
+        return report
+    
+    def _loop(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            try:
+                report = self.run_once()
+                print(f"[Cache Sweeper] Reclaimed {report['bytes_reclaimed']} bytes, {report['bytes_remaining']} bytes remaining")
+            except Exception as e:
+                print(f"[Cache Sweeper] Sweep failed: {e}")
+    
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._loop, name="cache-sweeper", daemon=True)
+            self.thread.start()
+        return self
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+class SimilarityCache:
+    MERSENNE_PRIME = (1 << 31) - 1
+    
+    def __init__(self, num_perm=128, bands=32, shingle_size=2, max_entries=5000, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        rng = np.random.RandomState(seed)
+        self.perm_a = rng.randint(1, self.MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.randint(0, self.MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.entries = OrderedDict()
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(text):
+        return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+    
+    def signature(self, text):
+        words = self.normalize(text).split()
+        if len(words) <= self.shingle_size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+        hashes = np.fromiter((zlib.crc32(sh.encode()) for sh in shingles), dtype=np.uint64, count=len(shingles))
+        hashes %= np.uint64(self.MERSENNE_PRIME)
+        permuted = (self.perm_a[:, None] * hashes[None, :] + self.perm_b[:, None]) % np.uint64(self.MERSENNE_PRIME)
+        return permuted.min(axis=1)
+    
+    def _band_keys(self, namespace, signature):
+        return [(namespace, band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+    
+    def add(self, namespace, text, cache_key):
+        signature = self.signature(text)
+        band_keys = self._band_keys(namespace, signature)
+        with self.lock:
+            self._remove(cache_key)
+            self.entries[cache_key] = (signature, band_keys)
+            for band_key in band_keys:
+                self.buckets.setdefault(band_key, set()).add(cache_key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+    
+    def remove(self, cache_key):
+        with self.lock:
+            self._remove(cache_key)
+    
+    def _remove(self, cache_key):
+        entry = self.entries.pop(cache_key, None)
+        if entry is None:
+            return
+        for band_key in entry[1]:
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(cache_key)
+                if not bucket:
+                    del self.buckets[band_key]
+    
+    def lookup(self, namespace, text, threshold):
+        signature = self.signature(text)
+        with self.lock:
+            candidates = set()
+            for band_key in self._band_keys(namespace, signature):
+                candidates.update(self.buckets.get(band_key, ()))
+            if not candidates:
+                return None, 0.0
+            keys = list(candidates)
+            signatures = np.stack([self.entries[k][0] for k in keys])
+        scores = (signatures == signature).mean(axis=1)
+        best = int(scores.argmax())
+        if scores[best] < threshold:
+            return None, float(scores[best])
+        return keys[best], float(scores[best])
 
 class PromptOptimizer:
+    VERSION = 3
+    COST_MODE_TOKEN_BUDGETS = {"economy": 0.5, "balanced": 0.75}
+    CRITICAL_PATTERN = re.compile(r"\b(critical|must|require\w*|essential|exactly|only|never|avoid|do not|no|json|format)\b", re.IGNORECASE)
+    # Output-format constraints ("without bullet points", "End with ...", "Include: ...")
+    # and registered instructions are never dropped, whatever the budget.
+    CONSTRAINT_PATTERN = re.compile(r"\b(without|include\w*|end with|bullet points?|numbered lists?|paragraphs?)\b|\bno\b[^.]*\blists?\b", re.IGNORECASE)
+    protected = set()
+    EXAMPLE_PATTERN = re.compile(r"^examples?\b", re.IGNORECASE)
+    SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'\[])")
+    FILLER_PATTERNS = [
+        (re.compile(r"\b(?:please|kindly)\s+", re.IGNORECASE), ""),
+        (re.compile(r"\b(?:you should|it is important to|make sure to|make sure that|be sure to|note that)\s+", re.IGNORECASE), ""),
+        (re.compile(r"\b(?:really|truly|basically|actually|simply)\s+", re.IGNORECASE), ""),
+        (re.compile(r"\bin order to\b", re.IGNORECASE), "to")
+    ]
+    memo = OrderedDict()
+    memo_size = 1024
+    lock = threading.Lock()
+    stats = {'compressions': 0, 'memo_hits': 0, 'tokens_before': 0, 'tokens_after': 0}
+    
+    @staticmethod
+    def _strip_filler(sentence):
+        cleaned = sentence
+        for pattern, replacement in PromptOptimizer.FILLER_PATTERNS:
+            cleaned = pattern.sub(replacement, cleaned)
+        cleaned = re.sub(r"[ \t]{2,}", " ", cleaned).strip()
+        if cleaned != sentence.strip() and cleaned[:1].islower() and sentence.lstrip()[:1].isupper():
+            cleaned = cleaned[0].upper() + cleaned[1:]
+        return cleaned
+    
+    @staticmethod
+    def _normalize(sentence):
+        return " ".join(re.sub(r"[^\w\s-]", " ", re.sub(r"^[-*•\d.)\s]+", "", sentence.lower())).split())
+    
+    @staticmethod
+    def protect(instruction):
+        for sentence in PromptOptimizer.SENTENCE_PATTERN.split(instruction):
+            PromptOptimizer.protected.add(PromptOptimizer._normalize(PromptOptimizer._strip_filler(sentence)))
+    
     @staticmethod
-    def compress_prompt(prompt, target_reduction=0.3):
-        lines = prompt.split('\n')
-        essential_lines = []
-        for line in lines:
-            if any(keyword in line.upper() for keyword in ['CRITICAL', 'MUST', 'REQUIRED', 'ESSENTIAL']):
-                essential_lines.append(line)
-            elif len(line.strip()) > 10 and not line.strip().startswith('-'):
-                essential_lines.append(line[:int(len(line) * (1 - target_reduction))])
-        return '\n'.join(essential_lines)
+    def is_constraint(text):
+        return PromptOptimizer._normalize(text) in PromptOptimizer.protected or bool(PromptOptimizer.CONSTRAINT_PATTERN.search(text))
     
     @staticmethod
-    def optimize_for_cost(prompt, cost_mode):
-        if cost_mode == "economy":
-            compressed = PromptOptimizer.compress_prompt(prompt, 0.5)
-            return compressed.replace("Please provide", "Provide").replace("You should", "").replace("It is important to", "").replace("Make sure to", "")
-        elif cost_mode == "premium":
+    def _units(prompt):
+        units = []
+        seen = []
+        block = 0
+        block_critical = False
+        in_examples = False
+        for line_index, line in enumerate(prompt.split('\n')):
+            stripped = line.strip()
+            if not stripped:
+                block += 1
+                block_critical = False
+                in_examples = False
+                units.append({'line': line_index, 'block': block, 'text': "", 'critical': True, 'example': False, 'header': False})
+                continue
+            bullet = re.match(r"^([-*•]|\d+[.)])\s+", stripped)
+            prefix = bullet.group(0) if bullet else ""
+            header = stripped.endswith(":") and len(stripped) <= 60
+            if header:
+                block += 1
+                in_examples = bool(PromptOptimizer.EXAMPLE_PATTERN.match(stripped))
+                block_critical = not in_examples and bool(PromptOptimizer.CRITICAL_PATTERN.search(stripped))
+            for sentence_index, sentence in enumerate(PromptOptimizer.SENTENCE_PATTERN.split(stripped[len(prefix):])):
+                text = PromptOptimizer._strip_filler(sentence)
+                normalized = PromptOptimizer._normalize(text)
+                if not normalized:
+                    continue
+                words = set(normalized.split())
+                example = in_examples and not header
+                critical = header or block_critical or not seen or (not example and (bool(PromptOptimizer.CRITICAL_PATTERN.search(text)) or PromptOptimizer.is_constraint(text)))
+                if normalized in (earlier for earlier, _ in seen) or (not critical and len(words) >= 3 and any(words <= earlier_words for _, earlier_words in seen)):
+                    continue
+                seen.append((normalized, words))
+                units.append({'line': line_index, 'block': block, 'text': (prefix if sentence_index == 0 else "") + text, 'critical': critical, 'example': example, 'header': header})
+        return units
+    
+    @staticmethod
+    def _render(units):
+        lines = {}
+        for unit in units:
+            lines.setdefault(unit['line'], []).append(unit['text'])
+        rendered = [" ".join(part for part in parts if part) for _, parts in sorted(lines.items())]
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(rendered)).strip()
+    
+    @staticmethod
+    def compress_prompt(prompt, token_budget=None):
+        key = (prompt, token_budget)
+        with PromptOptimizer.lock:
+            cached = PromptOptimizer.memo.get(key)
+            if cached is not None:
+                PromptOptimizer.memo.move_to_end(key)
+                PromptOptimizer.stats['memo_hits'] += 1
+                PromptOptimizer.stats['tokens_before'] += cached[1]
+                PromptOptimizer.stats['tokens_after'] += cached[2]
+                return cached
+        
+        units = PromptOptimizer._units(prompt)
+        compressed = PromptOptimizer._render(units)
+        tokens = count_tokens(compressed)
+        while token_budget is not None and tokens > token_budget:
+            droppable = [unit for unit in units if not unit['critical']]
+            droppable = [unit for unit in droppable if unit['example']] or droppable
+            if not droppable:
+                break
+            line_sizes = Counter(unit['line'] for unit in droppable)
+            unit = max(reversed(droppable), key=lambda unit: line_sizes[unit['line']])
+            units.remove(unit)
+            if not any(other['block'] == unit['block'] and other['text'] and not other['header'] for other in units):
+                units = [other for other in units if not (other['header'] and other['block'] == unit['block'])]
+            compressed = PromptOptimizer._render(units)
+            tokens = count_tokens(compressed)
+        
+        result = (compressed, count_tokens(prompt), tokens)
+        with PromptOptimizer.lock:
+            PromptOptimizer.memo[key] = result
+            while len(PromptOptimizer.memo) > PromptOptimizer.memo_size:
+                PromptOptimizer.memo.popitem(last=False)
+            PromptOptimizer.stats['compressions'] += 1
+            PromptOptimizer.stats['tokens_before'] += result[1]
+            PromptOptimizer.stats['tokens_after'] += result[2]
+        return result
+    
+    @staticmethod
+    def token_budget(prompt, cost_mode):
+        ratio = PromptOptimizer.COST_MODE_TOKEN_BUDGETS.get(cost_mode)
+        return None if ratio is None else int(count_tokens(prompt) * ratio)
+    
+    @staticmethod
+    def optimize_for_cost(prompt, cost_mode, budgeted=False):
+        if cost_mode == "premium":
             return prompt
-        else:
-            return PromptOptimizer.compress_prompt(prompt, 0.25)
+        return PromptOptimizer.compress_prompt(prompt, PromptOptimizer.token_budget(prompt, cost_mode) if budgeted else None)[0]
+    
+    @staticmethod
+    def snapshot():
+        with PromptOptimizer.lock:
+            stats = dict(PromptOptimizer.stats)
+        stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+        stats['memo_entries'] = len(PromptOptimizer.memo)
+        return stats
 
 class BatchProcessor:
+    def __init__(self, send, window_seconds=0.05, max_batch=8, max_batch_tokens=3000):
+        self.send = send
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.max_batch_tokens = max_batch_tokens
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="batch-send")
+        self.stats = {'batches': 0, 'batched_requests': 0, 'unbatched_requests': 0}
+    
     @staticmethod
     def can_batch(requests):
-        return len(requests) > 1 and all(req.get('model') == requests[0].get('model') for req in requests)
+        return len(requests) > 1 and all(req.get('model') == requests[0].get('model') and req.get('temperature') == requests[0].get('temperature') for req in requests)
     
     @staticmethod
     def create_batch_prompt(requests):
-        batch_prompt = "Generate the following items in JSON format:\n"
+        shared_system = requests[0].get('system') if all(req.get('system') == requests[0].get('system') for req in requests) else None
+        batch_system = "You complete several independent requests in a single response."
+        if shared_system:
+            batch_system += f"\n\n{shared_system}"
+        batch_prompt = "Complete each of the following requests independently:\n"
         for i, req in enumerate(requests):
-            batch_prompt += f"{i+1}. {req['type']}: {req['prompt']}\n"
-        batch_prompt += "\nReturn as JSON array with 'type', 'content', and 'index' fields."
-        return batch_prompt
+            batch_prompt += f"\n{i+1}. {req['type']}:\n"
+            if not shared_system and req.get('system'):
+                batch_prompt += f"Instructions: {req['system']}\n"
+            batch_prompt += f"{req['prompt']}\n"
+        batch_prompt += "\nReturn ONLY a JSON array with one object per request: {\"index\": <request number>, \"content\": <the complete answer to that request as a string>}."
+        return batch_system, batch_prompt
+    
+    @staticmethod
+    def split_batch_response(raw, count):
+        contents = [None] * count
+        try:
+            parsed = json.loads(clean_json_output(raw))
+        except ValueError:
+            return contents
+        if isinstance(parsed, dict):
+            parsed = parsed.get('results') or parsed.get('items') or []
+        if not isinstance(parsed, list):
+            return contents
+        for item in parsed:
+            if not isinstance(item, dict) or not isinstance(item.get('index'), int) or not 1 <= item['index'] <= count:
+                continue
+            content = item.get('content')
+            if not isinstance(content, str):
+                content = json.dumps(content)
+            if content.strip():
+                contents[item['index'] - 1] = content.strip()
+        return contents
+    
+    def submit(self, request):
+        future = Future()
+        group = (request['type'], request['model'], request['temperature'])
+        batch = None
+        with self.lock:
+            items = self.pending.get(group)
+            if items is None:
+                items = self.pending[group] = OrderedDict()
+                timer = threading.Timer(self.window_seconds, self._flush, args=(group, items))
+                timer.daemon = True
+                timer.start()
+            if request['cache_key'] in items:
+                items[request['cache_key']][1].append(future)
+                return future
+            items[request['cache_key']] = (request, [future])
+            if len(items) >= self.max_batch or sum(req['max_tokens'] for req, _ in items.values()) >= self.max_batch_tokens:
+                batch = self.pending.pop(group)
+        if batch is not None:
+            self.executor.submit(self._dispatch, batch)
+        return future
+    
+    def _flush(self, group, items):
+        with self.lock:
+            if self.pending.get(group) is not items:
+                return
+            del self.pending[group]
+        self._dispatch(items)
+    
+    def _dispatch(self, batch):
+        entries = list(batch.values())
+        requests = [req for req, _ in entries]
+        try:
+            contents = self.send(requests) if self.can_batch(requests) else [None] * len(requests)
+        except Exception as e:
+            for _, futures in entries:
+                for future in futures:
+                    future.set_exception(e)
+            return
+        with self.lock:
+            if len(requests) > 1:
+                self.stats['batches'] += 1
+            for content in contents:
+                self.stats['batched_requests' if content is not None else 'unbatched_requests'] += 1
+        for (req, futures), content in zip(entries, contents):
+            for future in futures:
+                future.set_result((content, len(requests)))
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
 
 class PerformanceAnalytics:
     def __init__(self):
@@ -110,7 +1342,16 @@ class PerformanceAnalytics:
             'total_cost': 0.0,
             'total_tokens': 0,
             'avg_response_time': 0.0,
-            'error_rate': 0.0
+            'error_rate': 0.0,
+            'similarity_hits': 0,
+            'coalesced_calls': 0,
+            'batched_requests': 0,
+            'deadline_exceeded': 0,
+            'api_usage_calls': 0,
+            'estimated_usage_calls': 0,
+            'static_prefix_tokens': 0,
+            'prefix_cache_eligible_tokens': 0,
+            'cached_prompt_tokens': 0
         }
     
     def record_request(self, cost, tokens, response_time, from_cache=False, error=False):
@@ -127,6 +1368,11 @@ class PerformanceAnalytics:
         if error:
             self.metrics['error_rate'] = (self.metrics['error_rate'] * (self.metrics['total_requests'] - 1) + 1) / self.metrics['total_requests']
     
+    def record_prefix(self, prefix_tokens, cached_tokens=0):
+        self.metrics['static_prefix_tokens'] += prefix_tokens
+        self.metrics['prefix_cache_eligible_tokens'] += prefix_cache_eligible(prefix_tokens)
+        self.metrics['cached_prompt_tokens'] += cached_tokens
+    
     def get_efficiency_score(self):
         if self.metrics['total_requests'] == 0:
             return 0
@@ -147,9 +1393,149 @@ class PerformanceAnalytics:
         
         return sum(w * c for w, c in zip(weights, components)) * 100
 
-cache = SmartCache()
+class ConnectionStats:
+    TRACE_EVENTS = {
+        "connection.connect_tcp.complete": 'new_connections',
+        "connection.connect_tcp.failed": 'connect_failures',
+        "connection.start_tls.complete": 'tls_handshakes'
+    }
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'new_connections': 0, 'tls_handshakes': 0, 'connect_failures': 0}
+    
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+    
+    def trace(self, event_name, info):
+        if event_name in self.TRACE_EVENTS:
+            self._count(self.TRACE_EVENTS[event_name])
+    
+    async def trace_async(self, event_name, info):
+        self.trace(event_name, info)
+    
+    def on_request(self, request):
+        self._count('requests')
+        request.extensions["trace"] = self.trace
+    
+    async def on_request_async(self, request):
+        self._count('requests')
+        request.extensions["trace"] = self.trace_async
+    
+    def snapshot(self):
+        with self.lock:
+            counts = dict(self.counts)
+        counts['reused_connections'] = max(counts['requests'] - counts['new_connections'], 0)
+        counts['reuse_rate'] = f"{counts['reused_connections'] / max(counts['requests'], 1) * 100:.1f}%"
+        return counts
+
+PROMPT_TEMPLATE_VERSIONS = {
+    "titles": 3,
+    "description": 2,
+    "faqs": 2,
+    "refund_policy": 2,
+    "flyer": 1,
+    "banner": 1
+}
+
+shared_tier_path = os.getenv("SMART_CACHE_SHARED_TIER")
+cache = SmartCache(
+    disk_backend=os.getenv("SMART_CACHE_BACKEND", "pickle"),
+    shared_tier=SharedMemoryTier(shared_tier_path, int(float(os.getenv("SMART_CACHE_SHARED_MB", "64")) * 1024 * 1024)) if shared_tier_path else None
+)
+image_blobs = ImageBlobStore(os.path.join(cache.cache_dir, "blobs"))
+single_flight = SingleFlight(os.path.join(cache.cache_dir, ".flights"))
+async_single_flight = AsyncSingleFlight()
+similarity_cache = SimilarityCache()
+
+SIMILARITY_THRESHOLDS = {
+    "titles": None,
+    "description": None,
+    "faqs": None,
+    "refund_policy": None
+}
+for item in os.getenv("SMART_CACHE_SIMILARITY", "").split(","):
+    if "=" in item:
+        generator_name, threshold = item.split("=", 1)
+        SIMILARITY_THRESHOLDS[generator_name.strip()] = float(threshold)
+SIMILARITY_TEXT_FIELDS = ("title", "description", "context")
+
+def similarity_scope(generator, cache_params, user_msg, max_tokens, temperature, model, cost_mode):
+    # Only the free-text request fields are signed; the prompt templates are
+    # shared by every event and would dominate the MinHash signature. All other
+    # params (category, event type, tone, counts, ...) must match exactly.
+    if cache_params is None:
+        return (generator, max_tokens, temperature, model, cost_mode), user_msg
+    exact = {k: v for k, v in cache_params.items() if k not in SIMILARITY_TEXT_FIELDS}
+    namespace = (generator, json.dumps(SmartCache.canonicalize(exact), sort_keys=True, default=str), temperature, model, cost_mode)
+    text = "\n".join(SmartCache.canonicalize(str(cache_params[k])) for k in SIMILARITY_TEXT_FIELDS if cache_params.get(k))
+    return namespace, text
+
+CACHE_TTL_HOURS = {
+    "titles": {"soft": 48, "hard": 96},
+    "description": {"soft": 48, "hard": 96},
+    "faqs": {"soft": 48, "hard": 120},
+    "refund_policy": {"soft": 72, "hard": 168}
+}
+
+revalidation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-revalidate")
+revalidation_lock = threading.Lock()
+revalidating_keys = set()
+cache_sweeper = None
+if os.getenv("SMART_CACHE_SWEEP_INTERVAL"):
+    max_disk_mb = os.getenv("SMART_CACHE_MAX_DISK_MB")
+    cache_sweeper = CacheSweeper(
+        cache,
+        image_blobs,
+        max_disk_bytes=int(float(max_disk_mb) * 1024 * 1024) if max_disk_mb else None,
+        interval_seconds=float(os.getenv("SMART_CACHE_SWEEP_INTERVAL"))
+    ).start()
 analytics = PerformanceAnalytics()
 
+def _retry_policy(breaker_name):
+    breaker = CircuitBreaker(
+        breaker_name,
+        error_rate=float(os.getenv("OPENAI_CIRCUIT_ERROR_RATE", "0.5")),
+        min_calls=int(os.getenv("OPENAI_CIRCUIT_MIN_CALLS", "10")),
+        window_seconds=float(os.getenv("OPENAI_CIRCUIT_WINDOW_SECONDS", "60")),
+        cooldown_seconds=float(os.getenv("OPENAI_CIRCUIT_COOLDOWN_SECONDS", "30"))
+    )
+    return RetryPolicy(
+        max_attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("OPENAI_RETRY_BASE_DELAY", "1")),
+        max_delay=float(os.getenv("OPENAI_RETRY_MAX_DELAY", "30")),
+        breaker=breaker
+    )
+
+MODEL_RATE_LIMITS = {
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000},
+    "dall-e-3": {"rpm": 7, "tpm": None}
+}
+for item in os.getenv("OPENAI_RATE_LIMITS", "").split(","):
+    if "=" in item:
+        model_name, limit = item.split("=", 1)
+        rpm, _, tpm = limit.partition("/")
+        if float(rpm) > 0:
+            MODEL_RATE_LIMITS[model_name.strip()] = {"rpm": float(rpm), "tpm": float(tpm) if tpm else None}
+        else:
+            MODEL_RATE_LIMITS.pop(model_name.strip(), None)
+rate_limiter = RateLimiter(MODEL_RATE_LIMITS, os.path.join(cache.cache_dir, ".ratelimit"))
+hedge_policy = HedgePolicy(
+    percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE")) if os.getenv("OPENAI_HEDGE_PERCENTILE") else None,
+    max_share=float(os.getenv("OPENAI_HEDGE_MAX_SHARE", "0.1")),
+    min_samples=int(os.getenv("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+)
+
+length_calibrator = LengthCalibrator(
+    os.getenv("LENGTH_CALIBRATION_FILE", os.path.join(cache.cache_dir, "length_calibration.json")),
+    min_samples=int(os.getenv("LENGTH_CALIBRATION_MIN_SAMPLES", "5"))
+)
+atexit.register(length_calibrator.save)
+
+chat_retry = _retry_policy("chat")
+image_retry = _retry_policy("images")
+
 def get_api_key():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key and 'st' in globals():
@@ -168,7 +1554,150 @@ if not API_KEY:
     else:
         raise ValueError("OpenAI API key not found. Please set OPENAI_API_KEY environment variable or add to Streamlit secrets.")
 
-client = OpenAI(api_key=API_KEY)
+HTTP_CLIENT_SETTINGS = {
+    "max_connections": int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+    "max_keepalive_connections": int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+    "keepalive_expiry": float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")),
+    "connect_timeout": float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+    "read_timeout": float(os.getenv("OPENAI_READ_TIMEOUT", "90")),
+    "write_timeout": float(os.getenv("OPENAI_WRITE_TIMEOUT", "30")),
+    "pool_timeout": float(os.getenv("OPENAI_POOL_TIMEOUT", "10")),
+    "http2": os.getenv("OPENAI_HTTP2", "").lower() in ("1", "true", "yes")
+}
+connection_stats = ConnectionStats()
+
+def create_http_client(asynchronous=False, **overrides):
+    settings = dict(HTTP_CLIENT_SETTINGS, **overrides)
+    http2 = settings["http2"]
+    if http2 and importlib.util.find_spec("h2") is None:
+        print("[HTTP] HTTP/2 requested but the 'h2' package is not installed - using HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(
+        max_connections=settings["max_connections"],
+        max_keepalive_connections=settings["max_keepalive_connections"],
+        keepalive_expiry=settings["keepalive_expiry"]
+    )
+    timeout = httpx.Timeout(
+        connect=settings["connect_timeout"],
+        read=settings["read_timeout"],
+        write=settings["write_timeout"],
+        pool=settings["pool_timeout"]
+    )
+    if asynchronous:
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2, event_hooks={"request": [connection_stats.on_request_async]})
+    return httpx.Client(limits=limits, timeout=timeout, http2=http2, event_hooks={"request": [connection_stats.on_request]})
+
+def create_openai_client(asynchronous=False, **overrides):
+    http_client = create_http_client(asynchronous, **overrides)
+    client_class = AsyncOpenAI if asynchronous else OpenAI
+    return client_class(api_key=API_KEY, http_client=http_client, timeout=http_client.timeout, max_retries=0)
+
+client = create_openai_client()
+async_clients = weakref.WeakKeyDictionary()
+
+def _async_openai_client():
+    loop = asyncio.get_running_loop()
+    loop_client = async_clients.get(loop)
+    if loop_client is None:
+        loop_client = async_clients[loop] = create_openai_client(asynchronous=True)
+    return loop_client
+
+async def close_async_http_client():
+    loop_client = async_clients.pop(asyncio.get_running_loop(), None)
+    if loop_client is not None:
+        await loop_client.close()
+
+def close_http_clients():
+    client.close()
+
+def configure_http_clients(**overrides):
+    global client
+    unknown = set(overrides) - set(HTTP_CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown HTTP client settings: {', '.join(sorted(unknown))}")
+    HTTP_CLIENT_SETTINGS.update(overrides)
+    old_client, client = client, create_openai_client()
+    old_client.close()
+    # Async clients belong to their event loop, so they are closed there. A
+    # loop that is not running cannot do that; call close_async_http_client on
+    # it before reconfiguring.
+    stale = list(async_clients.items())
+    async_clients.clear()
+    for loop, loop_client in stale:
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(loop_client.close(), loop)
+    return dict(HTTP_CLIENT_SETTINGS)
+
+atexit.register(close_http_clients)
+async_concurrency = int(os.getenv("OPENAI_ASYNC_CONCURRENCY", "32"))
+async_semaphores = weakref.WeakKeyDictionary()
+
+def set_async_concurrency(limit):
+    global async_concurrency
+    if limit < 1:
+        raise ValueError("async concurrency must be at least 1")
+    async_concurrency = limit
+    async_semaphores.clear()
+
+def _async_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = async_semaphores[loop] = asyncio.Semaphore(async_concurrency)
+    return semaphore
+
+@asynccontextmanager
+async def _async_slot(deadline=None):
+    semaphore = _async_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), _time_left(deadline))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Time budget exhausted waiting for a concurrency slot")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+@contextmanager
+def _process_lock(key, deadline=None):
+    lock = single_flight.process_lock(key)
+    if deadline is None or isinstance(lock, nullcontext):
+        with lock:
+            yield
+        return
+    while not lock.try_acquire():
+        if time.time() >= deadline:
+            raise DeadlineExceeded("Time budget exhausted waiting for an in-flight generation")
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        lock.release()
+
+async def _async_try_acquire(lock):
+    # The lock file is opened and flocked on a worker thread; if the caller is
+    # cancelled meanwhile, a lock that still ends up acquired is released again.
+    acquiring = asyncio.ensure_future(asyncio.to_thread(lock.try_acquire))
+    try:
+        return await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(lambda f: f.exception() is None and f.result() and lock.release())
+        raise
+
+@asynccontextmanager
+async def _async_process_lock(key, deadline=None):
+    lock = single_flight.process_lock(key)
+    if isinstance(lock, nullcontext):
+        yield
+        return
+    while not await _async_try_acquire(lock):
+        if deadline is not None and time.time() >= deadline:
+            raise DeadlineExceeded("Time budget exhausted waiting for an in-flight generation")
+        await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(lock.release)
 
 def clean_json_output(raw):
     raw = raw.strip()
@@ -180,7 +1709,9 @@ def clean_json_output(raw):
         raw = raw[:-3].strip()
     return raw
 
-def estimate_cost(prompt_tokens, completion_tokens, model="gpt-3.5-turbo"):
+CACHED_INPUT_PRICE_RATIO = 0.5
+
+def estimate_cost(prompt_tokens, completion_tokens, model="gpt-3.5-turbo", cached_tokens=0):
     costs = {
         "gpt-3.5-turbo": {"input": 0.0005, "output": 0.0015},
         "gpt-4": {"input": 0.03, "output": 0.06},
@@ -188,13 +1719,69 @@ def estimate_cost(prompt_tokens, completion_tokens, model="gpt-3.5-turbo"):
     }
     
     if model in costs and "input" in costs[model]:
-        input_cost = costs[model]["input"] * (prompt_tokens / 1000)
+        input_cost = costs[model]["input"] * ((prompt_tokens - cached_tokens * (1 - CACHED_INPUT_PRICE_RATIO)) / 1000)
         output_cost = costs[model]["output"] * (completion_tokens / 1000)
         return input_cost + output_cost
     return 0.02
 
+TOKENIZER_BPE_FILE = os.getenv("TOKENIZER_BPE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cl100k_base.tiktoken"))
+token_counter = TokenCounter(load_bpe_encoding(TOKENIZER_BPE_FILE), int(os.getenv("TOKENIZER_MEMO_SIZE", "4096")))
+
 def count_tokens(text):
-    return max(len(text.split()), int(len(text) / 3.5))
+    return token_counter.count(text)
+
+def count_prompt_tokens(system_msg, user_msg):
+    return token_counter.count_messages(system_msg, user_msg)
+
+IMAGE_PROMPT_TOKEN_BUDGET = 800
+
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_INCREMENT = int(os.getenv("PROMPT_CACHE_INCREMENT", "128"))
+
+class PromptTemplate:
+    def __init__(self, name, prefix, suffix):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.optimized_prefixes = {cost_mode: PromptOptimizer.optimize_for_cost(prefix, cost_mode, budgeted=True) for cost_mode in ("economy", "balanced", "premium")}
+        self.prefix_tokens = {cost_mode: count_tokens(optimized) for cost_mode, optimized in self.optimized_prefixes.items()}
+    
+    def render(self, **values):
+        return f"{self.prefix}\n\n{self.suffix.format(**values)}"
+
+class PromptTemplateRegistry:
+    def __init__(self):
+        self.templates = {}
+    
+    def register(self, name, prefix, suffix):
+        self.templates[name] = PromptTemplate(name, prefix, suffix)
+        return self.templates[name]
+    
+    def render(self, name, **values):
+        return self.templates[name].render(**values)
+    
+    def match(self, system_msg):
+        for template in self.templates.values():
+            if system_msg.startswith(template.prefix + "\n\n"):
+                return template
+        return None
+    
+    def optimize(self, system_msg, cost_mode):
+        template = self.match(system_msg)
+        if template is None or cost_mode not in template.optimized_prefixes:
+            return PromptOptimizer.optimize_for_cost(system_msg, cost_mode), 0
+        suffix = PromptOptimizer.optimize_for_cost(system_msg[len(template.prefix) + 2:], cost_mode)
+        return f"{template.optimized_prefixes[cost_mode]}\n\n{suffix}", template.prefix_tokens[cost_mode]
+    
+    def snapshot(self):
+        return {name: template.prefix_tokens for name, template in self.templates.items()}
+
+def prefix_cache_eligible(prefix_tokens):
+    if prefix_tokens < PROMPT_CACHE_MIN_TOKENS:
+        return 0
+    return PROMPT_CACHE_MIN_TOKENS + (prefix_tokens - PROMPT_CACHE_MIN_TOKENS) // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+
+prompt_templates = PromptTemplateRegistry()
 
 def fuzzy_correct(user_input, valid_options):
     matches = get_close_matches(user_input, valid_options, n=1, cutoff=0.75)
@@ -202,23 +1789,168 @@ def fuzzy_correct(user_input, valid_options):
         return matches[0]
     return user_input
 
-def smart_api_call(system_msg, user_msg, max_tokens, temperature, model="gpt-3.5-turbo", cost_mode="balanced"):
-    start_time = time.time()
-    
-    optimized_system = PromptOptimizer.optimize_for_cost(system_msg, cost_mode)
-    optimized_user = PromptOptimizer.optimize_for_cost(user_msg, cost_mode)
-    
-    cache_key = cache._get_cache_key(optimized_system, optimized_user, max_tokens, temperature, model)
-    cached_result = cache.get(cache_key)
-    
-    if cached_result:
-        analytics.record_request(0, 0, time.time() - start_time, from_cache=True)
-        return cached_result
-    
-    max_retries = 3
-    for attempt in range(max_retries):
+def _read_stream(stream, on_chunk, stop_chars, state, cancel=None, deadline=None):
+    parts = []
+    length = 0
+    try:
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                break
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded("Time budget exhausted mid-stream", "".join(parts).strip())
+            if getattr(chunk, 'usage', None) is not None:
+                state['usage'] = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not parts and delta:
+                delta = delta.lstrip()
+            if not delta:
+                continue
+            parts.append(delta)
+            length += len(delta)
+            if on_chunk is not None:
+                on_chunk(delta)
+                state['emitted'] = True
+            if stop_chars is not None and length >= stop_chars:
+                break
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if cancel is not None and cancel.is_set():
+            return "".join(parts).strip()
+        if deadline is None or time.time() < deadline:
+            raise
+        raise DeadlineExceeded(f"Time budget exhausted mid-stream: {e}", "".join(parts).strip()) from e
+    return "".join(parts).strip()
+
+def _deadline(timeout):
+    return None if timeout is None else time.time() + timeout
+
+def _time_left(deadline):
+    if deadline is None:
+        return None
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+def _request_timeout(deadline):
+    left = _time_left(deadline)
+    if left is None:
+        return {}
+    return {"timeout": httpx.Timeout(
+        connect=min(HTTP_CLIENT_SETTINGS["connect_timeout"], left),
+        read=min(HTTP_CLIENT_SETTINGS["read_timeout"], left),
+        write=min(HTTP_CLIENT_SETTINGS["write_timeout"], left),
+        pool=min(HTTP_CLIENT_SETTINGS["pool_timeout"], left)
+    )}
+
+def _log_retry(label):
+    def log(attempt, error, delay):
+        print(f"{label} Error (attempt {attempt + 1}): {error} - retrying in {delay:.1f}s")
+    return log
+
+def _structured_options(response_format, n):
+    options = {}
+    if response_format is not None:
+        options["response_format"] = response_format
+    if n > 1:
+        options["n"] = n
+    return options
+
+def _stream_options(stream):
+    return {"stream_options": {"include_usage": True}} if stream else {}
+
+def _store_usage(usage, reported):
+    if usage is None or reported is None:
+        return
+    usage['prompt_tokens'] = reported.prompt_tokens
+    usage['completion_tokens'] = reported.completion_tokens
+    usage['cached_tokens'] = getattr(getattr(reported, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+
+def _completion_text(response, n):
+    if n > 1:
+        return json.dumps([choice.message.content.strip() for choice in response.choices])
+    return response.choices[0].message.content.strip()
+
+def _request_completion(optimized_system, optimized_user, max_tokens, temperature, model, on_chunk=None, stop_chars=None, cancel=None, deadline=None, response_format=None, n=1, usage=None):
+    stream = (on_chunk is not None or stop_chars is not None or cancel is not None or deadline is not None) and n == 1
+    state = {'emitted': False}
+    
+    def attempt():
+        rate_limiter.acquire(model, count_prompt_tokens(optimized_system, optimized_user) + max_tokens, deadline)
+        if cancel is not None and cancel.is_set():
+            return ""
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": optimized_system},
+                {"role": "user", "content": optimized_user}
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=0.9,
+            frequency_penalty=0.6,
+            presence_penalty=0.4,
+            stream=stream,
+            **_stream_options(stream),
+            **_structured_options(response_format, n),
+            **_request_timeout(deadline)
+        )
+        if not stream:
+            _store_usage(usage, getattr(response, 'usage', None))
+            return _completion_text(response, n)
+        if cancel is not None:
+            cancel.attach(response)
         try:
-            response = client.chat.completions.create(
+            result = _read_stream(response, on_chunk, stop_chars, state, cancel, deadline)
+        finally:
+            response.close()
+        _store_usage(usage, state.get('usage'))
+        return result
+    
+    return chat_retry.call(attempt, on_retry=_log_retry("OpenAI"), can_retry=lambda: not state['emitted'], deadline=deadline)
+
+async def _read_stream_async(stream, on_chunk, stop_chars, state, deadline=None):
+    parts = []
+    length = 0
+    try:
+        async for chunk in stream:
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded("Time budget exhausted mid-stream", "".join(parts).strip())
+            if getattr(chunk, 'usage', None) is not None:
+                state['usage'] = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not parts and delta:
+                delta = delta.lstrip()
+            if not delta:
+                continue
+            parts.append(delta)
+            length += len(delta)
+            if on_chunk is not None:
+                on_chunk(delta)
+                state['emitted'] = True
+            if stop_chars is not None and length >= stop_chars:
+                break
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        if deadline is None or time.time() < deadline:
+            raise
+        raise DeadlineExceeded(f"Time budget exhausted mid-stream: {e}", "".join(parts).strip()) from e
+    return "".join(parts).strip()
+
+async def _request_completion_async(optimized_system, optimized_user, max_tokens, temperature, model, on_chunk=None, stop_chars=None, deadline=None, response_format=None, n=1, usage=None):
+    stream = (on_chunk is not None or stop_chars is not None or deadline is not None) and n == 1
+    state = {'emitted': False}
+    
+    async def attempt():
+        await rate_limiter.acquire_async(model, count_prompt_tokens(optimized_system, optimized_user) + max_tokens, deadline)
+        async with _async_slot(deadline):
+            response = await _async_openai_client().chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": optimized_system},
@@ -228,24 +1960,491 @@ def smart_api_call(system_msg, user_msg, max_tokens, temperature, model="gpt-3.5
                 temperature=temperature,
                 top_p=0.9,
                 frequency_penalty=0.6,
-                presence_penalty=0.4
+                presence_penalty=0.4,
+                stream=stream,
+                **_stream_options(stream),
+                **_structured_options(response_format, n),
+                **_request_timeout(deadline)
             )
-            
-            result = response.choices[0].message.content.strip()
-            cache.set(cache_key, result)
-            
-            prompt_tokens = count_tokens(optimized_system + optimized_user)
-            completion_tokens = count_tokens(result)
-            cost = estimate_cost(prompt_tokens, completion_tokens, model)
-            
-            analytics.record_request(cost, prompt_tokens + completion_tokens, time.time() - start_time)
+            if not stream:
+                _store_usage(usage, getattr(response, 'usage', None))
+                return _completion_text(response, n)
+            try:
+                result = await _read_stream_async(response, on_chunk, stop_chars, state, deadline)
+            finally:
+                await response.close()
+            _store_usage(usage, state.get('usage'))
             return result
-            
+    
+    return await chat_retry.call_async(attempt, on_retry=_log_retry("OpenAI"), can_retry=lambda: not state['emitted'], deadline=deadline)
+
+hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+class StreamCancel:
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.response = None
+    
+    def is_set(self):
+        return self.event.is_set()
+    
+    def attach(self, response):
+        with self.lock:
+            self.response = response
+            cancelled = self.event.is_set()
+        if cancelled:
+            response.close()
+    
+    def set(self):
+        with self.lock:
+            self.event.set()
+            response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+def _record_hedge(winner_is_hedge, optimized_system, optimized_user, result, model):
+    prompt_tokens = count_prompt_tokens(optimized_system, optimized_user)
+    hedge_tokens = prompt_tokens + count_tokens(result)
+    hedge_cost = estimate_cost(prompt_tokens, count_tokens(result), model)
+    hedge_policy.record_hedge(winner_is_hedge, hedge_tokens, hedge_cost)
+    analytics.metrics['total_cost'] += hedge_cost
+    analytics.metrics['total_tokens'] += hedge_tokens
+    print(f"[Hedge] {'hedge' if winner_is_hedge else 'primary'} request won, duplicate cancelled (~{hedge_tokens} extra tokens)")
+
+def _hedged_completion(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=None, generator=None, deadline=None, response_format=None, n=1, usage=None):
+    hedge_key = (generator, model)
+    delay = hedge_policy.hedge_delay(hedge_key) if n == 1 else None
+    start_time = time.time()
+    if delay is None:
+        result = _request_completion(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=stop_chars, deadline=deadline, response_format=response_format, n=n, usage=usage)
+        hedge_policy.record_latency(hedge_key, time.time() - start_time)
+        return result
+    
+    # The primary runs on its own thread and only the hedge goes to
+    # hedge_executor, so a busy pool can delay a hedge but never a primary.
+    # The caller waits for the first racer to succeed (or for all to fail) and
+    # returns at once; the winner closes the loser's stream, and a loser still
+    # waiting for response headers is dropped as soon as they arrive.
+    cancels = {'primary': StreamCancel(), 'hedge': StreamCancel()}
+    racer_usage = {'primary': {}, 'hedge': {}}
+    race = {'winner': None, 'result': None, 'error': None, 'hedged': False, 'live': {'primary', 'hedge'}}
+    race_lock = threading.Lock()
+    settled = threading.Event()
+    primary_done = threading.Event()
+    
+    def finish(name, result=None, error=None, abandoned=False):
+        with race_lock:
+            race['live'].discard(name)
+            won = not abandoned and error is None and race['winner'] is None
+            if won:
+                race['winner'], race['result'] = name, result
+            elif error is not None and race['error'] is None:
+                race['error'] = error
+            if race['winner'] is not None or not race['live']:
+                settled.set()
+        if won:
+            cancels['hedge' if name == 'primary' else 'primary'].set()
+    
+    def run(name):
+        try:
+            result = _request_completion(optimized_system, optimized_user, max_tokens, temperature, model, None, stop_chars, cancels[name], deadline, response_format, n, racer_usage[name])
+        except Exception as e:
+            finish(name, error=e)
+        else:
+            finish(name, result)
+        finally:
+            if name == 'primary':
+                primary_done.set()
+    
+    def run_hedge():
+        if primary_done.wait(max(delay - (time.time() - start_time), 0)) or not hedge_policy.try_hedge():
+            finish('hedge', abandoned=True)
+            return
+        race['hedged'] = True
+        run('hedge')
+    
+    threading.Thread(target=run, args=('primary',), name="hedge-primary", daemon=True).start()
+    hedge_executor.submit(run_hedge)
+    settled.wait()
+    
+    with race_lock:
+        winner, result, error = race['winner'], race['result'], race['error']
+    if winner is None:
+        raise error
+    if usage is not None:
+        usage.update(racer_usage[winner])
+    hedge_policy.record_latency(hedge_key, time.time() - start_time)
+    if race['hedged']:
+        _record_hedge(winner == 'hedge', optimized_system, optimized_user, result, model)
+    return result
+
+async def _hedged_completion_async(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=None, generator=None, deadline=None, response_format=None, n=1, usage=None):
+    hedge_key = (generator, model)
+    delay = hedge_policy.hedge_delay(hedge_key) if n == 1 else None
+    start_time = time.time()
+    if delay is None:
+        result = await _request_completion_async(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=stop_chars, deadline=deadline, response_format=response_format, n=n, usage=usage)
+        hedge_policy.record_latency(hedge_key, time.time() - start_time)
+        return result
+    
+    racer_usage = [{}, {}]
+    primary = asyncio.ensure_future(_request_completion_async(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=stop_chars, deadline=deadline, response_format=response_format, n=n, usage=racer_usage[0]))
+    racers = [primary]
+    error = None
+    try:
+        done, _ = await asyncio.wait(racers, timeout=delay)
+        if not done and hedge_policy.try_hedge():
+            racers.append(asyncio.ensure_future(_request_completion_async(optimized_system, optimized_user, max_tokens, temperature, model, stop_chars=stop_chars, deadline=deadline, response_format=response_format, n=n, usage=racer_usage[1])))
+        
+        pending = set(racers)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                if usage is not None:
+                    usage.update(racer_usage[racers.index(task)])
+                hedge_policy.record_latency(hedge_key, time.time() - start_time)
+                if len(racers) > 1:
+                    _record_hedge(task is not primary, optimized_system, optimized_user, task.result(), model)
+                return task.result()
+        raise error
+    finally:
+        for task in racers:
+            if not task.done():
+                task.cancel()
+
+def _call_tokens(usage, optimized_system, optimized_user, result):
+    if usage:
+        analytics.metrics['api_usage_calls'] += 1
+        return usage['prompt_tokens'], usage['completion_tokens']
+    analytics.metrics['estimated_usage_calls'] += 1
+    return count_prompt_tokens(optimized_system, optimized_user), count_tokens(result)
+
+def _revalidate(cache_key, optimized_system, optimized_user, max_tokens, temperature, model, response_format=None, n=1):
+    start_time = time.time()
+    try:
+        usage = {}
+        result = _request_completion(optimized_system, optimized_user, max_tokens, temperature, model, response_format=response_format, n=n, usage=usage)
+        cache.set(cache_key, result)
+        prompt_tokens, completion_tokens = _call_tokens(usage, optimized_system, optimized_user, result)
+        analytics.record_request(estimate_cost(prompt_tokens, completion_tokens, model), prompt_tokens + completion_tokens, time.time() - start_time)
+    except Exception as e:
+        analytics.record_request(0, 0, time.time() - start_time, error=True)
+        print(f"[Stale Cache] Background refresh failed: {e}")
+    finally:
+        with revalidation_lock:
+            revalidating_keys.discard(cache_key)
+
+def _prepare_call(system_msg, user_msg, max_tokens, temperature, model, cost_mode, generator, call_log, cache_params, response_format=None, n=1):
+    start_time = time.time()
+    
+    optimized_system, prefix_tokens = prompt_templates.optimize(system_msg, cost_mode)
+    optimized_user = PromptOptimizer.optimize_for_cost(user_msg, cost_mode)
+    
+    if generator and cache_params is not None:
+        cache_key = cache.request_key(generator, temperature=temperature, model=model, cost_mode=cost_mode, **cache_params)
+    else:
+        cache_key = cache._get_cache_key(optimized_system, optimized_user, max_tokens, temperature, model)
+    cached_result, cached_age = cache.lookup(cache_key)
+    
+    call = {
+        'start_time': start_time,
+        'optimized_system': optimized_system,
+        'optimized_user': optimized_user,
+        'prefix_tokens': prefix_tokens,
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'model': model,
+        'response_format': response_format,
+        'n': n,
+        'generator': generator,
+        'call_log': call_log,
+        'cache_key': cache_key,
+        'cached_result': cached_result,
+        'cached_age': cached_age,
+        'similarity_threshold': SIMILARITY_THRESHOLDS.get(generator)
+    }
+    call['similarity_namespace'], call['similarity_text'] = similarity_scope(generator, cache_params, optimized_user, max_tokens, temperature, model, cost_mode)
+    
+    ttl_policy = CACHE_TTL_HOURS.get(generator, {})
+    soft_ttl = timedelta(hours=ttl_policy['soft']) if 'soft' in ttl_policy else cache.ttl
+    hard_ttl = max(soft_ttl, timedelta(hours=ttl_policy['hard'])) if 'hard' in ttl_policy else soft_ttl
+    
+    if cached_result and cached_age < soft_ttl:
+        analytics.record_request(0, 0, time.time() - start_time, from_cache=True)
+        if call_log is not None:
+            call_log.append({'cache': 'exact'})
+        call['result'] = cached_result
+        return call
+    
+    if cached_result and cached_age < hard_ttl:
+        with revalidation_lock:
+            refresh = cache_key not in revalidating_keys
+            revalidating_keys.add(cache_key)
+        if refresh:
+            revalidation_executor.submit(_revalidate, cache_key, optimized_system, optimized_user, max_tokens, temperature, model, response_format, n)
+        analytics.record_request(0, 0, time.time() - start_time, from_cache=True)
+        print(f"[Stale Cache] {generator} serving stale value ({cached_age.total_seconds() / 3600:.1f}h old), refreshing in background")
+        if call_log is not None:
+            call_log.append({'cache': 'stale', 'age_hours': round(cached_age.total_seconds() / 3600, 2)})
+        call['result'] = cached_result
+        return call
+    
+    similarity_threshold = call['similarity_threshold']
+    if similarity_threshold is not None:
+        similar_key, similarity = similarity_cache.lookup(call['similarity_namespace'], call['similarity_text'], similarity_threshold)
+        if similar_key is not None:
+            similar_result = cache.get(similar_key)
+            if similar_result:
+                analytics.record_request(0, 0, time.time() - start_time, from_cache=True)
+                analytics.metrics['similarity_hits'] += 1
+                print(f"[Similarity Cache] {generator} hit - similarity {similarity:.2f} >= {similarity_threshold}")
+                if call_log is not None:
+                    call_log.append({'cache': 'similarity', 'similarity': round(similarity, 3)})
+                call['result'] = similar_result
+                return call
+            similarity_cache.remove(similar_key)
+    
+    return call
+
+def _fail_call(call, e):
+    analytics.record_request(0, 0, time.time() - call['start_time'], error=True)
+    cached_result, cached_age = call['cached_result'], call['cached_age']
+    if cached_result:
+        print(f"[Stale Cache] {call['generator']} provider error ({e}), serving stale value ({cached_age.total_seconds() / 3600:.1f}h old)")
+        if call['call_log'] is not None:
+            call['call_log'].append({'cache': 'stale-if-error', 'age_hours': round(cached_age.total_seconds() / 3600, 2), 'error': str(e)})
+        return cached_result
+    raise e
+
+def _finish_call(call, result, filled_elsewhere, coalesced):
+    call_log = call['call_log']
+    if coalesced or filled_elsewhere:
+        analytics.record_request(0, 0, time.time() - call['start_time'], from_cache=True)
+        analytics.metrics['coalesced_calls'] += 1
+        if call_log is not None:
+            call_log.append({'cache': 'coalesced'})
+        return result
+    
+    if call['similarity_threshold'] is not None:
+        similarity_cache.add(call['similarity_namespace'], call['similarity_text'], call['cache_key'])
+    prompt_tokens, completion_tokens = _call_tokens(call.get('usage'), call['optimized_system'], call['optimized_user'], result)
+    if call_log is not None:
+        call_log.append({'cache': 'miss', 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens})
+    
+    cached_tokens = (call.get('usage') or {}).get('cached_tokens', 0)
+    analytics.record_prefix(call['prefix_tokens'], cached_tokens)
+    cost = estimate_cost(prompt_tokens, completion_tokens, call['model'], cached_tokens)
+    
+    analytics.record_request(cost, prompt_tokens + completion_tokens, time.time() - call['start_time'])
+    return result
+
+def _single_api_call(call):
+    cache_key = call['cache_key']
+    
+    deadline = call.get('deadline')
+    
+    def fetch():
+        with _process_lock(cache_key, deadline):
+            shared_result = cache.get(cache_key)
+            if shared_result:
+                return shared_result, True
+            call['usage'] = {}
+            if call.get('on_chunk') is None:
+                fresh_result = _hedged_completion(call['optimized_system'], call['optimized_user'], call['max_tokens'], call['temperature'], call['model'], call.get('stop_chars'), call['generator'], deadline, call['response_format'], call['n'], call['usage'])
+            else:
+                fresh_result = _request_completion(call['optimized_system'], call['optimized_user'], call['max_tokens'], call['temperature'], call['model'], call.get('on_chunk'), call.get('stop_chars'), deadline=deadline, response_format=call['response_format'], n=call['n'], usage=call['usage'])
+            call['streamed'] = call.get('on_chunk') is not None
+            cache.set(cache_key, fresh_result)
+            return fresh_result, False
+    
+    try:
+        (result, filled_elsewhere), coalesced = single_flight.do(cache_key, fetch, deadline)
+    except Exception as e:
+        return _fail_call(call, e)
+    return _finish_call(call, result, filled_elsewhere, coalesced)
+
+def smart_api_call(system_msg, user_msg, max_tokens, temperature, model="gpt-3.5-turbo", cost_mode="balanced", generator=None, call_log=None, cache_params=None, on_chunk=None, stop_chars=None, deadline=None, response_format=None, n=1):
+    call = _prepare_call(system_msg, user_msg, max_tokens, temperature, model, cost_mode, generator, call_log, cache_params, response_format, n)
+    call['on_chunk'] = on_chunk
+    call['stop_chars'] = stop_chars
+    call['deadline'] = deadline
+    result = call['result'] if 'result' in call else _single_api_call(call)
+    if on_chunk is not None and result and not call.get('streamed'):
+        on_chunk(result)
+    return result
+
+async def async_smart_api_call(system_msg, user_msg, max_tokens, temperature, model="gpt-3.5-turbo", cost_mode="balanced", generator=None, call_log=None, cache_params=None, on_chunk=None, stop_chars=None, deadline=None, response_format=None, n=1):
+    # Cache lookups and lock files touch the disk, so they run on worker threads
+    # instead of blocking the event loop.
+    call = await asyncio.to_thread(_prepare_call, system_msg, user_msg, max_tokens, temperature, model, cost_mode, generator, call_log, cache_params, response_format, n)
+    if 'result' in call:
+        if on_chunk is not None and call['result']:
+            on_chunk(call['result'])
+        return call['result']
+    cache_key = call['cache_key']
+    
+    async def fetch():
+        async with _async_process_lock(cache_key, deadline):
+            shared_result = await asyncio.to_thread(cache.get, cache_key)
+            if shared_result:
+                return shared_result, True
+            call['usage'] = {}
+            if on_chunk is None:
+                fresh_result = await _hedged_completion_async(call['optimized_system'], call['optimized_user'], max_tokens, temperature, model, stop_chars, generator, deadline, response_format, n, call['usage'])
+            else:
+                fresh_result = await _request_completion_async(call['optimized_system'], call['optimized_user'], max_tokens, temperature, model, on_chunk, stop_chars, deadline, response_format, n, call['usage'])
+            call['streamed'] = on_chunk is not None
+            await asyncio.to_thread(cache.set, cache_key, fresh_result)
+            return fresh_result, False
+    
+    try:
+        (result, filled_elsewhere), coalesced = await async_single_flight.do(cache_key, fetch, deadline)
+    except Exception as e:
+        result = _fail_call(call, e)
+    else:
+        result = _finish_call(call, result, filled_elsewhere, coalesced)
+    if on_chunk is not None and result and not call.get('streamed'):
+        on_chunk(result)
+    return result
+
+BATCH_GENERATORS = {"titles"}
+batch_processor = None
+
+def _send_batch(requests):
+    start_time = time.time()
+    batch_system, batch_prompt = BatchProcessor.create_batch_prompt(requests)
+    max_tokens = min(sum(req['max_tokens'] for req in requests) + 20 * len(requests), 4000)
+    usage = {}
+    try:
+        raw = _request_completion(batch_system, batch_prompt, max_tokens, requests[0]['temperature'], requests[0]['model'], usage=usage)
+    except Exception:
+        analytics.record_request(0, 0, time.time() - start_time, error=True)
+        raise
+    contents = BatchProcessor.split_batch_response(raw, len(requests))
+    for req, content in zip(requests, contents):
+        if content is not None:
+            cache.set(req['cache_key'], content)
+    
+    prompt_tokens, completion_tokens = _call_tokens(usage, batch_system, batch_prompt, raw)
+    cost = estimate_cost(prompt_tokens, completion_tokens, requests[0]['model'])
+    analytics.record_request(cost, prompt_tokens + completion_tokens, time.time() - start_time)
+    analytics.metrics['batched_requests'] += sum(1 for content in contents if content is not None)
+    print(f"[Batch] Sent {len(requests)} {requests[0]['type']} requests in one completion, {sum(1 for content in contents if content is not None)} answered")
+    return contents
+
+def enable_batching(window_ms=50, max_batch=8, max_batch_tokens=3000):
+    global batch_processor
+    batch_processor = BatchProcessor(_send_batch, window_ms / 1000, max_batch, max_batch_tokens) if window_ms > 0 else None
+    return batch_processor
+
+def batched_api_call(system_msg, user_msg, max_tokens, temperature, model="gpt-3.5-turbo", cost_mode="balanced", generator=None, call_log=None, cache_params=None, deadline=None, response_format=None, n=1):
+    # The batch prompt merges several requests into one plain-text completion,
+    # so structured output and multiple choices always go through smart_api_call.
+    if batch_processor is None or n > 1 or response_format is not None:
+        return smart_api_call(system_msg, user_msg, max_tokens, temperature, model, cost_mode, generator, call_log, cache_params, deadline=deadline, response_format=response_format, n=n)
+    call = _prepare_call(system_msg, user_msg, max_tokens, temperature, model, cost_mode, generator, call_log, cache_params)
+    if 'result' in call:
+        return call['result']
+    call['deadline'] = deadline
+    
+    future = batch_processor.submit({
+        'type': generator,
+        'system': call['optimized_system'],
+        'prompt': call['optimized_user'],
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+        'model': model,
+        'cache_key': call['cache_key']
+    })
+    try:
+        result, batch_size = future.result(None if deadline is None else max(deadline - time.time(), 0))
+    except Exception as e:
+        if not future.done():
+            e = DeadlineExceeded("Time budget exhausted waiting for a batched completion")
+        return _fail_call(call, e)
+    if result is None:
+        return _single_api_call(call)
+    
+    if call['similarity_threshold'] is not None:
+        similarity_cache.add(call['similarity_namespace'], call['similarity_text'], call['cache_key'])
+    if call_log is not None:
+        call_log.append({'cache': 'batched', 'batch_size': batch_size, 'prompt_tokens': count_prompt_tokens(call['optimized_system'], call['optimized_user']), 'completion_tokens': count_tokens(result)})
+    return result
+
+if os.getenv("SMART_BATCH_WINDOW_MS"):
+    enable_batching(float(os.getenv("SMART_BATCH_WINDOW_MS")), int(os.getenv("SMART_BATCH_MAX_SIZE", "8")))
+
+def _first_chunk_timer(on_chunk):
+    marks = {}
+    if on_chunk is None:
+        return None, marks
+    def emit(text):
+        marks.setdefault('first', time.time())
+        on_chunk(text)
+    return emit, marks
+
+def _fresh_call(call_log):
+    return bool(call_log) and call_log[-1]['cache'] == 'miss'
+
+def _fresh_completion_tokens(call_log, text):
+    return call_log[-1].get('completion_tokens') or count_tokens(text)
+
+def _sent_tokens(call_log):
+    # Tokens of the prompts actually sent (after compression) and of the replies
+    # received, from API usage where available; cache hits send nothing.
+    sent = [c for c in call_log if 'prompt_tokens' in c]
+    return sum(c['prompt_tokens'] for c in sent), sum(c['completion_tokens'] for c in sent)
+
+def _chat_step(*args, **kwargs):
+    return ("chat", args, kwargs)
+
+def _image_step(*args, **kwargs):
+    return ("image", args, kwargs)
+
+def _run_steps(steps):
+    result, error = None, None
+    while True:
+        try:
+            kind, args, kwargs = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result, error = None, None
+        try:
+            if kind == "chat" and batch_processor is not None and kwargs.get("generator") in BATCH_GENERATORS:
+                result = batched_api_call(*args, **kwargs)
+            elif kind == "chat":
+                result = smart_api_call(*args, **kwargs)
+            else:
+                result = single_flight.do(args[0], lambda: _generate_image_blob(*args, **kwargs), kwargs.get("deadline"))
+        except Exception as e:
+            if isinstance(e, DeadlineExceeded):
+                analytics.metrics['deadline_exceeded'] += 1
+            error = e
+
+async def _run_steps_async(steps):
+    result, error = None, None
+    while True:
+        try:
+            kind, args, kwargs = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result, error = None, None
+        try:
+            if kind == "chat":
+                result = await async_smart_api_call(*args, **kwargs)
+            else:
+                result = await async_single_flight.do(args[0], lambda: _generate_image_blob_async(*args, **kwargs), kwargs.get("deadline"))
         except Exception as e:
-            if attempt == max_retries - 1:
-                analytics.record_request(0, 0, time.time() - start_time, error=True)
-                raise e
-            time.sleep(2 ** attempt)
+            if isinstance(e, DeadlineExceeded):
+                analytics.metrics['deadline_exceeded'] += 1
+            error = e
 
 def get_title_examples(category, event_type, tone):
     examples = {
@@ -260,6 +2459,59 @@ def get_title_examples(category, event_type, tone):
         return examples[key]
     return [f"{category} Excellence Summit", f"{event_type} Innovation Forum", f"Advanced {category} Workshop"]
 
+CATEGORY_OPTIONS = ["Select event category", "Technology", "Business", "Education", "Health", "Entertainment", "Sports", "Arts & Culture", "Other"]
+EVENT_TYPE_OPTIONS = ["Select event type", "Conference", "Workshop", "Seminar", "Webinar", "Festival", "Exhibition", "Meetup", "Other"]
+TONE_OPTIONS = ["Select tone of event", "Professional", "Casual", "Formal", "Creative", "Premium", "Innovative", "Friendly", "Corporate", "Other"]
+
+def suggest_optimal_settings(category, event_type):
+    suggestions = {
+        ("Technology", "Conference"): {"tone": "Professional", "titles": 5, "desc_length": 1200},
+        ("Technology", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 800},
+        ("Technology", "Seminar"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
+        ("Technology", "Webinar"): {"tone": "Innovative", "titles": 4, "desc_length": 900},
+        ("Technology", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1100},
+        ("Technology", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
+        ("Business", "Conference"): {"tone": "Professional", "titles": 5, "desc_length": 1400},
+        ("Business", "Workshop"): {"tone": "Formal", "titles": 4, "desc_length": 900},
+        ("Business", "Seminar"): {"tone": "Formal", "titles": 3, "desc_length": 1000},
+        ("Business", "Webinar"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
+        ("Business", "Festival"): {"tone": "Professional", "titles": 4, "desc_length": 1200},
+        ("Business", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1100},
+        ("Education", "Conference"): {"tone": "Innovative", "titles": 5, "desc_length": 1400},
+        ("Education", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 900},
+        ("Education", "Seminar"): {"tone": "Innovative", "titles": 4, "desc_length": 1100},
+        ("Education", "Webinar"): {"tone": "Creative", "titles": 5, "desc_length": 1000},
+        ("Education", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1200},
+        ("Education", "Exhibition"): {"tone": "Innovative", "titles": 4, "desc_length": 1000},
+        ("Health", "Conference"): {"tone": "Professional", "titles": 4, "desc_length": 1300},
+        ("Health", "Workshop"): {"tone": "Friendly", "titles": 4, "desc_length": 900},
+        ("Health", "Seminar"): {"tone": "Professional", "titles": 3, "desc_length": 800},
+        ("Health", "Webinar"): {"tone": "Friendly", "titles": 4, "desc_length": 900},
+        ("Health", "Festival"): {"tone": "Friendly", "titles": 5, "desc_length": 1100},
+        ("Health", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
+        ("Entertainment", "Conference"): {"tone": "Creative", "titles": 4, "desc_length": 1100},
+        ("Entertainment", "Workshop"): {"tone": "Casual", "titles": 4, "desc_length": 800},
+        ("Entertainment", "Seminar"): {"tone": "Creative", "titles": 3, "desc_length": 900},
+        ("Entertainment", "Webinar"): {"tone": "Casual", "titles": 4, "desc_length": 800},
+        ("Entertainment", "Festival"): {"tone": "Casual", "titles": 5, "desc_length": 1000},
+        ("Entertainment", "Exhibition"): {"tone": "Creative", "titles": 5, "desc_length": 1100},
+        ("Sports", "Conference"): {"tone": "Professional", "titles": 4, "desc_length": 1200},
+        ("Sports", "Workshop"): {"tone": "Professional", "titles": 4, "desc_length": 900},
+        ("Sports", "Seminar"): {"tone": "Professional", "titles": 3, "desc_length": 800},
+        ("Sports", "Webinar"): {"tone": "Professional", "titles": 4, "desc_length": 900},
+        ("Sports", "Festival"): {"tone": "Casual", "titles": 5, "desc_length": 1100},
+        ("Sports", "Exhibition"): {"tone": "Professional", "titles": 4, "desc_length": 1000},
+        ("Arts & Culture", "Conference"): {"tone": "Creative", "titles": 4, "desc_length": 1200},
+        ("Arts & Culture", "Workshop"): {"tone": "Creative", "titles": 4, "desc_length": 900},
+        ("Arts & Culture", "Seminar"): {"tone": "Creative", "titles": 3, "desc_length": 900},
+        ("Arts & Culture", "Webinar"): {"tone": "Creative", "titles": 4, "desc_length": 800},
+        ("Arts & Culture", "Festival"): {"tone": "Creative", "titles": 5, "desc_length": 1200},
+        ("Arts & Culture", "Exhibition"): {"tone": "Creative", "titles": 5, "desc_length": 1100}
+    }
+    
+    key = (category, event_type)
+    return suggestions.get(key, {"tone": "Professional", "titles": 3, "desc_length": 800})
+
 def validate_inputs(category, event_type, tone, num_titles=3, context=None):
     errors = []
     warnings = []
@@ -275,127 +2527,210 @@ def validate_inputs(category, event_type, tone, num_titles=3, context=None):
         warnings.append("Context is very long - may increase costs")
     return errors, warnings
 
-def generate_titles(category, event_type, tone, num_titles=5, context=None, cost_mode="balanced"):
+TITLE_OUTPUT_MODES = ("text", "json", "candidates")
+TITLE_OUTPUT_MODE = os.getenv("TITLE_OUTPUT_MODE", "json")
+TITLE_CANDIDATES = max(2, int(os.getenv("TITLE_CANDIDATES", "3")))
+TITLE_JSON_SPARES = 2
+
+def _title_items(raw):
+    try:
+        parsed = json.loads(clean_json_output(raw))
+    except Exception as e:
+        lines = raw.replace('[', '').replace(']', '').replace('"', '').split(',')
+        items = [line.strip().strip('"').strip("'").strip('-').strip('1234567890.').strip() for line in lines]
+        return [item for item in items if item], str(e)
+    if isinstance(parsed, dict):
+        parsed = parsed.get("titles")
+    if not isinstance(parsed, list):
+        return [], "JSON is not a list"
+    return [str(t).strip() for t in parsed if isinstance(t, str) and t.strip()], None
+
+def _add_titles(titles, seen, items, limit):
+    for t in items:
+        if len(titles) >= limit:
+            break
+        if 3 <= len(t.split()) <= 6 and t.lower() not in seen:
+            titles.append(t)
+            seen.add(t.lower())
+
+prompt_templates.register(
+    "titles/economy",
+    "Event title generator. 3-6 words each, no colons. JSON format. Each title must be unique, creative, and use different wording. Avoid repeating phrases or structures. No emojis or decorative symbols.",
+    "Generate {ask} creative, unique {tone} event titles for {category} {event_type}.{context}"
+)
+prompt_templates.register(
+    "titles/balanced",
+    """Professional event title generator.
+
+REQUIREMENTS:
+- Generate EXACTLY the number of titles requested
+- Length: 3-6 words each
+- Format: JSON array only
+- Each title must be unique and use different words or focus
+- Avoid repeating phrases or structures""",
+    """Create EXACTLY {ask} {tone} titles for {category} {event_type}.
+Style: {tone}, memorable
+Examples: {examples}{context}"""
+)
+prompt_templates.register(
+    "titles/premium",
+    """Expert event marketer writing compelling event titles.
+
+CRITICAL REQUIREMENTS:
+- Generate EXACTLY the number of titles requested, no more, no less
+- Each title must be 3-6 words long
+- Each title must be unique and creative
+- Use different words, phrases, and focus areas for each title
+- Format as a clean JSON array: ["Title 1", "Title 2", "Title 3"]
+- NO explanations, NO extra text, just the JSON array
+
+Examples of diverse titles:
+["Innovate Now Summit", "Future Leaders Forum", "Tech Vision Expo"]
+["Business Growth Bootcamp", "Leadership Mastery Workshop", "Strategic Success Seminar"]
+["Learning Revolution Conference", "Education Innovation Forum", "Teaching Excellence Expo"]""",
+    """Generate EXACTLY {ask} compelling {tone} titles for {category} {event_type}.
+Style: {tone}, memorable, actionable{context}"""
+)
+prompt_templates.register(
+    "titles/economy/json",
+    'Event title generator. 3-6 words each, no colons. Each title must be unique, creative, and use different wording. Avoid repeating phrases or structures. No emojis or decorative symbols. Reply with a JSON object: {"titles": ["Title 1", "Title 2"]}',
+    "Generate {ask} creative, unique {tone} event titles for {category} {event_type}.{context}"
+)
+prompt_templates.register(
+    "titles/balanced/json",
+    """Professional event title generator.
+
+REQUIREMENTS:
+- Generate the number of titles requested
+- Length: 3-6 words each
+- Format: JSON object only, {"titles": ["Title 1", "Title 2"]}
+- Each title must be unique and use different words or focus
+- Avoid repeating phrases or structures""",
+    """Create {ask} {tone} titles for {category} {event_type}.
+Style: {tone}, memorable
+Examples: {examples}{context}"""
+)
+prompt_templates.register(
+    "titles/premium/json",
+    """Expert event marketer writing compelling event titles.
+
+CRITICAL REQUIREMENTS:
+- Generate the number of titles requested
+- Each title must be 3-6 words long
+- Each title must be unique and creative
+- Use different words, phrases, and focus areas for each title
+- Format as a clean JSON object: {"titles": ["Title 1", "Title 2", "Title 3"]}
+- NO explanations, NO extra text, just the JSON object
+
+Examples of diverse title sets:
+Innovate Now Summit, Future Leaders Forum, Tech Vision Expo
+Business Growth Bootcamp, Leadership Mastery Workshop, Strategic Success Seminar
+Learning Revolution Conference, Education Innovation Forum, Teaching Excellence Expo""",
+    """Generate {ask} compelling {tone} titles for {category} {event_type}.
+Style: {tone}, memorable, actionable{context}"""
+)
+
+def _titles_steps(category, event_type, tone, num_titles=5, context=None, cost_mode="balanced", deadline=None, output_mode=None):
     errors, warnings = validate_inputs(category, event_type, tone, num_titles, context)
+    output_mode = output_mode or TITLE_OUTPUT_MODE
+    if output_mode not in TITLE_OUTPUT_MODES:
+        errors.append(f"Unknown title output mode: {output_mode} (expected one of {', '.join(TITLE_OUTPUT_MODES)})")
     if errors:
         return [], {"errors": errors, "warnings": warnings}
     
     num_titles = max(1, min(int(num_titles), 5))
-    diversity_instruction = "Each title must be unique, creative, and use different wording. Avoid repeating phrases or structures. No emojis or decorative symbols."
+    # json mode asks for a couple of spare titles in a {"titles": [...]} object,
+    # so its prompts come from the /json templates without the array wording.
+    json_mode = output_mode == "json"
+    ask = num_titles + TITLE_JSON_SPARES if json_mode else num_titles
+    template_suffix = "/json" if json_mode else ""
     
     if cost_mode == "economy":
         context_str = f" Focus: {context}" if context else ""
-        system_msg = f"Generate {num_titles} creative, unique {tone.lower()} event titles for {category} {event_type}. 3-6 words each, no colons. JSON format. {diversity_instruction}{context_str}"
-        user_msg = f"Create {num_titles} unique, creative titles for {category} {event_type} ({tone}){context_str}"
-        max_tokens = 15 * num_titles + 40
+        system_msg = prompt_templates.render("titles/economy" + template_suffix, ask=ask, tone=tone.lower(), category=category, event_type=event_type, context=context_str)
+        user_msg = f"Create {ask} unique, creative titles for {category} {event_type} ({tone}){context_str}"
+        max_tokens = 15 * ask + 40
         temperature = 0.85
     elif cost_mode == "premium":
-        examples = get_title_examples(category, event_type, tone)
-        example_block = "\n".join([
-            "[\"Innovate Now Summit\", \"Future Leaders Forum\", \"Tech Vision Expo\"]",
-            "[\"Business Growth Bootcamp\", \"Leadership Mastery Workshop\", \"Strategic Success Seminar\"]",
-            "[\"Learning Revolution Conference\", \"Education Innovation Forum\", \"Teaching Excellence Expo\"]"
-        ])
         context_str = f" Context: {context}" if context else ""
-        system_msg = f"""Expert event marketer. Generate EXACTLY {num_titles} compelling {tone.lower()} titles for {category} {event_type}.
-
-CRITICAL REQUIREMENTS:
-- Generate EXACTLY {num_titles} titles, no more, no less
-- Each title must be 3-6 words long
-- Each title must be unique and creative
-- Use different words, phrases, and focus areas for each title
-- Format as a clean JSON array: ["Title 1", "Title 2", "Title 3"]
-- NO explanations, NO extra text, just the JSON array
-
-Examples of diverse titles:
-{example_block}
-
-Style: {tone.lower()}, memorable, actionable{context_str}"""
-        user_msg = f"Generate EXACTLY {num_titles} exceptional, unique titles for {category} {event_type} with {tone} tone. Return only a JSON array.{context_str}"
-        max_tokens = 20 * num_titles + 60
+        system_msg = prompt_templates.render("titles/premium" + template_suffix, ask=ask, tone=tone.lower(), category=category, event_type=event_type, context=context_str)
+        if json_mode:
+            user_msg = f"Generate {ask} exceptional, unique titles for {category} {event_type} with {tone} tone.{context_str}"
+        else:
+            user_msg = f"Generate EXACTLY {ask} exceptional, unique titles for {category} {event_type} with {tone} tone. Return only a JSON array.{context_str}"
+        max_tokens = 20 * ask + 60
         temperature = 0.9
     else:
         examples = get_title_examples(category, event_type, tone)
         context_str = f" Focus: {context}" if context else ""
-        system_msg = f"""Professional event title generator. Create EXACTLY {num_titles} {tone.lower()} titles for {category} {event_type}.
-
-REQUIREMENTS:
-- Generate EXACTLY {num_titles} titles
-- Length: 3-6 words each
-- Style: {tone.lower()}, memorable
-- Format: JSON array only
-- Each title must be unique and use different words or focus
-- Avoid repeating phrases or structures
-
-Examples: {examples[0]}, {examples[1]}{context_str}"""
-        user_msg = f"Generate EXACTLY {num_titles} unique titles: {category} {event_type} ({tone}). Return JSON array only.{context_str}"
-        max_tokens = 18 * num_titles + 50
+        system_msg = prompt_templates.render("titles/balanced" + template_suffix, ask=ask, tone=tone.lower(), category=category, event_type=event_type, examples=f"{examples[0]}, {examples[1]}", context=context_str)
+        if json_mode:
+            user_msg = f"Generate {ask} unique titles: {category} {event_type} ({tone}).{context_str}"
+        else:
+            user_msg = f"Generate EXACTLY {ask} unique titles: {category} {event_type} ({tone}). Return JSON array only.{context_str}"
+        max_tokens = 18 * ask + 50
         temperature = 0.85
     
-    start = time.time()
+    max_tokens = length_calibrator.max_tokens("titles", cost_mode, ask, max_tokens)
+    structured = {}
+    if json_mode:
+        structured["response_format"] = {"type": "json_object"}
+    elif output_mode == "candidates":
+        structured["n"] = TITLE_CANDIDATES
     
-    result = smart_api_call(system_msg, user_msg, max_tokens, temperature, cost_mode=cost_mode)
-    cleaned = clean_json_output(result)
-    titles = []
-    parsing_error = None
+    start = time.time()
+    call_log = []
     
+    title_params = {"category": category, "event_type": event_type, "tone": tone, "num_titles": num_titles, "context": context}
+    if output_mode != "text":
+        title_params.update(structured, output_mode=output_mode)
+    deadline_fallback = None
     try:
-        parsed = json.loads(cleaned)
-        if isinstance(parsed, list):
-            titles = [str(t).strip() for t in parsed if isinstance(t, str) and t.strip()]
-            titles = [t for t in titles if 3 <= len(t.split()) <= 6]
-        else:
-            parsing_error = "JSON is not a list"
-    except Exception as e:
-        parsing_error = str(e)
-        lines = result.replace('[', '').replace(']', '').replace('"', '').split(',')
-        for line in lines:
-            clean = line.strip().strip('"').strip("'").strip('-').strip('1234567890.').strip()
-            if clean and 3 <= len(clean.split()) <= 6 and clean not in titles:
-                titles.append(clean)
-                if len(titles) >= num_titles:
-                    break
+        result = yield _chat_step(system_msg, user_msg, max_tokens, temperature, cost_mode=cost_mode, generator="titles", call_log=call_log, cache_params=title_params, deadline=deadline, **structured)
+    except DeadlineExceeded:
+        result = ""
+        deadline_fallback = "static fallback titles"
     
-    seen = set()
-    unique_titles = []
-    for t in titles:
-        if t.lower() not in seen:
-            unique_titles.append(t)
-            seen.add(t.lower())
-    titles = unique_titles[:num_titles]
+    choices = [result]
+    if output_mode == "candidates" and result:
+        try:
+            choices = json.loads(result)
+        except ValueError:
+            pass
+        if not isinstance(choices, list) or not choices or not all(isinstance(choice, str) for choice in choices):
+            choices = [result]
     
+    titles = []
+    seen = set()
+    parsing_error = None
+    for i, choice in enumerate(choices):
+        items, error = _title_items(choice)
+        parsing_error = parsing_error or error
+        if i == 0:
+            exact_answer = []
+            _add_titles(exact_answer, set(), items[:num_titles], num_titles)
+            if output_mode != "candidates" and deadline_fallback is None and _fresh_call(call_log):
+                length_calibrator.record("titles", cost_mode, ask, ask, len(items), _fresh_completion_tokens(call_log, choice))
+        _add_titles(titles, seen, items, num_titles)
+    
+    follow_ups_avoided = 1 if output_mode != "text" and len(exact_answer) < num_titles else 0
     retry_count = 0
     max_retries = 2 if cost_mode == "premium" else 1
     
-    while len(titles) < num_titles and retry_count < max_retries:
+    while output_mode == "text" and len(titles) < num_titles and retry_count < max_retries and deadline_fallback is None:
         retry_count += 1
         needed = num_titles - len(titles)
         
         retry_system = system_msg.replace(f"EXACTLY {num_titles}", f"EXACTLY {needed} additional")
         retry_user = f"Generate {needed} more unique titles for {category} {event_type} ({tone}). Avoid these existing titles: {', '.join(titles)}. Return JSON array only."
         
-        result2 = smart_api_call(retry_system, retry_user, max_tokens + 20, temperature + 0.1, cost_mode=cost_mode)
-        cleaned2 = clean_json_output(result2)
-        
+        retry_params = dict(title_params, stage="topup", needed=needed, existing=sorted(t.lower() for t in titles))
         try:
-            parsed2 = json.loads(cleaned2)
-            if isinstance(parsed2, list):
-                for t in parsed2:
-                    t = str(t).strip()
-                    if t and 3 <= len(t.split()) <= 6 and t.lower() not in seen:
-                        titles.append(t)
-                        seen.add(t.lower())
-                        if len(titles) >= num_titles:
-                            break
-        except Exception as e:
-            lines = result2.replace('[', '').replace(']', '').replace('"', '').split(',')
-            for line in lines:
-                clean = line.strip().strip('"').strip("'").strip('-').strip('1234567890.').strip()
-                if clean and 3 <= len(clean.split()) <= 6 and clean.lower() not in seen:
-                    titles.append(clean)
-                    seen.add(clean.lower())
-                    if len(titles) >= num_titles:
-                        break
+            result2 = yield _chat_step(retry_system, retry_user, max_tokens + 20, temperature + 0.1, cost_mode=cost_mode, generator="titles", call_log=call_log, cache_params=retry_params, deadline=deadline)
+        except DeadlineExceeded:
+            deadline_fallback = f"top-up stopped at {len(titles)} of {num_titles} titles, rest from static fallbacks"
+            break
+        _add_titles(titles, seen, _title_items(result2)[0], num_titles)
     
     titles = titles[:num_titles]
     
@@ -433,8 +2768,7 @@ Examples: {examples[0]}, {examples[1]}{context_str}"""
     
     end = time.time()
     
-    prompt_tokens = count_tokens(system_msg) + count_tokens(user_msg)
-    completion_tokens = count_tokens(result)
+    prompt_tokens, completion_tokens = _sent_tokens(call_log)
     total_tokens = prompt_tokens + completion_tokens
     cost = estimate_cost(prompt_tokens, completion_tokens)
     efficiency_score = len(titles) / cost if cost > 0 else 0
@@ -450,9 +2784,16 @@ Examples: {examples[0]}, {examples[1]}{context_str}"""
         "System prompt": system_msg,
         "User prompt": user_msg,
         "Retry count": retry_count,
+        "Output mode": output_mode,
+        "Candidates": TITLE_CANDIDATES if output_mode == "candidates" else 1,
+        "Follow-up calls avoided": follow_ups_avoided,
+        "Max tokens": max_tokens,
         "Titles requested": num_titles,
         "Titles generated": len(titles),
         "Cache hit": analytics.metrics['cache_hits'] > 0,
+        "Similarity hits": sum(1 for c in call_log if c['cache'] == 'similarity'),
+        "Stale served": sum(1 for c in call_log if c['cache'] in ('stale', 'stale-if-error')),
+        "Deadline fallback": deadline_fallback,
         "Overall efficiency": f"{analytics.get_efficiency_score():.1f}%"
     }
     
@@ -463,53 +2804,110 @@ Examples: {examples[0]}, {examples[1]}{context_str}"""
         warnings.append(f"JSON parsing issue: {parsing_error}")
     if retry_count > 0:
         warnings.append(f"Required {retry_count} retries to generate sufficient titles.")
+    if deadline_fallback:
+        warnings.append(f"Time budget exhausted - returned {deadline_fallback}.")
     
     if warnings:
         logs["Warnings"] = "; ".join(warnings)
     
     return titles, logs
 
-def generate_description(title, category, event_type, tone, context=None, max_chars=5000, cost_mode="balanced"):
+def generate_titles(category, event_type, tone, num_titles=5, context=None, cost_mode="balanced", timeout=None, output_mode=None):
+    return _run_steps(_titles_steps(category, event_type, tone, num_titles, context, cost_mode, _deadline(timeout), output_mode))
+
+async def async_generate_titles(category, event_type, tone, num_titles=5, context=None, cost_mode="balanced", timeout=None, output_mode=None):
+    return await _run_steps_async(_titles_steps(category, event_type, tone, num_titles, context, cost_mode, _deadline(timeout), output_mode))
+
+DESCRIPTION_END_INSTRUCTION = "Write in flowing paragraphs without bullet points or numbered lists. Use natural transitions between ideas. End with a strong call-to-action. No emojis or decorative symbols."
+PromptOptimizer.protect(DESCRIPTION_END_INSTRUCTION)
+
+prompt_templates.register(
+    "description/economy",
+    f"Event description copywriter. Include benefits and call-to-action. Use all available space. {DESCRIPTION_END_INSTRUCTION}",
+    "Write compelling {tone} description for '{title}' - {category} {event_type}. EXACTLY {chars} characters.{context}"
+)
+prompt_templates.register(
+    "description/balanced",
+    f"""Professional copywriter for event descriptions.
+Include: value proposition, benefits, call-to-action
+Use all available space, do not stop early.
+{DESCRIPTION_END_INSTRUCTION}""",
+    """Create engaging {tone} description for '{title}' - {category} {event_type}.
+Length: EXACTLY {chars} characters
+Style: {tone}, compelling{context}"""
+)
+prompt_templates.register(
+    "description/premium",
+    f"""Expert copywriter for event descriptions.
+Structure: Hook → Problem → Solution → Benefits → CTA
+Style: persuasive, action-oriented
+TARGET: Use the full character count available. Do not stop early. Fill all space. {DESCRIPTION_END_INSTRUCTION}""",
+    """Write a compelling {chars}-character description for '{title}' - {tone} {event_type} in {category}.
+Tone: {tone}{context}"""
+)
+
+def _description_steps(title, category, event_type, tone, context=None, max_chars=5000, cost_mode="balanced", on_chunk=None, deadline=None):
     max_chars = max(100, min(int(max_chars), 5000))
+    asked_chars = length_calibrator.prompt_target("description", cost_mode, max_chars)
     
-    end_instruction = "Write in flowing paragraphs without bullet points or numbered lists. Use natural transitions between ideas. End with a strong call-to-action. No emojis or decorative symbols."
     if cost_mode == "economy":
         context_str = f" Focus: {context}" if context else ""
-        system_msg = f"Write compelling {tone.lower()} description for '{title}' - {category} {event_type}. EXACTLY {max_chars} characters. Include benefits and call-to-action. Use all available space. {end_instruction}{context_str}"
-        user_msg = f"Description for: {title} ({category} {event_type}, {tone}) (MUST be {max_chars} characters){context_str}"
-        max_tokens = int(max_chars/2.8) + 50
+        system_msg = prompt_templates.render("description/economy", title=title, tone=tone.lower(), category=category, event_type=event_type, chars=asked_chars, context=context_str)
+        user_msg = f"Description for: {title} ({category} {event_type}, {tone}) (MUST be {asked_chars} characters){context_str}"
+        max_tokens = length_calibrator.max_tokens("description", cost_mode, max_chars, int(max_chars/2.8) + 50)
         temperature = 0.7
     elif cost_mode == "premium":
         context_str = f" Focus: {context}" if context else ""
-        system_msg = f"""Expert copywriter. Write compelling {max_chars}-character description for '{title}' - {tone.lower()} {event_type} in {category}.
-Structure: Hook → Problem → Solution → Benefits → CTA
-Tone: {tone.lower()}, persuasive, action-oriented
-TARGET: Use the full {max_chars} characters available. Do not stop early. Fill all space. {end_instruction}{context_str}"""
-        user_msg = f"Write description for '{title}' ({category} {event_type}, {tone}). MUST be as close as possible to {max_chars} characters."
-        max_tokens = int(max_chars/2.5) + 100
+        system_msg = prompt_templates.render("description/premium", title=title, tone=tone.lower(), category=category, event_type=event_type, chars=asked_chars, context=context_str)
+        user_msg = f"Write description for '{title}' ({category} {event_type}, {tone}). MUST be as close as possible to {asked_chars} characters."
+        max_tokens = length_calibrator.max_tokens("description", cost_mode, max_chars, int(max_chars/2.5) + 100)
         temperature = 0.75
     else:
         context_str = f" Focus: {context}" if context else ""
-        system_msg = f"""Professional copywriter. Create engaging {tone.lower()} description for '{title}' - {category} {event_type}.
-Length: EXACTLY {max_chars} characters (use all available space, do not stop early)
-Include: value proposition, benefits, call-to-action
-Style: {tone.lower()}, compelling{context_str}
-{end_instruction}"""
-        user_msg = f"Write description: '{title}' ({category} {event_type}, {tone}). Target {max_chars} chars. Use all available space." + (f" {context_str}" if context_str else "")
-        max_tokens = int(max_chars/2.6) + 75
+        system_msg = prompt_templates.render("description/balanced", title=title, tone=tone.lower(), category=category, event_type=event_type, chars=asked_chars, context=context_str)
+        user_msg = f"Write description: '{title}' ({category} {event_type}, {tone}). Target {asked_chars} chars. Use all available space." + (f" {context_str}" if context_str else "")
+        max_tokens = length_calibrator.max_tokens("description", cost_mode, max_chars, int(max_chars/2.6) + 75)
         temperature = 0.72
     
     start = time.time()
+    call_log = []
+    emit, chunk_marks = _first_chunk_timer(on_chunk)
+    deadline_fallback = None
     
     try:
-        description = smart_api_call(system_msg, user_msg, max_tokens, temperature, cost_mode=cost_mode)
+        description_params = {"title": title, "category": category, "event_type": event_type, "tone": tone, "context": context, "max_chars": max_chars}
+        try:
+            description = yield _chat_step(system_msg, user_msg, max_tokens, temperature, cost_mode=cost_mode, generator="description", call_log=call_log, cache_params=description_params, on_chunk=emit, stop_chars=max_chars, deadline=deadline)
+        except DeadlineExceeded as e:
+            partial = e.partial or ""
+            description = partial[:partial.rfind('.') + 1]
+            if description:
+                deadline_fallback = "partial description"
+            else:
+                description = f"Join us for {title}, a {tone.lower()} {category} {event_type.lower()} built around practical insight and real connections. Reserve your place today."
+                deadline_fallback = "static description"
+                if emit:
+                    emit(description)
+        if deadline_fallback is None and _fresh_call(call_log):
+            length_calibrator.record("description", cost_mode, max_chars, asked_chars, len(description), _fresh_completion_tokens(call_log, description), complete=len(description) < 0.98 * max_chars)
         
-        if len(description) < int(0.75 * max_chars) and cost_mode != "economy":
+        extension_calls = 0
+        if deadline_fallback is None and len(description) < int(0.75 * max_chars) and cost_mode != "economy":
+            extension_calls += 1
             remaining_chars = max_chars - len(description)
             extend_system = f"You are extending an event description. Add {remaining_chars} more characters to make it more detailed and compelling."
             extend_user = f"Current description: {description}\n\nExpand this by adding more details, benefits, or call-to-action to reach closer to {max_chars} total characters."
             
-            extension = smart_api_call(extend_system, extend_user, int(remaining_chars/2.5) + 30, temperature, cost_mode=cost_mode)
+            extension_params = dict(description_params, stage="extension", description=description)
+            extension_separator = [" "]
+            def emit_extension(text):
+                emit(extension_separator.pop() + text if extension_separator else text)
+            try:
+                extension = yield _chat_step(extend_system, extend_user, length_calibrator.max_tokens("description", cost_mode, remaining_chars, int(remaining_chars/2.5) + 30), temperature, cost_mode=cost_mode, generator="description", call_log=call_log, cache_params=extension_params, on_chunk=emit_extension if emit else None, stop_chars=remaining_chars, deadline=deadline)
+            except DeadlineExceeded as e:
+                partial = e.partial or ""
+                extension = partial[:partial.rfind('.') + 1]
+                deadline_fallback = "partial extension" if extension else "description without extension"
             if extension and not extension.lower().startswith(description.lower()[:20]):
                 description = description + " " + extension
         
@@ -518,8 +2916,7 @@ Style: {tone.lower()}, compelling{context_str}
     
     end = time.time()
     
-    prompt_tokens = count_tokens(system_msg) + count_tokens(user_msg)
-    completion_tokens = count_tokens(description)
+    prompt_tokens, completion_tokens = _sent_tokens(call_log)
     total_tokens = prompt_tokens + completion_tokens
     cost = estimate_cost(prompt_tokens, completion_tokens)
     too_short = len(description) < int(0.6 * max_chars)
@@ -542,6 +2939,13 @@ Style: {tone.lower()}, compelling{context_str}
         "Target utilization": f"{len(description)/max_chars*100:.1f}%",
         "Cost mode": cost_mode,
         "Shorter than requested": too_short,
+        "Prompted length (chars)": asked_chars,
+        "Max tokens": max_tokens,
+        "Extension calls": extension_calls,
+        "Time to first chunk (s)": round(chunk_marks['first'] - start, 2) if 'first' in chunk_marks else None,
+        "Similarity hits": sum(1 for c in call_log if c['cache'] == 'similarity'),
+        "Stale served": sum(1 for c in call_log if c['cache'] in ('stale', 'stale-if-error')),
+        "Deadline fallback": deadline_fallback,
         "category": category,
         "event_type": event_type,
         "tone": tone,
@@ -554,7 +2958,32 @@ Style: {tone.lower()}, compelling{context_str}
     
     return description, logs
 
-def generate_faqs(title, description, category, event_type, tone, context=None, cost_mode="balanced"):
+def generate_description(title, category, event_type, tone, context=None, max_chars=5000, cost_mode="balanced", on_chunk=None, timeout=None):
+    return _run_steps(_description_steps(title, category, event_type, tone, context, max_chars, cost_mode, on_chunk, _deadline(timeout)))
+
+async def async_generate_description(title, category, event_type, tone, context=None, max_chars=5000, cost_mode="balanced", on_chunk=None, timeout=None):
+    return await _run_steps_async(_description_steps(title, category, event_type, tone, context, max_chars, cost_mode, on_chunk, _deadline(timeout)))
+
+prompt_templates.register(
+    "faqs",
+    """You are an expert event manager. Your task is to create professional, clear, and helpful FAQs for the event described by the user.
+
+Requirements:
+1. Create at least 5 FAQs that directly address likely questions about this specific event
+2. Make answers informative, helpful, and in the event's tone
+3. Focus on practical questions attendees would actually ask
+4. Include questions about logistics, content, requirements, and benefits
+5. Use professional language without emojis or decorative symbols
+
+Example FAQ format:
+Q: What is the dress code for the event?
+A: Business casual attire is recommended.
+Q: Will meals be provided?
+A: Yes, lunch and refreshments will be served.""",
+    "You specialize in {category} {event_type}s. Match the {tone} tone of this {event_type}."
+)
+
+def _faqs_steps(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, deadline=None):
     event_specific_faqs = {
         "Conference": [
             {"q": "What is the dress code for the conference?", "a": "Business casual attire is recommended for all conference sessions and networking events."},
@@ -593,26 +3022,23 @@ def generate_faqs(title, description, category, event_type, tone, context=None,
         for faq in event_specific_faqs[event_type][:2]:
             few_shot += f"Q: {faq['q']}\nA: {faq['a']}\n"
     
-    few_shot += (
-        "Q: What is the dress code for the event?\nA: The dress code is business casual.\n"
-        "Q: Will meals be provided?\nA: Yes, lunch and refreshments will be served.\n"
-        "Q: Can I transfer my ticket to someone else?\nA: Yes, please contact support to transfer your ticket.\n"
-        "Q: Is parking available at the venue?\nA: Yes, free parking is available for all attendees.\n"
-        "Q: Will the sessions be recorded?\nA: Yes, recordings will be shared after the event.\n"
-        "---\n"
-        "Example Refund Policy:\n"
-    )
+    general_faqs = [
+        {"q": "What is the dress code for the event?", "a": "The dress code is business casual."},
+        {"q": "Will meals be provided?", "a": "Yes, lunch and refreshments will be served."},
+        {"q": "Can I transfer my ticket to someone else?", "a": "Yes, please contact support to transfer your ticket."},
+        {"q": "Is parking available at the venue?", "a": "Yes, free parking is available for all attendees."},
+        {"q": "Will the sessions be recorded?", "a": "Yes, recordings will be shared after the event."}
+    ]
+    for faq in general_faqs:
+        few_shot += f"Q: {faq['q']}\nA: {faq['a']}\n"
+    few_shot += "---\nExample Refund Policy:\n"
     
     if event_type in refund_policies:
         few_shot += refund_policies[event_type] + "\n"
     else:
         few_shot += default_policy + "\n"
     
-    system_prompt = (
-        f"You are an expert event manager specializing in {category} {event_type}s. "
-        f"Your task is to create professional, clear, and helpful FAQs and a fair refund policy "
-        f"that matches the {tone.lower()} tone of this {event_type}."
-    )
+    system_prompt = prompt_templates.render("faqs", category=category, event_type=event_type, tone=tone.lower())
     
     user_prompt = (
         f"Based on the following event details, generate at least 5 relevant, clear, and professional FAQs with detailed answers.\n"
@@ -622,23 +3048,22 @@ def generate_faqs(title, description, category, event_type, tone, context=None,
         f"Event Type: {event_type}\n"
         f"Tone: {tone}\n"
         f"{f'Context: {context}' if context else ''}\n\n"
-        f"Requirements:\n"
-        f"1. Create at least 5 FAQs that directly address likely questions about this specific event\n"
-        f"2. Make answers informative, helpful, and in a {tone.lower()} tone\n"
-        f"3. Focus on practical questions attendees would actually ask\n"
-        f"4. Include questions about logistics, content, requirements, and benefits\n"
-        f"5. Use professional language without emojis or decorative symbols\n\n"
-        f"Example FAQ format:\n"
-        f"Q: What is the dress code for the event?\nA: Business casual attire is recommended.\n"
-        f"Q: Will meals be provided?\nA: Yes, lunch and refreshments will be served.\n\n"
         f"Now generate FAQs for this event. Format:\nQ: ...\nA: ...\n"
     )
     
     start = time.time()
+    call_log = []
+    emit, chunk_marks = _first_chunk_timer(on_chunk)
+    max_tokens = length_calibrator.max_tokens("faqs", cost_mode, 6, 1200)
+    deadline_fallback = None
     try:
-        output = smart_api_call(system_prompt, user_prompt, 1200, 0.7, cost_mode=cost_mode)
+        faq_params = {"title": title, "description": description, "category": category, "event_type": event_type, "tone": tone, "context": context}
+        output = yield _chat_step(system_prompt, user_prompt, max_tokens, 0.7, cost_mode=cost_mode, generator="faqs", call_log=call_log, cache_params=faq_params, on_chunk=emit, deadline=deadline)
+    except DeadlineExceeded as e:
+        output = e.partial or ""
+        deadline_fallback = "partial FAQs" if output else "static FAQs"
     except Exception as e:
-        return [], "", {"error": str(e)}
+        return [], {"error": str(e)}
     end = time.time()
     
     faqs = []
@@ -667,6 +3092,8 @@ def generate_faqs(title, description, category, event_type, tone, context=None,
     
     if current_question and current_answer:
         faqs.append({"question": current_question, "answer": current_answer})
+    if deadline_fallback is None and _fresh_call(call_log):
+        length_calibrator.record("faqs", cost_mode, 6, 6, len(faqs), _fresh_completion_tokens(call_log, output))
     
     if len(faqs) < 5 and event_type in event_specific_faqs:
         for faq in event_specific_faqs[event_type]:
@@ -675,8 +3102,14 @@ def generate_faqs(title, description, category, event_type, tone, context=None,
             if not any(f["question"].lower() == faq["q"].lower() for f in faqs):
                 faqs.append({"question": faq["q"], "answer": faq["a"]})
     
-    prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
-    completion_tokens = count_tokens(output)
+    if deadline_fallback:
+        for faq in general_faqs:
+            if len(faqs) >= 5:
+                break
+            if not any(f["question"].lower() == faq["q"].lower() for f in faqs):
+                faqs.append({"question": faq["q"], "answer": faq["a"]})
+    
+    prompt_tokens, completion_tokens = _sent_tokens(call_log)
     total_tokens = prompt_tokens + completion_tokens
     cost = estimate_cost(prompt_tokens, completion_tokens)
     logs = {
@@ -688,11 +3121,39 @@ def generate_faqs(title, description, category, event_type, tone, context=None,
         "Model": "gpt-3.5-turbo",
         "Prompt": user_prompt,
         "System prompt": system_prompt,
-        "Cost mode": cost_mode
+        "Cost mode": cost_mode,
+        "Similarity hits": sum(1 for c in call_log if c['cache'] == 'similarity'),
+        "Stale served": sum(1 for c in call_log if c['cache'] in ('stale', 'stale-if-error')),
+        "Time to first chunk (s)": round(chunk_marks['first'] - start, 2) if 'first' in chunk_marks else None,
+        "Max tokens": max_tokens,
+        "Deadline fallback": deadline_fallback
     }
     return faqs, logs
 
-def generate_refund_policy(title, description, category, event_type, tone, context=None, cost_mode="balanced"):
+def generate_faqs(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, timeout=None):
+    return _run_steps(_faqs_steps(title, description, category, event_type, tone, context, cost_mode, on_chunk, _deadline(timeout)))
+
+async def async_generate_faqs(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, timeout=None):
+    return await _run_steps_async(_faqs_steps(title, description, category, event_type, tone, context, cost_mode, on_chunk, _deadline(timeout)))
+
+prompt_templates.register(
+    "refund_policy",
+    """You are an expert event manager and legal advisor specializing in creating fair, clear, and professional refund policies. The policy should be clear, fair to both organizers and attendees, and legally sound.
+
+Requirements:
+1. Create a clear, professional refund policy appropriate for this event type
+2. Include specific timeframes for different refund percentages
+3. Address ticket transfers and cancellation procedures
+4. Use the event's tone while maintaining legal clarity
+5. Consider the event category and type when setting terms
+6. Use professional language without emojis or decorative symbols
+
+Example policy structure:
+Full refunds available up to X days before the event. Partial refunds available between X and Y days. No refunds within Y days. Transfer policies and contact information.""",
+    "Create a comprehensive refund policy appropriate for a {category} {event_type} with a {tone} tone."
+)
+
+def _refund_policy_steps(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, deadline=None):
     refund_policies = {
         "Conference": "Full refunds available up to 30 days before the event. 50% refund available between 30 and 14 days before the event. No refunds within 14 days of the event. Ticket transfers are permitted at any time.",
         "Workshop": "Full refunds available up to 14 days before the workshop. 50% refund available between 14 and 7 days before. No refunds within 7 days of the workshop. You may transfer your registration to another person at no cost.",
@@ -706,11 +3167,7 @@ def generate_refund_policy(title, description, category, event_type, tone, conte
     
     default_policy = "Full refunds available up to 14 days before the event. 50% refund available between 14 and 7 days before. No refunds within 7 days of the event. Ticket transfers are permitted at any time with written notice."
     
-    system_prompt = (
-        f"You are an expert event manager and legal advisor specializing in creating fair, clear, and professional refund policies. "
-        f"Create a comprehensive refund policy that is appropriate for a {category} {event_type} with a {tone.lower()} tone. "
-        f"The policy should be clear, fair to both organizers and attendees, and legally sound."
-    )
+    system_prompt = prompt_templates.render("refund_policy", category=category, event_type=event_type, tone=tone.lower())
     
     user_prompt = (
         f"Create a professional, clear, and fair refund policy for the following event:\n"
@@ -720,21 +3177,20 @@ def generate_refund_policy(title, description, category, event_type, tone, conte
         f"Event Type: {event_type}\n"
         f"Tone: {tone}\n"
         f"{f'Context: {context}' if context else ''}\n\n"
-        f"Requirements:\n"
-        f"1. Create a clear, professional refund policy appropriate for this event type\n"
-        f"2. Include specific timeframes for different refund percentages\n"
-        f"3. Address ticket transfers and cancellation procedures\n"
-        f"4. Use a {tone.lower()} tone while maintaining legal clarity\n"
-        f"5. Consider the event category and type when setting terms\n"
-        f"6. Use professional language without emojis or decorative symbols\n\n"
-        f"Example policy structure:\n"
-        f"Full refunds available up to X days before the event. Partial refunds available between X and Y days. No refunds within Y days. Transfer policies and contact information.\n\n"
         f"Generate a comprehensive refund policy for this {event_type}:"
     )
     
     start = time.time()
+    call_log = []
+    emit, chunk_marks = _first_chunk_timer(on_chunk)
+    deadline_fallback = None
     try:
-        refund_policy = smart_api_call(system_prompt, user_prompt, 600, 0.7, cost_mode=cost_mode)
+        refund_params = {"title": title, "description": description, "category": category, "event_type": event_type, "tone": tone, "context": context}
+        refund_policy = yield _chat_step(system_prompt, user_prompt, 600, 0.7, cost_mode=cost_mode, generator="refund_policy", call_log=call_log, cache_params=refund_params, on_chunk=emit, deadline=deadline)
+    except DeadlineExceeded as e:
+        partial = e.partial or ""
+        refund_policy = partial[:partial.rfind('.') + 1]
+        deadline_fallback = "partial refund policy" if len(refund_policy) >= 100 else "static refund policy"
     except Exception as e:
         refund_policy = refund_policies.get(event_type, default_policy)
     
@@ -743,8 +3199,7 @@ def generate_refund_policy(title, description, category, event_type, tone, conte
     if len(refund_policy) < 100:
         refund_policy = refund_policies.get(event_type, default_policy)
     
-    prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
-    completion_tokens = count_tokens(refund_policy)
+    prompt_tokens, completion_tokens = _sent_tokens(call_log)
     total_tokens = prompt_tokens + completion_tokens
     cost = estimate_cost(prompt_tokens, completion_tokens)
     
@@ -757,11 +3212,21 @@ def generate_refund_policy(title, description, category, event_type, tone, conte
         "Model": "gpt-3.5-turbo",
         "Prompt": user_prompt,
         "System prompt": system_prompt,
-        "Cost mode": cost_mode
+        "Cost mode": cost_mode,
+        "Similarity hits": sum(1 for c in call_log if c['cache'] == 'similarity'),
+        "Stale served": sum(1 for c in call_log if c['cache'] in ('stale', 'stale-if-error')),
+        "Time to first chunk (s)": round(chunk_marks['first'] - start, 2) if 'first' in chunk_marks else None,
+        "Deadline fallback": deadline_fallback
     }
     
     return refund_policy, logs
 
+def generate_refund_policy(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, timeout=None):
+    return _run_steps(_refund_policy_steps(title, description, category, event_type, tone, context, cost_mode, on_chunk, _deadline(timeout)))
+
+async def async_generate_refund_policy(title, description, category, event_type, tone, context=None, cost_mode="balanced", on_chunk=None, timeout=None):
+    return await _run_steps_async(_refund_policy_steps(title, description, category, event_type, tone, context, cost_mode, on_chunk, _deadline(timeout)))
+
 def get_flyer_examples(category, event_type, tone):
     examples = [
         {"title": "Tech Leadership Summit", "description": "A premier gathering for technology leaders to explore innovation and future trends.", "category": "Technology", "event_type": "Conference", "tone": "Professional", "style": "Photorealistic modern design, sleek blue and white gradient, 3D tech elements, crystal clear bold title, professional lighting, high-contrast readable text"},
@@ -869,7 +3334,84 @@ def extract_event_details(context):
     
     return details
 
-def generate_flyer_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1024x1024"):
+def _image_output(digest, output):
+    try:
+        if output == "path":
+            return image_blobs.path(digest)
+        if output == "buffer":
+            return image_blobs.open(digest)
+        return image_blobs.read(digest)
+    except OSError:
+        return None
+
+def _cached_image_digest(cache_key):
+    cached_result = cache.get(cache_key)
+    if not cached_result:
+        return None
+    if ImageBlobStore.is_digest(cached_result):
+        digest = cached_result
+    else:
+        try:
+            digest = image_blobs.put(base64.b64decode(cached_result))
+        except Exception:
+            return None
+        cache.set(cache_key, digest, pool="image")
+    return digest if image_blobs.path(digest) else None
+
+def load_cached_image(cache_key, output="bytes"):
+    digest = _cached_image_digest(cache_key)
+    if digest is None:
+        return None
+    return _image_output(digest, output)
+
+def _generate_image_blob(cache_key, prompt, image_size, cost_mode, label, deadline=None):
+    with _process_lock(cache_key, deadline):
+        digest = _cached_image_digest(cache_key)
+        if digest is not None:
+            return digest, True
+        
+        def attempt():
+            rate_limiter.acquire("dall-e-3", deadline=deadline)
+            response = client.images.generate(
+                model="dall-e-3",
+                prompt=prompt,
+                n=1,
+                size=image_size,
+                quality="hd" if cost_mode=="premium" else "standard",
+                response_format="b64_json",
+                **_request_timeout(deadline)
+            )
+            return image_blobs.put(base64.b64decode(response.data[0].b64_json))
+        
+        digest = image_retry.call(attempt, on_retry=_log_retry(f"DALL-E {label}"), deadline=deadline)
+        cache.set(cache_key, digest, pool="image")
+        return digest, False
+
+async def _generate_image_blob_async(cache_key, prompt, image_size, cost_mode, label, deadline=None):
+    async with _async_process_lock(cache_key, deadline):
+        digest = await asyncio.to_thread(_cached_image_digest, cache_key)
+        if digest is not None:
+            return digest, True
+        
+        async def attempt():
+            await rate_limiter.acquire_async("dall-e-3", deadline=deadline)
+            async with _async_slot(deadline):
+                response = await _async_openai_client().images.generate(
+                    model="dall-e-3",
+                    prompt=prompt,
+                    n=1,
+                    size=image_size,
+                    quality="hd" if cost_mode=="premium" else "standard",
+                    response_format="b64_json",
+                    **_request_timeout(deadline)
+                )
+            return await asyncio.to_thread(image_blobs.put, base64.b64decode(response.data[0].b64_json))
+        
+        digest = await image_retry.call_async(attempt, on_retry=_log_retry(f"DALL-E {label}"), deadline=deadline)
+        await asyncio.to_thread(cache.set, cache_key, digest, pool="image")
+        return digest, False
+
+def _flyer_image_steps(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1024x1024", output="bytes", deadline=None):
     example = get_flyer_examples(category, event_type, tone)
     event_details = extract_event_details(context)
     
@@ -968,53 +3510,34 @@ def generate_flyer_image(title, description, category, event_type, tone, context
     )
     
     if len(base_prompt) > 3500:
-        base_prompt = PromptOptimizer.compress_prompt(base_prompt, 0.4)
+        base_prompt = PromptOptimizer.compress_prompt(base_prompt, IMAGE_PROMPT_TOKEN_BUDGET)[0]
     
     prompt = base_prompt
     start = time.time()
     
-    cache_key = cache._get_cache_key(prompt, image_size, cost_mode, "flyer")
-    cached_result = cache.get(cache_key)
+    cache_key = cache.request_key("flyer", title=title, description=description, category=category, event_type=event_type, tone=tone, context=context, cost_mode=cost_mode, image_size=image_size)
+    image_url = load_cached_image(cache_key, output)
     
-    if cached_result:
+    if image_url is not None:
         analytics.record_request(0, 0, time.time() - start, from_cache=True)
-        import base64
-        try:
-            image_url = base64.b64decode(cached_result)
-            print(f"Cache hit - decoded {len(image_url)} bytes")
-        except Exception as e:
-            image_url = cached_result  # if already bytes
-            print(f"Cache hit - using cached bytes: {len(image_url) if hasattr(image_url, '__len__') else 'N/A'}")
+        print(f"Cache hit - serving image blob ({output})")
     else:
         print("No cache hit - making API call")
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = client.images.generate(
-                    model="dall-e-3",
-                    prompt=prompt,
-                    n=1,
-                    size=image_size,
-                    quality="hd" if cost_mode=="premium" else "standard",
-                    response_format="b64_json"
-                )
-                image_b64 = response.data[0].b64_json
-                import base64, io
-                image_bytes = base64.b64decode(image_b64)
-                cache.set(cache_key, image_b64)  # cache b64 string
-                image_url = image_bytes
-                print(f"API call successful - generated {len(image_url)} bytes")
-                
-                cost = 0.04 if cost_mode=="premium" else 0.02
-                analytics.record_request(cost, count_tokens(prompt), time.time() - start)
-                break
-            except Exception as e:
-                print(f"DALL-E Flyer Error (attempt {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
-                    analytics.record_request(0, 0, time.time() - start, error=True)
-                    print(f"All retries failed - returning empty bytes")
-                    return b"", {"error": str(e), "Time taken (s)": round(time.time() - start, 2)}
-                time.sleep(2 ** attempt)
+        try:
+            (digest, filled_elsewhere), coalesced = yield _image_step(cache_key, prompt, image_size, cost_mode, "Flyer", deadline=deadline)
+        except Exception as e:
+            analytics.record_request(0, 0, time.time() - start, error=True)
+            print("All retries failed - returning empty bytes")
+            return b"", {"error": str(e), "Time taken (s)": round(time.time() - start, 2), "Deadline fallback": "no image" if isinstance(e, DeadlineExceeded) else None}
+        image_url = _image_output(digest, output)
+        if coalesced or filled_elsewhere:
+            analytics.record_request(0, 0, time.time() - start, from_cache=True)
+            analytics.metrics['coalesced_calls'] += 1
+            print(f"Coalesced with in-flight generation - serving image blob ({output})")
+        else:
+            print(f"API call successful - stored image blob ({output})")
+            cost = 0.04 if cost_mode=="premium" else 0.02
+            analytics.record_request(cost, count_tokens(prompt), time.time() - start)
     end = time.time()
     prompt_tokens = count_tokens(prompt)
     completion_tokens = 0
@@ -1034,7 +3557,13 @@ def generate_flyer_image(title, description, category, event_type, tone, context
     print(f"Returning image_url: type={type(image_url)}, length={len(image_url) if hasattr(image_url, '__len__') else 'N/A'}")
     return image_url, logs
 
-def generate_banner_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1792x1024"):
+def generate_flyer_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1024x1024", output="bytes", timeout=None):
+    return _run_steps(_flyer_image_steps(title, description, category, event_type, tone, context, cost_mode, image_size, output, _deadline(timeout)))
+
+async def async_generate_flyer_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1024x1024", output="bytes", timeout=None):
+    return await _run_steps_async(_flyer_image_steps(title, description, category, event_type, tone, context, cost_mode, image_size, output, _deadline(timeout)))
+
+def _banner_image_steps(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1792x1024", output="bytes", deadline=None):
     example = get_flyer_examples(category, event_type, tone)
     event_details = extract_event_details(context)
     
@@ -1115,53 +3644,34 @@ def generate_banner_image(title, description, category, event_type, tone, contex
     )
     
     if len(base_prompt) > 3500:
-        base_prompt = PromptOptimizer.compress_prompt(base_prompt, 0.4)
+        base_prompt = PromptOptimizer.compress_prompt(base_prompt, IMAGE_PROMPT_TOKEN_BUDGET)[0]
     
     prompt = base_prompt
     
     start = time.time()
     
-    cache_key = cache._get_cache_key(prompt, image_size, cost_mode, "banner")
-    cached_result = cache.get(cache_key)
+    cache_key = cache.request_key("banner", title=title, description=description, category=category, event_type=event_type, tone=tone, context=context, cost_mode=cost_mode, image_size=image_size)
+    image_url = load_cached_image(cache_key, output)
     
-    if cached_result:
+    if image_url is not None:
         analytics.record_request(0, 0, time.time() - start, from_cache=True)
-        import base64
-        try:
-            image_url = base64.b64decode(cached_result)
-            print(f"Banner cache hit - decoded {len(image_url)} bytes")
-        except Exception as e:
-            image_url = cached_result  # if already bytes
-            print(f"Banner cache hit - using cached bytes: {len(image_url) if hasattr(image_url, '__len__') else 'N/A'}")
+        print(f"Banner cache hit - serving image blob ({output})")
     else:
         print("No banner cache hit - making API call")
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = client.images.generate(
-                    model="dall-e-3",
-                    prompt=prompt,
-                    n=1,
-                    size=image_size,
-                    quality="hd" if cost_mode=="premium" else "standard",
-                    response_format="b64_json"
-                )
-                image_b64 = response.data[0].b64_json
-                import base64
-                image_bytes = base64.b64decode(image_b64)
-                cache.set(cache_key, image_b64)
-                image_url = image_bytes
-                print(f"Banner API call successful - generated {len(image_url)} bytes")
-                
-                cost = 0.04 if cost_mode=="premium" else 0.02
-                analytics.record_request(cost, count_tokens(prompt), time.time() - start)
-                break
-            except Exception as e:
-                print(f"DALL-E Banner Error (attempt {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
-                    analytics.record_request(0, 0, time.time() - start, error=True)
-                    return b"", {"error": str(e), "Time taken (s)": round(time.time() - start, 2)}
-                time.sleep(2 ** attempt)
+        try:
+            (digest, filled_elsewhere), coalesced = yield _image_step(cache_key, prompt, image_size, cost_mode, "Banner", deadline=deadline)
+        except Exception as e:
+            analytics.record_request(0, 0, time.time() - start, error=True)
+            return b"", {"error": str(e), "Time taken (s)": round(time.time() - start, 2), "Deadline fallback": "no image" if isinstance(e, DeadlineExceeded) else None}
+        image_url = _image_output(digest, output)
+        if coalesced or filled_elsewhere:
+            analytics.record_request(0, 0, time.time() - start, from_cache=True)
+            analytics.metrics['coalesced_calls'] += 1
+            print(f"Banner coalesced with in-flight generation - serving image blob ({output})")
+        else:
+            print(f"Banner API call successful - stored image blob ({output})")
+            cost = 0.04 if cost_mode=="premium" else 0.02
+            analytics.record_request(cost, count_tokens(prompt), time.time() - start)
     
     end = time.time()
     
@@ -1186,17 +3696,211 @@ def generate_banner_image(title, description, category, event_type, tone, contex
     print(f"Returning banner image_url: type={type(image_url)}, length={len(image_url) if hasattr(image_url, '__len__') else 'N/A'}")
     return image_url, logs
 
+def generate_banner_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1792x1024", output="bytes", timeout=None):
+    return _run_steps(_banner_image_steps(title, description, category, event_type, tone, context, cost_mode, image_size, output, _deadline(timeout)))
+
+async def async_generate_banner_image(title, description, category, event_type, tone, context=None, cost_mode="balanced", image_size="1792x1024", output="bytes", timeout=None):
+    return await _run_steps_async(_banner_image_steps(title, description, category, event_type, tone, context, cost_mode, image_size, output, _deadline(timeout)))
+
+EVENT_PACKAGE_GRAPH = {
+    "titles": [],
+    "description": ["titles"],
+    "faqs": ["description"],
+    "refund_policy": ["description"],
+    "flyer": ["description"],
+    "banner": ["description"]
+}
+# Image stages are not started with less budget left than a DALL-E call usually takes.
+PACKAGE_IMAGE_MIN_SECONDS = 15
+
+def _run_package_stage(stage, inputs):
+    timeout = None if inputs["deadline"] is None else max(inputs["deadline"] - time.time(), 0)
+    if stage in ("flyer", "banner") and timeout is not None and timeout < PACKAGE_IMAGE_MIN_SECONDS:
+        return None, {"error": f"Skipped: {timeout:.0f}s of the time budget left, below typical image latency ({PACKAGE_IMAGE_MIN_SECONDS:.0f}s)"}
+    if stage == "titles":
+        return generate_titles(inputs["category"], inputs["event_type"], inputs["tone"], inputs["num_titles"], inputs["context"], inputs["cost_mode"], timeout=timeout)
+    if stage == "description":
+        return generate_description(inputs["title"], inputs["category"], inputs["event_type"], inputs["tone"], inputs["context"], inputs["max_chars"], inputs["cost_mode"], timeout=timeout)
+    if stage == "faqs":
+        return generate_faqs(inputs["title"], inputs["description"], inputs["category"], inputs["event_type"], inputs["tone"], inputs["context"], inputs["cost_mode"], timeout=timeout)
+    if stage == "refund_policy":
+        return generate_refund_policy(inputs["title"], inputs["description"], inputs["category"], inputs["event_type"], inputs["tone"], inputs["context"], inputs["cost_mode"], timeout=timeout)
+    if stage == "flyer":
+        return generate_flyer_image(inputs["title"], inputs["description"], inputs["category"], inputs["event_type"], inputs["tone"], inputs["context"], inputs["cost_mode"], inputs["flyer_size"], inputs["image_output"], timeout=timeout)
+    if stage == "banner":
+        return generate_banner_image(inputs["title"], inputs["description"], inputs["category"], inputs["event_type"], inputs["tone"], inputs["context"], inputs["cost_mode"], inputs["banner_size"], inputs["image_output"], timeout=timeout)
+    raise ValueError(f"Unknown package stage: {stage}")
+
+def _timed_package_stage(stage, inputs, package_start):
+    started = time.time()
+    try:
+        artifact, logs = _run_package_stage(stage, inputs)
+    except Exception as e:
+        artifact, logs = None, {"error": str(e)}
+    finished = time.time()
+    return artifact, logs, {"started": round(started - package_start, 2), "finished": round(finished - package_start, 2), "seconds": round(finished - started, 2)}
+
+def iter_event_package(category, event_type, tone, context=None, cost_mode="balanced", num_titles=3, max_chars=800, title=None, description=None, stages=None, graph=None, max_workers=4, flyer_size="1024x1792", banner_size="1792x1024", image_output="bytes", timeout=None):
+    graph = graph or EVENT_PACKAGE_GRAPH
+    stages = list(stages or graph)
+    
+    for stage in stages:
+        if stage not in graph:
+            raise ValueError(f"Unknown package stage: {stage}")
+    pending = set()
+    visiting = []
+    def visit(stage):
+        if stage in visiting:
+            raise ValueError(f"Package graph has a dependency cycle: {' -> '.join(visiting[visiting.index(stage):] + [stage])}")
+        if stage in pending:
+            return
+        visiting.append(stage)
+        for dep in graph[stage]:
+            if dep not in graph:
+                raise ValueError(f"Package stage {stage} depends on unknown stage: {dep}")
+            visit(dep)
+        visiting.pop()
+        pending.add(stage)
+    for stage in stages:
+        visit(stage)
+
+    inputs = {
+        "category": category, "event_type": event_type, "tone": tone, "context": context, "cost_mode": cost_mode,
+        "num_titles": num_titles, "max_chars": max_chars, "title": title, "description": description,
+        "flyer_size": flyer_size, "banner_size": banner_size, "image_output": image_output, "deadline": _deadline(timeout)
+    }
+    done = set()
+    if title:
+        pending.discard("titles")
+        done.add("titles")
+    if description:
+        pending.discard("description")
+        done.add("description")
+    failed = set()
+    package_start = time.time()
+    
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="event-package") as executor:
+        running = {}
+        while pending or running:
+            for stage in [s for s in pending if any(dep in failed for dep in graph[s])]:
+                pending.discard(stage)
+                failed.add(stage)
+                blocked_by = ", ".join(dep for dep in graph[stage] if dep in failed)
+                yield stage, None, {"error": f"Skipped: depends on failed stage {blocked_by}"}, None
+            
+            for stage in [s for s in pending if all(dep in done for dep in graph[s])]:
+                pending.discard(stage)
+                running[executor.submit(_timed_package_stage, stage, dict(inputs), package_start)] = stage
+            
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                artifact, logs, timing = future.result()
+                if not artifact or "error" in logs or "errors" in logs:
+                    failed.add(stage)
+                else:
+                    done.add(stage)
+                    if stage == "titles":
+                        inputs["title"] = artifact[0]
+                    elif stage == "description":
+                        inputs["description"] = artifact
+                yield stage, artifact, logs, timing
+
+def generate_event_package(category, event_type, tone, context=None, cost_mode="balanced", num_titles=3, max_chars=800, title=None, description=None, stages=None, graph=None, max_workers=4, flyer_size="1024x1792", banner_size="1792x1024", image_output="bytes", on_artifact=None, timeout=None):
+    start = time.time()
+    package = {}
+    stage_logs = {}
+    stage_timings = {}
+    failed = []
+    
+    for stage, artifact, logs, timing in iter_event_package(category, event_type, tone, context, cost_mode, num_titles, max_chars, title, description, stages, graph, max_workers, flyer_size, banner_size, image_output, timeout):
+        stage_logs[stage] = logs
+        if timing is not None:
+            stage_timings[stage] = timing
+        if artifact:
+            package[stage] = artifact
+        else:
+            failed.append(stage)
+        if on_artifact is not None:
+            on_artifact(stage, artifact, logs)
+    
+    sequential = sum(t["seconds"] for t in stage_timings.values())
+    elapsed = time.time() - start
+    logs = {
+        "Stage timings (s)": {stage: t["seconds"] for stage, t in stage_timings.items()},
+        "Stage schedule (s)": stage_timings,
+        "Time taken (s)": round(elapsed, 2),
+        "Sequential time (s)": round(sequential, 2),
+        "Parallel speedup": f"{sequential / elapsed:.2f}x" if elapsed > 0 else "N/A",
+        "Failed stages": failed,
+        "Deadline fallbacks": {stage: stage_log["Deadline fallback"] for stage, stage_log in stage_logs.items() if stage_log.get("Deadline fallback")},
+        "Stage logs": stage_logs
+    }
+    return package, logs
+
+PROMPT_CORPUS_EVENTS = [
+    ("Technology", "Conference", "Professional", "AI adoption in healthcare"),
+    ("Business", "Workshop", "Casual", None),
+    ("Education", "Seminar", "Innovative", "Hybrid classrooms for K-12 teachers"),
+    ("Arts & Culture", "Festival", "Creative", None),
+    ("Sports", "Meetup", "Friendly", "Weekend running clubs")
+]
+
+def prompt_corpus(cost_modes=("economy", "balanced", "premium")):
+    corpus = []
+    for category, event_type, tone, context in PROMPT_CORPUS_EVENTS:
+        title = f"{category} {event_type} Live"
+        description = f"Join us for {title}, a {tone.lower()} {category} {event_type.lower()} with practical sessions, expert speakers and time to connect with peers."
+        for cost_mode in cost_modes:
+            for generator, steps in (
+                ("titles", _titles_steps(category, event_type, tone, 3, context, cost_mode)),
+                ("description", _description_steps(title, category, event_type, tone, context, 800, cost_mode)),
+                ("faqs", _faqs_steps(title, description, category, event_type, tone, context, cost_mode)),
+                ("refund_policy", _refund_policy_steps(title, description, category, event_type, tone, context, cost_mode))
+            ):
+                try:
+                    kind, args, kwargs = next(steps)
+                except StopIteration:
+                    continue
+                finally:
+                    steps.close()
+                corpus.append({"generator": generator, "cost_mode": cost_mode, "event": (category, event_type, tone, context), "system": args[0], "user": args[1], "max_tokens": args[2], "temperature": args[3], "model": kwargs.get("model", "gpt-3.5-turbo"), "cache_params": kwargs.get("cache_params")})
+    return corpus
+
 def get_global_analytics():
     return {
         "total_requests": analytics.metrics['total_requests'],
         "cache_hits": analytics.metrics['cache_hits'],
         "cache_hit_rate": f"{(analytics.metrics['cache_hits'] / max(analytics.metrics['total_requests'], 1)) * 100:.1f}%",
+        "similarity_hits": analytics.metrics['similarity_hits'],
+        "coalesced_calls": analytics.metrics['coalesced_calls'],
+        "batched_requests": analytics.metrics['batched_requests'],
+        "deadline_exceeded": analytics.metrics['deadline_exceeded'],
+        "batching": batch_processor.snapshot() if batch_processor else None,
+        "http_connections": connection_stats.snapshot(),
+        "rate_limits": rate_limiter.snapshot(),
+        "hedging": hedge_policy.snapshot() if hedge_policy.percentile is not None else None,
+        "length_calibration": length_calibrator.snapshot(),
+        "prompt_prefixes": {
+            "static_prefix_tokens": analytics.metrics['static_prefix_tokens'],
+            "prefix_cache_eligible_tokens": analytics.metrics['prefix_cache_eligible_tokens'],
+            "cached_prompt_tokens": analytics.metrics['cached_prompt_tokens'],
+            "template_prefix_tokens": prompt_templates.snapshot()
+        },
+        "prompt_compression": PromptOptimizer.snapshot(),
+        "token_counts": dict(token_counter.snapshot(), api_usage_calls=analytics.metrics['api_usage_calls'], estimated_usage_calls=analytics.metrics['estimated_usage_calls']),
+        "retries": {"chat": dict(chat_retry.stats), "images": dict(image_retry.stats)},
+        "circuit_breakers": {"chat": chat_retry.breaker.snapshot(), "images": image_retry.breaker.snapshot()},
         "total_cost": f"${analytics.metrics['total_cost']:.4f}",
         "total_tokens": analytics.metrics['total_tokens'],
         "avg_response_time": f"{analytics.metrics['avg_response_time']:.2f}s",
         "error_rate": f"{analytics.metrics['error_rate'] * 100:.1f}%",
         "efficiency_score": f"{analytics.get_efficiency_score():.1f}%",
         "cost_savings": f"${(analytics.metrics['cache_hits'] * 0.002):.4f}",
+        "memory_cache": cache.memory_stats(),
+        "cache_sweep": cache_sweeper.last_report if cache_sweeper else None,
         "recommendations": get_optimization_recommendations()
     }
 
@@ -1223,6 +3927,9 @@ def get_optimization_recommendations():
     if analytics.metrics['total_tokens'] / max(analytics.metrics['total_requests'], 1) > 1500:
         recommendations.append("High token usage - use economy mode for 25% token reduction")
     
+    if token_counter.method == "heuristic" and analytics.metrics['estimated_usage_calls'] > 0:
+        recommendations.append("Token counts are heuristic estimates - install tiktoken and run `python tokenizer_service.py fetch` for exact counts")
+    
     if analytics.metrics['error_rate'] > 0.05:
         recommendations.append("Error rate detected - verify API key and network stability")
     
@@ -0,0 +1,101 @@
+from event_llm_core import iter_event_package, EVENT_PACKAGE_GRAPH
+import argparse
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Full Event Package Generation Service")
+    parser.add_argument('--category', required=True, help='Event category')
+    parser.add_argument('--event_type', required=True, help='Event type')
+    parser.add_argument('--tone', required=True, help='Tone of the event')
+    parser.add_argument('--context', required=False, default=None, help='Optional context')
+    parser.add_argument('--cost_mode', choices=['economy', 'balanced', 'premium'], default='balanced', help='Cost/quality mode')
+    parser.add_argument('--title', required=False, default=None, help='Existing event title (skips title generation)')
+    parser.add_argument('--description', required=False, default=None, help='Existing event description (skips description generation)')
+    parser.add_argument('--num_titles', type=int, default=3, help='Number of titles to generate (max 5)')
+    parser.add_argument('--max_chars', type=int, default=800, help='Maximum description length')
+    parser.add_argument('--stages', nargs='+', choices=list(EVENT_PACKAGE_GRAPH), default=list(EVENT_PACKAGE_GRAPH), help='Stages to generate (dependencies are added automatically)')
+    parser.add_argument('--max_workers', type=int, default=4, help='Maximum stages generated at the same time')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds for the whole package; stages still running when it is spent return partial or static fallbacks')
+
+    args = parser.parse_args()
+
+    errors = []
+    if not args.category or args.category.strip() == "":
+        errors.append("Category is required")
+    if not args.event_type or args.event_type.strip() == "":
+        errors.append("Event type is required")
+    if not args.tone or args.tone.strip() == "":
+        errors.append("Tone is required")
+    if args.max_workers < 1:
+        errors.append("max_workers must be at least 1")
+
+    if errors:
+        print("[Package Service] Validation Errors:")
+        for error in errors:
+            print(f"  • {error}")
+        exit(1)
+
+    num_titles = max(1, min(args.num_titles, 5))
+
+    print(f"[Package Service] Generating stages: {', '.join(args.stages)}")
+    print(f"[Package Service] Category: {args.category}")
+    print(f"[Package Service] Event Type: {args.event_type}")
+    print(f"[Package Service] Tone: {args.tone}")
+    print(f"[Package Service] Context: {args.context}")
+    print(f"[Package Service] Cost Mode: {args.cost_mode}")
+    print(f"[Package Service] Max Workers: {args.max_workers}")
+    print("-" * 50)
+
+    start = time.time()
+    timings = {}
+    failed = []
+    for stage, artifact, logs, timing in iter_event_package(
+        args.category,
+        args.event_type,
+        args.tone,
+        args.context,
+        args.cost_mode,
+        num_titles,
+        args.max_chars,
+        args.title,
+        args.description,
+        args.stages,
+        max_workers=args.max_workers,
+        image_output="path",
+        timeout=args.timeout
+    ):
+        if timing is not None:
+            timings[stage] = timing
+        if not artifact:
+            failed.append(stage)
+            print(f"[Package Service] {stage} FAILED: {logs.get('error') or '; '.join(logs.get('errors', [])) or 'no result'}")
+            continue
+        print(f"[Package Service] {stage} ready after {timing['finished']}s ({timing['seconds']}s):")
+        if logs.get("Deadline fallback"):
+            print(f"  (time budget exhausted - {logs['Deadline fallback']})")
+        if stage == "titles":
+            for i, title in enumerate(artifact, 1):
+                print(f"  {i}. {title}")
+        elif stage == "faqs":
+            for faq in artifact:
+                print(f"  Q: {faq['question']}")
+                print(f"  A: {faq['answer']}")
+        elif stage in ("flyer", "banner"):
+            print(f"  Image Path: {artifact}")
+        else:
+            print(f"  {artifact}")
+
+    elapsed = time.time() - start
+    sequential = sum(t["seconds"] for t in timings.values())
+    print("-" * 50)
+    print("[Package Service] Stage Timings:")
+    for stage, timing in timings.items():
+        print(f"  {stage}: {timing['seconds']}s (started {timing['started']}s, finished {timing['finished']}s)")
+    print(f"  Total time: {elapsed:.2f}s")
+    print(f"  Sequential time: {sequential:.2f}s")
+    if failed:
+        print(f"[Package Service] Failed stages: {', '.join(failed)}")
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ def main():
     parser.add_argument('--tone', required=True, help='Tone of the event')
     parser.add_argument('--context', required=False, default=None, help='Optional context')
     parser.add_argument('--cost_mode', choices=['economy', 'balanced', 'premium'], default='balanced', help='Cost/quality mode')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds; once spent the best partial result or a static fallback is returned')
     
     args = parser.parse_args()
     
@@ -48,7 +49,8 @@ def main():
         args.event_type,
         args.tone,
         args.context,
-        args.cost_mode
+        args.cost_mode,
+        timeout=args.timeout
     )
     
     print("[FAQ Service] Generation Logs:")
@@ -12,6 +12,7 @@ def main():
     parser.add_argument('--context', required=False, default=None, help='Optional context')
     parser.add_argument('--cost_mode', choices=['economy', 'balanced', 'premium'], default='balanced', help='Cost/quality mode')
     parser.add_argument('--image_size', default=None, help='Image size (auto-selected based on visual type if not specified)')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds; the image call is abandoned once it is spent')
     
     args = parser.parse_args()
     
@@ -59,7 +60,9 @@ def main():
             args.tone,
             args.context,
             args.cost_mode,
-            args.image_size
+            args.image_size,
+            output="path",
+            timeout=args.timeout
         )
     else:
         image_url, logs = generate_banner_image(
@@ -70,13 +73,15 @@ def main():
             args.tone,
             args.context,
             args.cost_mode,
-            args.image_size
+            args.image_size,
+            output="path",
+            timeout=args.timeout
         )
     
     print(f"[Flyer/Banner Service] Generation Logs:")
     for k, v in logs.items():
         print(f"  {k}: {v}")
-    print(f"[Flyer/Banner Service] Generated {args.visual_type.title()} Image URL:")
+    print(f"[Flyer/Banner Service] Generated {args.visual_type.title()} Image Path:")
     print(f"  {image_url}")
 
 if __name__ == "__main__":
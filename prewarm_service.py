@@ -0,0 +1,148 @@
+from event_llm_core import generate_titles, generate_description, suggest_optimal_settings, get_global_analytics, enable_batching, CATEGORY_OPTIONS, EVENT_TYPE_OPTIONS, TONE_OPTIONS
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import json
+import os
+import threading
+import time
+
+COST_MODES = ["balanced", "economy", "premium"]
+
+def build_grid(categories, event_types, tones, cost_modes):
+    return [
+        (category, event_type, tone, cost_mode)
+        for cost_mode in cost_modes
+        for category in categories
+        for event_type in event_types
+        for tone in tones
+    ]
+
+def task_id(task):
+    return "|".join(task)
+
+def load_journal(journal_path):
+    done = set()
+    if os.path.exists(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("status") == "done":
+                    done.add(entry["task"])
+    return done
+
+def warm_combination(task, default_titles, default_chars, descriptions):
+    category, event_type, tone, cost_mode = task
+    optimal = suggest_optimal_settings(category, event_type)
+    start = time.time()
+    title_calls = 0
+    description_calls = 0
+
+    for num_titles in sorted({default_titles, optimal["titles"]}):
+        titles, logs = generate_titles(category, event_type, tone, num_titles, None, cost_mode)
+        title_calls += 1
+        if "errors" in logs:
+            raise ValueError("; ".join(logs["errors"]))
+        selected = titles if descriptions == "all" else titles[:1] if descriptions == "first" else []
+        for title in selected:
+            for max_chars in sorted({default_chars, optimal["desc_length"]}):
+                _, desc_logs = generate_description(title, category, event_type, tone, None, max_chars, cost_mode)
+                description_calls += 1
+                if "error" in desc_logs:
+                    raise RuntimeError(desc_logs["error"])
+
+    return {"titles": title_calls, "descriptions": description_calls, "seconds": round(time.time() - start, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache Pre-warm Service")
+    parser.add_argument('--cost_modes', nargs='+', choices=COST_MODES, default=["balanced"], help='Cost modes to pre-warm')
+    parser.add_argument('--categories', nargs='+', default=CATEGORY_OPTIONS[1:-1], help='Categories to pre-warm (defaults to every app category)')
+    parser.add_argument('--event_types', nargs='+', default=EVENT_TYPE_OPTIONS[1:-1], help='Event types to pre-warm (defaults to every app event type)')
+    parser.add_argument('--tones', nargs='+', default=TONE_OPTIONS[1:-1], help='Tones to pre-warm (defaults to every app tone)')
+    parser.add_argument('--num_titles', type=int, default=3, help='Title count to pre-warm in addition to the suggested count (app default: 3)')
+    parser.add_argument('--max_chars', type=int, default=800, help='Description length to pre-warm in addition to the suggested length (app default: 800)')
+    parser.add_argument('--descriptions', choices=['none', 'first', 'all'], default='first', help='Which generated titles get a pre-warmed description')
+    parser.add_argument('--concurrency', type=int, default=4, help='Maximum combinations generated at the same time')
+    parser.add_argument('--batch_window_ms', type=float, default=0, help='Pack title requests arriving within this window into one completion (0 disables batching)')
+    parser.add_argument('--batch_size', type=int, default=8, help='Maximum title requests packed into one batched completion')
+    parser.add_argument('--journal', default='prewarm_journal.jsonl', help='Checkpoint journal used to resume an interrupted run')
+
+    args = parser.parse_args()
+
+    errors = []
+    if not 1 <= args.num_titles <= 5:
+        errors.append("num_titles must be between 1 and 5")
+    if not 100 <= args.max_chars <= 5000:
+        errors.append("max_chars must be between 100 and 5000")
+    if args.concurrency < 1:
+        errors.append("concurrency must be at least 1")
+    if args.batch_window_ms < 0:
+        errors.append("batch_window_ms must not be negative")
+    if args.batch_size < 2:
+        errors.append("batch_size must be at least 2")
+
+    if errors:
+        print("[Prewarm Service] Validation Errors:")
+        for error in errors:
+            print(f"  • {error}")
+        exit(1)
+
+    if args.batch_window_ms:
+        enable_batching(args.batch_window_ms, args.batch_size)
+
+    grid = build_grid(args.categories, args.event_types, args.tones, args.cost_modes)
+    done = load_journal(args.journal)
+    pending = [task for task in grid if task_id(task) not in done]
+
+    print(f"[Prewarm Service] Grid size: {len(grid)} combinations")
+    print(f"[Prewarm Service] Already warmed (journal): {len(grid) - len(pending)}")
+    print(f"[Prewarm Service] Pending: {len(pending)}")
+    print(f"[Prewarm Service] Cost modes: {', '.join(args.cost_modes)}")
+    print(f"[Prewarm Service] Concurrency: {args.concurrency}")
+    print(f"[Prewarm Service] Title batching: {f'{args.batch_window_ms}ms window, up to {args.batch_size} per completion' if args.batch_window_ms else 'off'}")
+    print("-" * 50)
+
+    journal_lock = threading.Lock()
+    completed = len(grid) - len(pending)
+    failed = 0
+    start = time.time()
+
+    with open(args.journal, 'a') as journal, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {
+            executor.submit(warm_combination, task, args.num_titles, args.max_chars, args.descriptions): task
+            for task in pending
+        }
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                result = future.result()
+                entry = {"task": task_id(task), "status": "done", **result}
+                completed += 1
+                status = f"{result['titles']} title calls, {result['descriptions']} description calls, {result['seconds']}s"
+            except Exception as e:
+                entry = {"task": task_id(task), "status": "failed", "error": str(e)}
+                failed += 1
+                status = f"FAILED: {e}"
+            with journal_lock:
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+            print(f"[Prewarm Service] {completed}/{len(grid)} ({completed / len(grid) * 100:.1f}%) {' / '.join(task)} - {status}")
+
+    analytics = get_global_analytics()
+    print("-" * 50)
+    print("[Prewarm Service] Coverage Report:")
+    print(f"  Combinations warmed: {completed}/{len(grid)} ({completed / max(len(grid), 1) * 100:.1f}%)")
+    print(f"  Failed this run: {failed}")
+    print(f"  Requests this run: {analytics['total_requests']}")
+    print(f"  Already cached: {analytics['cache_hit_rate']}")
+    if analytics['batching']:
+        print(f"  Batched title requests: {analytics['batched_requests']} in {analytics['batching']['batches']} completions")
+    print(f"  Cost this run: {analytics['total_cost']}")
+    print(f"  Elapsed: {time.time() - start:.1f}s")
+    if failed:
+        print("[Prewarm Service] Re-run the same command to retry failed combinations.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+from event_llm_core import PromptOptimizer, prompt_templates, prompt_corpus, count_prompt_tokens
+import argparse
+import re
+import time
+
+def optimize(prompt):
+    system, _ = prompt_templates.optimize(prompt["system"], prompt["cost_mode"])
+    return system, PromptOptimizer.optimize_for_cost(prompt["user"], prompt["cost_mode"])
+
+def integrity(original, compressed):
+    if compressed == original:
+        return [], [], []
+    words = set(re.findall(r"\w+", original.lower()))
+    broken = [word for word in re.findall(r"\w+", compressed.lower()) if word not in words]
+    kept = PromptOptimizer._normalize(compressed)
+    dropped = [unit['text'] for unit in PromptOptimizer._units(original) if unit['critical'] and unit['text'] and not unit['header'] and PromptOptimizer._normalize(unit['text']) not in kept]
+    sentences = [sentence for line in original.split("\n") for sentence in PromptOptimizer.SENTENCE_PATTERN.split(line.strip())]
+    constraints = [sentence for sentence in sentences if PromptOptimizer.is_constraint(PromptOptimizer._strip_filler(sentence)) and PromptOptimizer._normalize(PromptOptimizer._strip_filler(sentence)) not in kept]
+    return broken, dropped, constraints
+
+def run_benchmark(args):
+    corpus = prompt_corpus(tuple(args.cost_modes))
+
+    print(f"[Prompt Service] Compressing {len(corpus)} prompts from the title, description, FAQ and refund policy generators")
+    print(f"[Prompt Service] Cost modes: {', '.join(args.cost_modes)}")
+    print("-" * 50)
+
+    groups = {}
+    broken_words = []
+    dropped_critical = []
+    dropped_constraints = []
+    for prompt in corpus:
+        system, user = optimize(prompt)
+        group = groups.setdefault(prompt["cost_mode"], {})
+        before, after = group.get(prompt["generator"], (0, 0))
+        group[prompt["generator"]] = (before + count_prompt_tokens(prompt["system"], prompt["user"]), after + count_prompt_tokens(system, user))
+        for original, compressed in ((prompt["system"], system), (prompt["user"], user)):
+            broken, dropped, constraints = integrity(original, compressed)
+            broken_words += broken
+            dropped_critical += [f"{prompt['generator']} ({prompt['cost_mode']}): {text}" for text in dropped]
+            dropped_constraints += [f"{prompt['generator']} ({prompt['cost_mode']}): {text}" for text in constraints]
+
+    print("[Prompt Service] Prompt tokens before -> after:")
+    for cost_mode, group in groups.items():
+        for generator, (before, after) in group.items():
+            print(f"  {generator} ({cost_mode}): {before} -> {after} ({(before - after) / before * 100:.1f}% saved)")
+
+    texts = [prompt["system"] for prompt in corpus] + [prompt["user"] for prompt in corpus]
+    start = time.perf_counter()
+    for text in texts:
+        PromptOptimizer._render(PromptOptimizer._units(text))
+    cold_us = (time.perf_counter() - start) / len(texts) * 1e6
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for text in texts:
+            PromptOptimizer.compress_prompt(text)
+    memo_us = (time.perf_counter() - start) / (args.iterations * len(texts)) * 1e6
+
+    print("-" * 50)
+    print("[Prompt Service] Benchmark Report:")
+    for cost_mode, group in groups.items():
+        before = sum(tokens[0] for tokens in group.values())
+        after = sum(tokens[1] for tokens in group.values())
+        print(f"  {cost_mode}: {before} -> {after} tokens ({before - after} saved, {(before - after) / before * 100:.1f}%)")
+    print(f"  broken words: {len(broken_words)}")
+    print(f"  critical lines dropped: {len(dropped_critical)}")
+    for entry in dropped_critical[:10]:
+        print(f"  • {entry}")
+    print(f"  format constraints dropped: {len(dropped_constraints)}")
+    for entry in dropped_constraints[:10]:
+        print(f"  • {entry}")
+    print(f"  compression per prompt (uncached): {cold_us:.1f}us")
+    print(f"  compression per prompt (memoized): {memo_us:.1f}us")
+    if broken_words or dropped_critical or dropped_constraints:
+        exit(1)
+
+def run_show(args):
+    for prompt in prompt_corpus((args.cost_mode,)):
+        if prompt["generator"] != args.generator:
+            continue
+        system, user = optimize(prompt)
+        print(f"[Prompt Service] {args.generator} ({args.cost_mode}): {count_prompt_tokens(prompt['system'], prompt['user'])} -> {count_prompt_tokens(system, user)} tokens")
+        print("-" * 50)
+        print(system)
+        print("-" * 50)
+        print(user)
+        constraints = integrity(prompt["system"], system)[2] + integrity(prompt["user"], user)[2]
+        if constraints:
+            print("-" * 50)
+            print("[Prompt Service] Format constraints dropped:")
+            for text in constraints:
+                print(f"  • {text}")
+            exit(1)
+        return
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt Compression Service")
+    parser.add_argument('command', choices=['benchmark', 'show'], help='benchmark reports tokens saved per cost mode over the real prompt corpus; show prints one compressed prompt')
+    parser.add_argument('--cost_modes', nargs='+', choices=['economy', 'balanced', 'premium'], default=['economy', 'balanced', 'premium'], help='Cost modes whose prompts are benchmarked')
+    parser.add_argument('--iterations', type=int, default=50, help='Timing passes over the prompt corpus for the memoized path')
+    parser.add_argument('--generator', choices=['titles', 'description', 'faqs', 'refund_policy'], default='titles', help='Generator whose prompt show prints')
+    parser.add_argument('--cost_mode', choices=['economy', 'balanced', 'premium'], default='balanced', help='Cost mode whose prompt show prints')
+
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        run_benchmark(args)
+    else:
+        run_show(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError", "TimeoutException", "TransportError"}
+FATAL_ERROR_NAMES = {"AuthenticationError", "PermissionDeniedError", "BadRequestError", "NotFoundError", "UnprocessableEntityError"}
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, message="Time budget exhausted", partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open after repeated provider errors - retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_retryable(error):
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & FATAL_ERROR_NAMES:
+        return False
+    if names & RETRYABLE_ERROR_NAMES:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(float(headers["retry-after-ms"]) / 1000, 0)
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+class CircuitBreaker:
+    def __init__(self, name, error_rate=0.5, min_calls=10, window_seconds=60, cooldown_seconds=30):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.lock = threading.Lock()
+        self.outcomes = deque()
+        self.state = "closed"
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.stats = {'opened': 0, 'short_circuited': 0}
+
+    def _trim(self, now):
+        while self.outcomes and self.outcomes[0][0] < now - self.window_seconds:
+            self.outcomes.popleft()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.cooldown_seconds - time.time()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return
+            self.stats['short_circuited'] += 1
+            raise CircuitOpenError(self.name, max(remaining, 0))
+
+    def record(self, success):
+        now = time.time()
+        with self.lock:
+            if self.state == "half_open":
+                self.probe_in_flight = False
+                if success:
+                    self.state = "closed"
+                    self.outcomes.clear()
+                else:
+                    self.state = "open"
+                    self.opened_at = now
+                    self.stats['opened'] += 1
+                return
+            self.outcomes.append((now, success))
+            self._trim(now)
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            if self.state == "closed" and len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.error_rate:
+                self.state = "open"
+                self.opened_at = now
+                self.stats['opened'] += 1
+                print(f"[Circuit Breaker] {self.name} opened: {failures}/{len(self.outcomes)} calls failed in the last {self.window_seconds}s, cooling down for {self.cooldown_seconds}s")
+
+    def release_probe(self):
+        with self.lock:
+            if self.state == "half_open":
+                self.probe_in_flight = False
+
+    def snapshot(self):
+        with self.lock:
+            self._trim(time.time())
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            return {
+                'state': self.state,
+                'window_calls': len(self.outcomes),
+                'window_error_rate': f"{failures / max(len(self.outcomes), 1) * 100:.1f}%",
+                **self.stats
+            }
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'fatal_errors': 0, 'exhausted': 0, 'deadline_exceeded': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def delay(self, attempt, error):
+        hinted = retry_after(error)
+        if hinted is not None:
+            return min(hinted, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _failed(self, attempt, error, can_retry, deadline):
+        retryable = is_retryable(error)
+        if self.breaker is not None:
+            if retryable:
+                self.breaker.record(False)
+            else:
+                self.breaker.release_probe()
+        if isinstance(error, DeadlineExceeded):
+            self._count('deadline_exceeded')
+            return None
+        if not retryable:
+            self._count('fatal_errors')
+            return None
+        if attempt == self.max_attempts - 1 or (can_retry is not None and not can_retry()):
+            self._count('exhausted')
+            return None
+        wait_seconds = self.delay(attempt, error)
+        if deadline is not None and time.time() + wait_seconds >= deadline:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"Time budget exhausted after {attempt + 1} attempts: {error}") from error
+        self._count('retries')
+        return wait_seconds
+
+    def call(self, fn, on_retry=None, can_retry=None, deadline=None):
+        self._count('calls')
+        for attempt in range(self.max_attempts):
+            if deadline is not None and time.time() >= deadline:
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded()
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                wait_seconds = self._failed(attempt, e, can_retry, deadline)
+                if wait_seconds is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e, wait_seconds)
+                time.sleep(wait_seconds)
+                continue
+            except BaseException:
+                if self.breaker is not None:
+                    self.breaker.release_probe()
+                raise
+            if self.breaker is not None:
+                self.breaker.record(True)
+            return result
+
+    async def call_async(self, coro_fn, on_retry=None, can_retry=None, deadline=None):
+        self._count('calls')
+        for attempt in range(self.max_attempts):
+            if deadline is not None and time.time() >= deadline:
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded()
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = await coro_fn()
+            except Exception as e:
+                wait_seconds = self._failed(attempt, e, can_retry, deadline)
+                if wait_seconds is None:
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e, wait_seconds)
+                await asyncio.sleep(wait_seconds)
+                continue
+            except BaseException:
+                if self.breaker is not None:
+                    self.breaker.release_probe()
+                raise
+            if self.breaker is not None:
+                self.breaker.record(True)
+            return result
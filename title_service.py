@@ -1,4 +1,4 @@
-from event_llm_core import generate_titles
+from event_llm_core import generate_titles, TITLE_OUTPUT_MODES
 import argparse
 
 def main():
@@ -8,6 +8,8 @@ def main():
     parser.add_argument('--tone', required=True, help='Tone of the event')
     parser.add_argument('--num_titles', type=int, default=3, help='Number of titles to generate (max 5)')
     parser.add_argument('--context', required=False, default=None, help='Optional context')
+    parser.add_argument('--output_mode', choices=list(TITLE_OUTPUT_MODES), default=None, help='json: schema-constrained JSON with spare titles; candidates: several completions in one call; text: free-form parsing with top-up calls (default: TITLE_OUTPUT_MODE or json)')
+    parser.add_argument('--timeout', type=float, default=None, help='Time budget in seconds; once spent the best partial result or a static fallback is returned')
     
     args = parser.parse_args()
     
@@ -34,7 +36,7 @@ def main():
     print(f"[Title Service] Context: {args.context}")
     print("-" * 50)
     
-    titles, logs = generate_titles(args.category, args.event_type, args.tone, num_titles, args.context)
+    titles, logs = generate_titles(args.category, args.event_type, args.tone, num_titles, args.context, timeout=args.timeout, output_mode=args.output_mode)
     
     print("[Title Service] Generation Logs:")
     for k, v in logs.items():
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+    from tiktoken.load import load_tiktoken_bpe
+except ImportError:
+    tiktoken = None
+
+CL100K_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+CL100K_SHA256 = "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+CL100K_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+CL100K_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276
+}
+
+# Chat format overhead: every message is wrapped in <|im_start|>{role}\n ... <|im_end|>\n
+# and the reply is primed with <|im_start|>assistant\n.
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+def heuristic_count(text):
+    return max(len(text.split()), int(len(text) / 3.5))
+
+def load_bpe_encoding(bpe_file):
+    if tiktoken is None:
+        print("[Tokenizer] WARNING: tiktoken is not installed - token counts are heuristic estimates (pip install -r requirements.txt, then run `python tokenizer_service.py fetch`)")
+        return None
+    if not os.path.exists(bpe_file):
+        print(f"[Tokenizer] WARNING: BPE file {bpe_file} not found - token counts are heuristic estimates (run `python tokenizer_service.py fetch` once to install it)")
+        return None
+    try:
+        return tiktoken.Encoding(
+            name="cl100k_base",
+            pat_str=CL100K_PATTERN,
+            mergeable_ranks=load_tiktoken_bpe(bpe_file, expected_hash=CL100K_SHA256),
+            special_tokens=CL100K_SPECIAL_TOKENS
+        )
+    except Exception as e:
+        print(f"[Tokenizer] WARNING: could not load {bpe_file} ({e}) - token counts are heuristic estimates (run `python tokenizer_service.py fetch` to reinstall it)")
+        return None
+
+def install_bpe_file(bpe_file, http_client):
+    response = http_client.get(CL100K_URL)
+    response.raise_for_status()
+    digest = hashlib.sha256(response.content).hexdigest()
+    if digest != CL100K_SHA256:
+        raise ValueError(f"Downloaded BPE file hash {digest} does not match {CL100K_SHA256}")
+    os.makedirs(os.path.dirname(os.path.abspath(bpe_file)), exist_ok=True)
+    tmp_path = f"{bpe_file}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(response.content)
+    os.replace(tmp_path, bpe_file)
+    return len(response.content)
+
+class TokenCounter:
+    def __init__(self, encoding=None, memo_size=4096):
+        self.encoding = encoding
+        self.method = "bpe" if encoding is not None else "heuristic"
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def _encode_count(self, text):
+        if self.encoding is None:
+            return heuristic_count(text)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def count(self, text):
+        if not text:
+            return 0
+        with self.lock:
+            tokens = self.memo.get(text)
+            if tokens is not None:
+                self.memo.move_to_end(text)
+                self.stats['hits'] += 1
+                return tokens
+            self.stats['misses'] += 1
+        tokens = self._encode_count(text)
+        with self.lock:
+            self.memo[text] = tokens
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        return tokens
+
+    def count_messages(self, *contents):
+        return sum(self.count(content) + TOKENS_PER_MESSAGE for content in contents) + TOKENS_PER_REPLY
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'method': self.method,
+                'memo_entries': len(self.memo),
+                'memo_hit_rate': f"{self.stats['hits'] / max(lookups, 1) * 100:.1f}%",
+                **self.stats
+            }
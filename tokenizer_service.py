@@ -0,0 +1,96 @@
+from event_llm_core import token_counter, prompt_corpus, estimate_cost, create_http_client, TOKENIZER_BPE_FILE
+from tokenizer import TokenCounter, install_bpe_file
+import argparse
+import time
+
+def run_fetch(args):
+    bpe_file = args.bpe_file or TOKENIZER_BPE_FILE
+    print(f"[Tokenizer Service] Downloading cl100k_base BPE ranks to {bpe_file}")
+    http_client = create_http_client()
+    try:
+        size = install_bpe_file(bpe_file, http_client)
+    except Exception as e:
+        print(f"[Tokenizer Service] Download failed: {e}")
+        exit(1)
+    finally:
+        http_client.close()
+    print(f"[Tokenizer Service] Installed {size / 1024 / 1024:.1f} MB - token counts use the BPE tokenizer from the next start, with no network access needed")
+
+def per_call_us(counter, corpus, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for prompt in corpus:
+            counter.count_messages(prompt["system"], prompt["user"])
+    return (time.perf_counter() - start) / (iterations * len(corpus)) * 1e6
+
+def run_benchmark(args):
+    if token_counter.encoding is None:
+        print("[Tokenizer Service] Validation Errors:")
+        print("  • BPE tokenizer not available - install tiktoken and run `python tokenizer_service.py fetch` first")
+        exit(1)
+
+    corpus = prompt_corpus(tuple(args.cost_modes))
+    heuristic = TokenCounter(None, memo_size=0)
+    bpe = TokenCounter(token_counter.encoding, memo_size=0)
+
+    print(f"[Tokenizer Service] Benchmarking {len(corpus)} prompts from the title, description, FAQ and refund policy generators")
+    print(f"[Tokenizer Service] Cost modes: {', '.join(args.cost_modes)}")
+    print("-" * 50)
+
+    groups = {}
+    for prompt in corpus:
+        exact = bpe.count_messages(prompt["system"], prompt["user"])
+        estimate = heuristic.count_messages(prompt["system"], prompt["user"])
+        group = groups.setdefault((prompt["generator"], prompt["cost_mode"]), {"exact": 0, "estimate": 0, "quota_exact": 0.0, "quota_estimate": 0.0, "errors": []})
+        group["exact"] += exact
+        group["estimate"] += estimate
+        group["quota_exact"] += estimate_cost(exact, prompt["max_tokens"], prompt["model"])
+        group["quota_estimate"] += estimate_cost(estimate, prompt["max_tokens"], prompt["model"])
+        group["errors"].append((estimate - exact) / exact * 100)
+
+    print("[Tokenizer Service] Prompt tokens (BPE vs heuristic):")
+    for (generator, cost_mode), group in groups.items():
+        mean_error = sum(group["errors"]) / len(group["errors"])
+        print(f"  {generator} ({cost_mode}): {group['exact']} vs {group['estimate']} tokens, heuristic error {mean_error:+.1f}%")
+
+    errors = [error for group in groups.values() for error in group["errors"]]
+    total_exact = sum(group["exact"] for group in groups.values())
+    total_estimate = sum(group["estimate"] for group in groups.values())
+    quota_exact = sum(group["quota_exact"] for group in groups.values())
+    quota_estimate = sum(group["quota_estimate"] for group in groups.values())
+
+    memo = TokenCounter(token_counter.encoding, memo_size=4096)
+    per_call_us(memo, corpus, 1)
+    heuristic_us = per_call_us(heuristic, corpus, args.iterations)
+    bpe_us = per_call_us(bpe, corpus, args.iterations)
+    memo_us = per_call_us(memo, corpus, args.iterations)
+
+    print("-" * 50)
+    print("[Tokenizer Service] Benchmark Report:")
+    print(f"  prompts: {len(corpus)}")
+    print(f"  total prompt tokens (BPE): {total_exact}")
+    print(f"  total prompt tokens (heuristic): {total_estimate} ({(total_estimate - total_exact) / total_exact * 100:+.1f}%)")
+    print(f"  heuristic mean absolute error: {sum(abs(error) for error in errors) / len(errors):.1f}%")
+    print(f"  heuristic worst error: {max(errors, key=abs):+.1f}%")
+    print(f"  quota cost at max_tokens (BPE): ${quota_exact:.4f}")
+    print(f"  quota cost at max_tokens (heuristic): ${quota_estimate:.4f}")
+    print(f"  heuristic per call: {heuristic_us:.1f}us")
+    print(f"  BPE per call (uncached): {bpe_us:.1f}us")
+    print(f"  BPE per call (memoized): {memo_us:.1f}us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer Service")
+    parser.add_argument('command', choices=['fetch', 'benchmark'], help='fetch installs the BPE file for offline use; benchmark compares BPE and heuristic token counts')
+    parser.add_argument('--bpe_file', default=None, help='Where fetch writes the BPE file (defaults to TOKENIZER_BPE_FILE)')
+    parser.add_argument('--cost_modes', nargs='+', choices=['economy', 'balanced', 'premium'], default=['economy', 'balanced', 'premium'], help='Cost modes whose prompts are benchmarked')
+    parser.add_argument('--iterations', type=int, default=50, help='Timing passes over the prompt corpus')
+
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        run_fetch(args)
+    else:
+        run_benchmark(args)
+
+if __name__ == "__main__":
+    main()